@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""Drive a bot script with synthetic Discord traffic against the mock API.
+
+Imports ``code.py`` or ``chat31.py`` in a scratch directory (fresh
+``memory.db`` and blob store), points it at ``bench/mock_flazu.py`` through
+``FLAZU_API_BASE``, and calls its ``on_message`` / ``cmd_chat`` /
+``slash_chat`` handlers with fake users, channels, attachments and
+interactions at a target rate (Poisson arrivals). Nothing talks to Discord:
+sends and typing only sleep for ``--discord-latency``.
+
+    python bench/discord_driver.py code.py --rate 20 --duration 30
+    python bench/discord_driver.py chat31.py --rate 10 --images 0.2 --out runs.jsonl
+
+Reports throughput, end-to-end latency percentiles, event-loop lag, RSS and
+conversation store I/O; ``--out`` appends the same numbers as one JSON line
+so runs can be compared.
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+BOT_ID = 999000000000000001
+PROMPTS = [
+    "explain how asyncio tasks work", "write a python function that merges two sorted lists",
+    "what is the difference between a list and a tuple", "summarize the plot of hamlet in three sentences",
+    "give me a bash one-liner to count lines in all .py files", "how do discord rate limits work",
+    "translate 'good morning' to french, spanish and german", "what does this error mean: KeyError 'id'",
+]
+FAILURE_MARKERS = ("Flazu API error", "Unexpected error", "took too long", "An error occurred",
+                   "Error during send", "overloaded", "Usage limit")
+_ids = itertools.count(1)
+
+
+# --- fake Discord objects ---
+class FakeUser:
+    def __init__(self, uid, name=None):
+        self.id = uid
+        self.name = name or f"user{uid}"
+        self.bot = False
+        self.mention = f"<@{uid}>"
+
+    def mentioned_in(self, message):
+        return any(m.id == self.id for m in message.mentions)
+
+
+class FakeGuild:
+    def __init__(self, gid):
+        self.id = gid
+
+
+class FakeSent:
+    def __init__(self, channel, content):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+        self.content = content
+        if content and any(marker in content for marker in FAILURE_MARKERS):
+            self.channel.failures += 1  # Streamed replies end with an edit of the placeholder
+
+
+class FakeChannel:
+    def __init__(self, cid, latency):
+        self.id = cid
+        self.latency = latency
+        self.sent = 0
+        self.failures = 0
+
+    async def send(self, content=None, files=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        if content and any(marker in content for marker in FAILURE_MARKERS):
+            self.failures += 1
+        return FakeSent(self, content)
+
+    async def typing(self):
+        await asyncio.sleep(self.latency)
+
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.id = next(_ids)
+        self.url = url
+        self.filename = url.rsplit("/", 1)[-1]
+        self.size = None
+        self.content_type = "image/png"
+
+
+class FakeMessage:
+    def __init__(self, author, channel, guild, content, mentions=(), attachments=()):
+        self.id = next(_ids)
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.content = content
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+
+
+class FakeContext:
+    def __init__(self, message):
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.guild = message.guild
+        self.send = message.channel.send
+
+
+class FakeResponse:
+    async def defer(self, **kwargs):
+        pass
+
+
+class FakeFollowup:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content=None, files=None, wait=False, **kwargs):
+        return await self.channel.send(content=content, files=files)
+
+
+class FakeInteraction:
+    def __init__(self, user, channel, guild):
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = guild
+        self.message = None
+        self.response = FakeResponse()
+        self.followup = FakeFollowup(channel)
+
+
+# --- measurement helpers ---
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def rss_mb():
+    """(current, peak) resident set size in MiB."""
+    current = peak = 0.0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return round(current, 1), round(peak, 1)
+
+
+def io_counters():
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+
+def store_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+async def sample_lag(samples, interval=0.05):
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(time.monotonic() - started - interval)
+
+
+# --- mock server ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(extra_args):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(BENCH, "mock_flazu.py"), "--port", str(port)]
+                            + shlex.split(extra_args))
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{base}/stats", timeout=1).read()
+            return proc, base
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("[ERROR] Mock Flazu server did not start.")
+
+
+def load_bot(script):
+    spec = importlib.util.spec_from_file_location("bench_bot", os.path.join(ROOT, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    bot_user = FakeUser(BOT_ID, "flazu")
+    module.bot._connection.user = bot_user
+
+    async def no_commands(message):
+        pass
+
+    module.bot.process_commands = no_commands
+    return module, bot_user
+
+
+def handlers(module):
+    found = {"on_message": None}
+    if hasattr(module, "cmd_chat"):
+        found["cmd_chat"] = None
+    if hasattr(module, "slash_chat"):
+        found["slash_chat"] = None
+    return found
+
+
+# --- the run ---
+async def drive(module, bot_user, opts, mix, api_base):
+    rng = random.Random(opts.seed)
+    users = [FakeUser(100000 + i) for i in range(opts.users)]
+    guilds = [FakeGuild(500000 + i) for i in range(max(1, opts.guilds))]
+    channels = [FakeChannel(700000 + i, opts.discord_latency) for i in range(opts.channels)]
+    kinds, weights = zip(*mix.items())
+    latencies, lag = [], []
+    counts = {kind: 0 for kind in kinds}
+    errors = 0
+
+    background = [asyncio.create_task(module.store.run_flusher()),
+                  asyncio.create_task(module.memory.run_sweeper()),
+                  asyncio.create_task(sample_lag(lag))]
+    if hasattr(module, "meter"):
+        background.append(asyncio.create_task(module.meter.run_flusher()))
+    await module.catalog.refresh()
+
+    async def one(kind):
+        nonlocal errors
+        user, channel = rng.choice(users), rng.choice(channels)
+        guild = guilds[channel.id % len(guilds)]
+        prompt = rng.choice(PROMPTS)
+        started = time.perf_counter()
+        try:
+            if kind == "on_message":
+                attachments = []
+                if rng.random() < opts.images:
+                    attachments.append(FakeAttachment(f"{api_base}/files/img-{next(_ids)}.png"))
+                message = FakeMessage(user, channel, guild, f"{bot_user.mention} {prompt}", [bot_user], attachments)
+                await module.on_message(message)
+            elif kind == "cmd_chat":
+                message = FakeMessage(user, channel, guild, f"!chat {prompt}")
+                await module.cmd_chat.callback(FakeContext(message), user_message=prompt)
+            else:
+                await module.slash_chat.callback(FakeInteraction(user, channel, guild), prompt)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors += 1
+            print(f"[WARN] {kind} raised {type(e).__name__}: {e}")
+
+    io_before = io_counters()
+    db_before = store_bytes(module.MEMORY_DB)
+    began = time.perf_counter()
+    tasks = []
+    next_at = began
+    while time.perf_counter() - began < opts.duration:
+        next_at += rng.expovariate(opts.rate)
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        kind = rng.choices(kinds, weights)[0]
+        counts[kind] += 1
+        tasks.append(asyncio.create_task(one(kind)))
+    dispatched = time.perf_counter() - began
+    _, pending = await asyncio.wait(tasks, timeout=opts.drain) if tasks else (None, [])
+    elapsed = time.perf_counter() - began
+    for task in pending:
+        task.cancel()
+    for task in background:
+        task.cancel()
+    await asyncio.to_thread(module.store.flush)
+    io_after = io_counters()
+    current, peak = rss_mb()
+    with urllib.request.urlopen(f"{api_base}/stats", timeout=5) as resp:
+        upstream = json.loads(resp.read())
+    failures = sum(c.failures for c in channels)
+    return {
+        "bot": opts.script, "ts": round(time.time()), "rate": opts.rate, "duration": round(dispatched, 1),
+        "requests": sum(counts.values()), "by_handler": counts,
+        "completed": len(latencies), "unfinished": len(pending), "raised": errors, "error_replies": failures,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_p50": round(pct(latencies, 0.50), 3), "latency_p99": round(pct(latencies, 0.99), 3),
+        "latency_max": round(max(latencies, default=0.0), 3),
+        "loop_lag_p50_ms": round(1000 * pct(lag, 0.50), 2), "loop_lag_p99_ms": round(1000 * pct(lag, 0.99), 2),
+        "loop_lag_max_ms": round(1000 * max(lag, default=0.0), 2),
+        "rss_mb": current, "peak_rss_mb": peak,
+        "store_bytes": store_bytes(module.MEMORY_DB), "store_growth_bytes": store_bytes(module.MEMORY_DB) - db_before,
+        "io_write_bytes": io_after.get("write_bytes", 0) - io_before.get("write_bytes", 0),
+        "io_read_bytes": io_after.get("read_bytes", 0) - io_before.get("read_bytes", 0),
+        "discord_sends": sum(c.sent for c in channels), "upstream": upstream,
+    }
+
+
+def report(result):
+    print(f"\n{result['bot']}: {result['requests']} requests over {result['duration']}s "
+          f"at {result['rate']}/s {result['by_handler']}")
+    print(f"  completed {result['completed']} ({result['throughput_rps']}/s), unfinished {result['unfinished']}, "
+          f"raised {result['raised']}, error replies {result['error_replies']}")
+    print(f"  latency p50 {result['latency_p50']}s  p99 {result['latency_p99']}s  max {result['latency_max']}s")
+    print(f"  loop lag p50 {result['loop_lag_p50_ms']}ms  p99 {result['loop_lag_p99_ms']}ms  "
+          f"max {result['loop_lag_max_ms']}ms")
+    print(f"  rss {result['rss_mb']} MiB (peak {result['peak_rss_mb']} MiB)")
+    print(f"  store {result['store_bytes']} bytes (+{result['store_growth_bytes']}), "
+          f"disk writes {result['io_write_bytes']} bytes")
+    print(f"  discord sends {result['discord_sends']}, upstream {result['upstream']}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Synthetic Discord load against a bot script and the mock API.")
+    p.add_argument("script", choices=["code.py", "chat31.py"])
+    p.add_argument("--rate", type=float, default=10.0, help="requests per second")
+    p.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    p.add_argument("--drain", type=float, default=60.0, help="seconds to wait for in-flight requests")
+    p.add_argument("--mix", default="", help="handler weights, e.g. on_message=3,cmd_chat=1")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--channels", type=int, default=20)
+    p.add_argument("--guilds", type=int, default=5)
+    p.add_argument("--images", type=float, default=0.0, help="fraction of on_message requests with an image")
+    p.add_argument("--discord-latency", type=float, default=0.05, help="simulated seconds per Discord call")
+    p.add_argument("--api-base", default="", help="use an already running mock (e.g. http://127.0.0.1:8808)")
+    p.add_argument("--mock-args", default="", help="extra arguments for mock_flazu.py")
+    p.add_argument("--out", default="", help="append the result as a JSON line to this file")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--keep", action="store_true", help="keep the scratch directory (memory.db, blobs)")
+    opts = p.parse_args(argv)
+
+    proc = None
+    if opts.api_base:
+        api_base = opts.api_base.rstrip("/")
+    else:
+        proc, api_base = start_mock(opts.mock_args)
+    out = os.path.abspath(opts.out) if opts.out else ""
+    workdir = tempfile.mkdtemp(prefix="flazu-bench-")
+    os.environ.update(FLAZU_API_BASE=f"{api_base}/v1", DISCORD_TOKEN="bench", FLAZU_API_KEY="bench")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        module, bot_user = load_bot(opts.script)
+        available = handlers(module)
+        mix = {}
+        for item in filter(None, opts.mix.split(",")):
+            name, _, weight = item.partition("=")
+            if name.strip() in available:
+                mix[name.strip()] = float(weight or 1)
+        mix = mix or {kind: (2.0 if kind == "on_message" else 1.0) for kind in available}
+
+        async def run():
+            try:
+                return await drive(module, bot_user, opts, mix, api_base)
+            finally:
+                await module.client.close_session()
+
+        result = asyncio.run(run())
+        module.store.close()
+        if hasattr(module, "meter"):
+            module.meter.close()
+        report(result)
+        if out:
+            with open(out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        os.chdir(ROOT)
+        if opts.keep:
+            print(f"[INFO] Scratch directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Splitting replies into text and code attachments: old regexes vs flazu.fences.
+
+Builds large synthetic replies (prose paragraphs interleaved with fenced code
+blocks) and times the two-regex ``extract_code_blocks`` the bots used to
+carry against the single-pass parser, both on the complete reply and fed in
+small streaming-sized deltas.
+
+    python bench/fence_split.py [reply_kb] [repeats]
+"""
+import io
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flazu.fences import FenceParser, extract_code_blocks  # noqa: E402
+
+WORDS = "the model returns some code and then explains what each part of it does".split()
+
+
+def regex_extract(reply):
+    code_blocks = re.findall(r'```(\w+)?\n(.*?)\n```', reply, re.DOTALL)
+    non_code_parts = re.split(r'```(?:\w+)?\n.*?\n```', reply, flags=re.DOTALL)
+    message_text = "\n".join(part.strip() for part in non_code_parts if part.strip())
+    return message_text, [(f"code.{lang}", io.StringIO(code.strip())) for lang, code in code_blocks]
+
+
+def make_reply(rng, size):
+    parts = []
+    total = 0
+    while total < size:
+        if rng.random() < 0.4:
+            lines = [f"    value_{i} = compute({i}, `{i}`)  # step {i}" for i in range(rng.randint(5, 80))]
+            part = f"```{rng.choice(['python', 'js', 'rust', 'bash'])}\n" + "\n".join(lines) + "\n```\n"
+        else:
+            part = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))) + "\n\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def streamed(reply, step=24):
+    parser = FenceParser()
+    out = []
+    for i in range(0, len(reply), step):
+        out += parser.feed(reply[i:i + step])
+    return out + parser.close()
+
+
+def timed(fn, reply, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn(reply)
+    return (time.perf_counter() - started) / repeats
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 256 * 1024
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    reply = make_reply(random.Random(7), size)
+    old_text, old_files = regex_extract(reply)
+    new_text, new_files = extract_code_blocks(reply)
+    assert len(old_files) == len(new_files), (len(old_files), len(new_files))
+    print(f"{len(reply) / 1024:.0f} KiB reply, {len(new_files)} code blocks, {repeats} repeats:")
+    for name, fn in (("regex (findall + split)", regex_extract),
+                     ("fences, whole reply", extract_code_blocks),
+                     ("fences, 24-char deltas", streamed)):
+        seconds = timed(fn, reply, repeats)
+        print(f"  {name:24} {1000 * seconds:8.2f} ms  {len(reply) / seconds / 1e6:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Bytes per stored turn: plain dict messages vs flazu.messages.
+
+Builds the same synthetic histories (chat31-style user turns with a text part
+and sometimes an image ref, plain-string assistant replies) in both shapes
+and measures the Python heap they take with tracemalloc.
+
+    python bench/message_memory.py [users] [turns]
+"""
+import copy
+import hashlib
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flazu.messages import from_dict  # noqa: E402
+
+WORDS = ("the quick brown fox jumps over a lazy dog while python code runs "
+         "fast and discord users ask about models images and tokens").split()
+
+
+def sentence(rng, lo, hi):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(lo, hi)))
+
+
+def dict_history(rng, turns):
+    history = [{"role": "system", "content": "You are a helpful, concise and friendly AI assistant with vision capabilities."}]
+    for i in range(turns):
+        parts = [{"type": "text", "text": sentence(rng, 4, 30)}]
+        if rng.random() < 0.1:
+            digest = hashlib.sha256(f"{i}-{rng.random()}".encode()).hexdigest()
+            parts.append({"type": "image_ref", "image_ref": {"sha256": digest, "mime": "image/webp"}})
+        history.append({"role": "user", "content": parts})
+        history.append({"role": "assistant", "content": sentence(rng, 20, 120)})
+    return history
+
+
+def build(users, turns, compact):
+    rng = random.Random(42)
+    # Strings are built outside the measured section so both shapes share them
+    # the way a real process shares text decoded from the store.
+    raw = [dict_history(rng, turns) for _ in range(users)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if compact:
+        kept = [[from_dict(m) for m in history] for history in raw]
+    else:
+        kept = copy.deepcopy(raw)  # new containers, same str objects
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+    messages = users * (1 + 2 * turns)
+    plain = build(users, turns, compact=False)
+    compact = build(users, turns, compact=True)
+    print(f"{users} users x {turns} turns ({messages} messages), text shared, overhead only:")
+    print(f"  dict messages:    {plain / messages:8.1f} bytes/message  {plain / (users * turns):8.1f} bytes/turn")
+    print(f"  slotted messages: {compact / messages:8.1f} bytes/message  {compact / (users * turns):8.1f} bytes/turn")
+    print(f"  saved: {100 * (1 - compact / plain):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Flazu API, for load tests.
+
+Serves ``/v1/chat/completions`` (plain JSON, or SSE when the body asks for
+``stream``), ``/v1/models`` and ``/v1/images/generations`` with configurable
+latency and error injection, plus ``/files/<name>.png`` (a small real PNG,
+used as attachment and generated-image URLs) and ``/stats`` (request counts).
+
+    python bench/mock_flazu.py [--port 8808] [--latency 0.4] [--error-rate 0.01]
+
+Point a bot at it with ``FLAZU_API_BASE=http://127.0.0.1:8808/v1``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import zlib
+
+from aiohttp import web
+
+WORDS = ("sure here is a short answer about python discord bots models tokens and "
+         "images that should be long enough to look like a real reply").split()
+MODELS = [
+    {"id": "gpt-5.1", "context_length": 400000, "architecture": {"input_modalities": ["text", "image"]}},
+    {"id": "gpt-5", "context_length": 400000, "architecture": {"input_modalities": ["text", "image"]}},
+    {"id": "gpt-4o-mini", "context_length": 128000, "architecture": {"input_modalities": ["text", "image"]}},
+    {"id": "deepseek-chat", "context_length": 64000},
+    {"id": "dall-e-3", "architecture": {"output_modalities": ["image"]}},
+]
+
+
+def png(width=64, height=64, seed=0):
+    """A valid RGB PNG of random pixels."""
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+class MockFlazu:
+    def __init__(self, opts):
+        self.opts = opts
+        self.rng = random.Random(opts.seed)
+        self.image = png(opts.image_size, opts.image_size)
+        self.stats = {"chat": 0, "stream": 0, "models": 0, "images": 0, "files": 0, "errors": 0, "rate_limited": 0}
+        self.started = time.time()
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/images/generations", self.images)
+        app.router.add_get("/files/{name}", self.files)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    async def _delay(self):
+        delay = self.opts.latency + self.rng.uniform(0, self.opts.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _fault(self):
+        """An error response to inject, or None."""
+        roll = self.rng.random()
+        if roll < self.opts.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return web.json_response({"error": {"message": "rate limited"}}, status=429, headers={"Retry-After": "1"})
+        if roll < self.opts.rate_limit_rate + self.opts.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "injected failure"}}, status=self.rng.choice([500, 502, 503]))
+        return None
+
+    def _reply(self):
+        words = self.rng.randint(self.opts.reply_words // 2, self.opts.reply_words * 3 // 2)
+        text = " ".join(self.rng.choice(WORDS) for _ in range(words))
+        if self.rng.random() < self.opts.code_rate:
+            lines = "\n".join(f"    total += item_{i} * {i}" for i in range(self.rng.randint(5, 40)))
+            text += f"\n\n```python\ndef compute(items):\n    total = 0\n{lines}\n    return total\n```\n\nThat should do it."
+        return text
+
+    async def chat(self, request):
+        raw = await request.read()
+        body = json.loads(raw)
+        await self._delay()
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        text = self._reply()
+        usage = {"prompt_tokens": len(raw) // 4, "completion_tokens": len(text) // 4,
+                 "total_tokens": len(raw) // 4 + len(text) // 4}
+        model = body.get("model", "gpt-5.1")
+        if not body.get("stream"):
+            self.stats["chat"] += 1
+            return web.json_response({"id": "chatcmpl-mock", "object": "chat.completion", "model": model,
+                                      "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                                   "finish_reason": "stop"}],
+                                      "usage": usage})
+        self.stats["stream"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+        pieces = [text[i:i + self.opts.chunk_chars] for i in range(0, len(text), self.opts.chunk_chars)]
+        for piece in pieces:
+            event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}}]}
+            await resp.write(b"data: " + json.dumps(event).encode() + b"\n\n")
+            if self.opts.chunk_interval > 0:
+                await asyncio.sleep(self.opts.chunk_interval)
+        final = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        await resp.write(b"data: " + json.dumps(final).encode() + b"\n\ndata: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def models(self, request):
+        self.stats["models"] += 1
+        return web.json_response({"object": "list", "data": MODELS})
+
+    async def images(self, request):
+        body = await request.json()
+        await asyncio.sleep(self.opts.image_latency)
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        self.stats["images"] += 1
+        base = f"{request.scheme}://{request.host}"
+        n = max(1, int(body.get("n", 1)))
+        return web.json_response({"created": int(time.time()),
+                                  "data": [{"url": f"{base}/files/gen-{self.rng.getrandbits(48):x}.png"} for _ in range(n)]})
+
+    async def files(self, request):
+        self.stats["files"] += 1
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats, uptime=round(time.time() - self.started, 1)))
+
+
+def parser():
+    p = argparse.ArgumentParser(description="Mock Flazu API for load tests.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8808)
+    p.add_argument("--latency", type=float, default=0.4, help="seconds before the first byte")
+    p.add_argument("--jitter", type=float, default=0.2, help="extra random latency, up to this many seconds")
+    p.add_argument("--chunk-chars", type=int, default=24, help="characters per streamed chunk")
+    p.add_argument("--chunk-interval", type=float, default=0.01, help="seconds between streamed chunks")
+    p.add_argument("--reply-words", type=int, default=120)
+    p.add_argument("--code-rate", type=float, default=0.2, help="fraction of replies with a code block")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    p.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    p.add_argument("--image-latency", type=float, default=2.0)
+    p.add_argument("--image-size", type=int, default=256, help="PNG edge in pixels")
+    p.add_argument("--seed", type=int, default=1)
+    return p
+
+
+def main(argv=None):
+    opts = parser().parse_args(argv)
+    print(f"[INFO] Mock Flazu API on http://{opts.host}:{opts.port}/v1")
+    web.run_app(MockFlazu(opts).app(), host=opts.host, port=opts.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
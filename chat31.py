@@ -1,26 +1,41 @@
 #!/usr/bin/env python3
 import os
-import requests
 import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 import json
+import time
 import traceback
-import io
 import re
-import base64
-from collections import defaultdict
-import time
+from flazu import client, config, encode, metrics, shards, streaming, tokens
+from flazu.blobs import BlobStore, digests_in
+from flazu.cache import ResponseCache
+from flazu.catalog import ModelCatalog
+from flazu.fences import extract_code_blocks
+from flazu.imagegen import ImageGenerator
+from flazu.imageprep import ImagePreprocessor
+from flazu.indicator import TypingManager
+from flazu.ingest import ImageIngestor
+from flazu.messages import Message, Text
+from flazu.outbox import Outbox
+from flazu.resilience import Upstream
+from flazu.router import ModelRouter
+from flazu.scheduler import Overloaded, RequestScheduler
+from flazu.store import ConversationStore
+from flazu.summarize import Summarizer
+from flazu.usage import QuotaExceeded, UsageMeter
+from flazu.watchdog import Watchdog
+from flazu.workingset import WorkingSet
 
 # Load environment variables
 load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 FLAZU_API_KEY = ("sk-pro-f1ae98fb-6b4b-4c70-a94e-5ba8e-5ba8aa6d95ba")
-FLAZU_API_URL = "https://ai.flazu.my/v1/chat/completions"
-FLAZU_MODELS_URL = "https://ai.flazu.my/v1/models"
-FLAZU_IMAGES_URL = "https://ai.flazu.my/v1/images/generations"
+FLAZU_API_URL = f"{config.API_BASE}/chat/completions"
+FLAZU_MODELS_URL = f"{config.API_BASE}/models"
+FLAZU_IMAGES_URL = f"{config.API_BASE}/images/generations"
 
 if not DISCORD_TOKEN or not FLAZU_API_KEY:
     print("ERROR: DISCORD_TOKEN or FLAZU_API_KEY missing in .env")
@@ -31,232 +46,265 @@ intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
 intents.guilds = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = shards.make_bot(intents, command_prefix="!")
 
 # Global variables
-MEMORY_FILE = "memory.json"
-MODEL_FILE = "global_model.json"
-memory = {}
-available_models = []
-global_model = "gpt-5.1"  # Default global model
-
-# Typing system
-typing_queue = defaultdict(asyncio.Semaphore)
-typing_last = defaultdict(float)
-TYPING_COOLDOWN = 5.0
-
-async def safe_typing(channel):
-    semaphore = typing_queue[channel.id]
-    async with semaphore:
-        now = time.time()
-        last = typing_last[channel.id]
-        if now - last < TYPING_COOLDOWN:
-            await asyncio.sleep(TYPING_COOLDOWN - (now - last))
-        try:
-            async with channel.typing():
-                typing_last[channel.id] = time.time()
-                await asyncio.sleep(1)
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = e.response.headers.get("Retry-After", 5)
-                print(f"[RATE LIMITED] Typing blocked, retry in {retry_after}s")
-                await asyncio.sleep(float(retry_after))
+MEMORY_FILE = "memory.json"  # Legacy format, migrated into MEMORY_DB on first start
+MEMORY_DB = "memory.db"
+MODEL_FILE = "global_model.json"  # Legacy format, migrated into MEMORY_DB on first start
+DEFAULT_MODEL = "gpt-5.1"  # Default global model
+SYSTEM_PROMPT = "You are a helpful, concise and friendly AI assistant with vision capabilities."
+SYSTEM_MESSAGE = Message("system", SYSTEM_PROMPT)  # Shared by every new history
+
+# Typing system (runs in the background while requests are in flight)
+typing_indicator = TypingManager()
+
+# Outbound messages: per-channel queues that split long replies and respect rate limits
+outbox = Outbox()
+
+# Event-loop stall detector (opt-in with FLAZU_WATCHDOG_STALL)
+watchdog = Watchdog()
 
 # Memory management
-def load_memory():
-    global memory
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                loaded = json.load(f)
-                temp_memory = {int(k): v for k, v in loaded.items()}
-            for uid, data in temp_memory.items():
-                if isinstance(data, list):
-                    temp_memory[uid] = {"history": data}
-                # Remove per-user model, use global
-            memory = temp_memory
-            print("[INFO] Memory loaded successfully.")
-        except Exception as e:
-            print(f"[WARN] Unable to load memory.json: {str(e)}. Initializing new memory.")
-            memory = {}
-    else:
-        print("[INFO] No memory.json file found.")
-        memory = {}
+store = ConversationStore(MEMORY_DB)
+blobs = BlobStore()
+
+def upgrade_memory_entry(data):
+    if isinstance(data, list):
+        return {"history": data}
+    # Remove per-user model, use global
+    return {"history": data.get("history", [])}
+
+def on_memory_load(uid, data):
+    # Older histories carry inline base64 images; move them to the blob store once
+    if blobs.externalize(data["history"]):
+        store.replace(uid, data["history"])
 
-def save_memory():
+def on_memory_evict(uid):
+    context_budget.forget(uid)
+    summarizer.forget(uid)
+
+# Conversations are loaded on first use and dropped again when idle (with their token ledgers and summary backoff)
+memory = WorkingSet(store, on_load=on_memory_load, shared=shards.sharded(),
+                   on_evict=on_memory_evict)
+
+def load_memory():
     try:
-        json_memory = {str(k): v for k, v in memory.items()}
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(json_memory, f, indent=2)
+        store.migrate_json(MEMORY_FILE, upgrade_memory_entry)
     except Exception as e:
-        print(f"[ERROR] Unable to save memory.json: {str(e)}")
+        print(f"[WARN] Unable to migrate memory.json: {str(e)}. Keeping it untouched.")
 
-# Global model management
+def cached_images():
+    """Blobs this process's caches hold; published so every process's collector keeps them."""
+    return images.digests() | ingestor.digests()
+
+def referenced_images():
+    store.flush()
+    return digests_in(store.scan('"image_ref"')) | cached_images()
+
+def remember(user_id, *messages):
+    """Record new turns for user_id in memory and queue them for the store."""
+    memory[user_id]["history"].extend(messages)
+    store.append(user_id, *messages)
+
+# Global model management (kept in the store so every shard process sees changes)
 def load_global_model():
-    global global_model
-    if os.path.exists(MODEL_FILE):
+    if store.setting("global_model") is None and os.path.exists(MODEL_FILE):
         try:
             with open(MODEL_FILE, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                global_model = data.get("model", "gpt-5.1")
-            print(f"[INFO] Global model loaded: {global_model}")
+            store.set_setting("global_model", data.get("model", DEFAULT_MODEL))
+            os.replace(MODEL_FILE, MODEL_FILE + ".migrated")
         except Exception as e:
-            print(f"[WARN] Unable to load global_model.json: {str(e)}. Using default 'gpt-5.1'.")
-    else:
-        print("[INFO] No global_model.json found. Using default 'gpt-5.1'.")
+            print(f"[WARN] Unable to migrate global_model.json: {str(e)}. Keeping it untouched.")
+    print(f"[INFO] Global model loaded: {get_global_model()}")
 
-def save_global_model():
+def get_global_model():
+    return store.setting("global_model", DEFAULT_MODEL)
+
+def save_global_model(model):
     try:
-        with open(MODEL_FILE, "w", encoding="utf-8") as f:
-            json.dump({"model": global_model}, f, indent=2)
+        store.set_setting("global_model", model)
     except Exception as e:
-        print(f"[ERROR] Unable to save global_model.json: {str(e)}")
+        print(f"[ERROR] Unable to save global model: {str(e)}")
 
 load_memory()
 load_global_model()
 
+# Token, image and latency metering per user, guild and model (with optional quotas)
+meter = UsageMeter(MEMORY_DB, shared=shards.sharded())
+meter.load()
+
 # Image handling
+image_prep = None
+if config.IMAGE_PREP:
+    if ImagePreprocessor.available():
+        image_prep = ImagePreprocessor(blobs)
+    else:
+        print("[WARN] FLAZU_IMAGE_PREP is on but Pillow is not installed; sending images unmodified.")
+ingestor = ImageIngestor(blobs, prep=image_prep)
+
 async def get_image_base64_from_message(message: discord.Message):
-    images = []
-    # Attachments
-    for attachment in message.attachments:
-        if attachment.content_type and attachment.content_type.startswith("image/"):
-            try:
-                data = await attachment.read()
-                b64 = base64.b64encode(data).decode('utf-8')
-                images.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{attachment.content_type};base64,{b64}"
-                    }
-                })
-            except Exception as e:
-                print(f"[ERROR] Failed to read attachment {attachment.filename}: {e}")
-    # Image URLs in content
-    url_pattern = r"https?://[^\s]+?\.(png|jpe?g|gif|webp)(\?[^\s]*)?"
-    urls = re.findall(url_pattern, message.content, re.IGNORECASE)
-    for url in set(urls):
-        try:
-            resp = requests.get(url, timeout=15)
-            if resp.status_code == 200 and "image" in resp.headers.get("Content-Type", ""):
-                b64 = base64.b64encode(resp.content).decode('utf-8')
-                mime = resp.headers.get("Content-Type", "image/png")
-                images.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime};base64,{b64}"
-                    }
-                })
-        except Exception as e:
-            print(f"[ERROR] Failed to download image {url}: {e}")
-    return images
+    """Image parts (blob refs) for every attachment and image URL in message."""
+    return await ingestor.ingest(message)
 
 # Sanitize messages
-def sanitize_messages(msgs, max_chars=12000):
-    out = []
-    total = 0
-    for m in reversed(msgs):
-        content = m.get("content", "")
-        if isinstance(content, list):
-            est_len = sum(1000 if c["type"] == "image_url" else len(c.get("text","")) for c in content)
-        else:
-            est_len = len(str(content))
-        if total + est_len > max_chars:
-            break
-        out.append(m)
-        total += est_len
-    return list(reversed(out))
-
-# Get models
-def get_available_models():
-    headers = {"Authorization": f"Bearer {FLAZU_API_KEY}"}
-    try:
-        resp = requests.get(FLAZU_MODELS_URL, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        return [m['id'] for m in data.get('data', [])]
-    except Exception as e:
-        print(f"[ERROR] Unable to retrieve models: {str(e)}")
-        return []
+context_budget = tokens.ContextBudget()
+
+def sanitize_messages(user_id, msgs, model, max_tokens=None):
+    return context_budget.select(user_id, msgs, model, max_tokens=max_tokens)
+
+# Encoded JSON of stored messages, reused across requests
+fragment_cache = encode.FragmentCache()
+
+response_cache = ResponseCache()
+upstream = Upstream(FLAZU_API_URL)
+router = ModelRouter(upstream)
+summarizer = Summarizer(store, context_budget, memory.peek, FLAZU_API_URL, FLAZU_API_KEY, upstream, meter)
+
+# Model catalog (warm from disk, refreshed in the background)
+catalog = ModelCatalog(FLAZU_MODELS_URL, FLAZU_API_KEY)
+catalog.load()
 
 # Main AI call (use global model)
-async def ask_flazu(user_id: int, user_prompt: str, message: discord.Message = None) -> str:
+async def ask_flazu(user_id: int, user_prompt: str, message: discord.Message = None, on_delta=None,
+                    stateless=False, cacheable=False, guild_id=None) -> str:
     try:
         user_id = int(user_id)
     except Exception:
         return "Internal error: invalid user_id."
-    if user_id not in memory:
-        memory[user_id] = {
-            "history": [{"role": "system", "content": "You are a helpful, concise and friendly AI assistant with vision capabilities."}]
-        }
+    if not stateless:
+        await memory.ensure(user_id)
+    if not stateless and user_id not in memory:
+        memory[user_id] = {"history": []}
+        remember(user_id, SYSTEM_MESSAGE)
     image_contents = []
     if message:
-        image_contents = await get_image_base64_from_message(message)
+        with metrics.span("ingest"):
+            image_contents = await get_image_base64_from_message(message)
     text_prompt = user_prompt.strip()
     if not text_prompt and image_contents:
         text_prompt = "Describe this image in detail."
-    user_content = [{"type": "text", "text": text_prompt}]
-    user_content.extend(image_contents)
-    memory[user_id]["history"].append({"role": "user", "content": user_content})
-    model_to_use = global_model
-    if image_contents and model_to_use not in ["gpt-5.1", "gpt-4o", "gpt-4-turbo"]:
-        model_to_use = "gpt-5.1"  # Force vision model if needed
-    msgs = sanitize_messages(memory[user_id]["history"])
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {FLAZU_API_KEY}"}
-    data = {"model": model_to_use, "messages": msgs, "max_tokens": 2000}
+    user_message = Message("user", [Text(text_prompt), *image_contents])
+    model_to_use = get_global_model()
+    if image_contents and not catalog.supports_vision(model_to_use):
+        model_to_use = catalog.vision_model()  # Force vision model if needed
+    metrics.tag(model=model_to_use)
+    if stateless:
+        window = [SYSTEM_MESSAGE, user_message]
+    else:
+        remember(user_id, user_message)
+        with metrics.span("sanitize"):
+            window = sanitize_messages(user_id, memory[user_id]["history"], model_to_use, max_tokens=2000)
+
+    spent = {}  # Filled in when the answer really came from upstream (not the cache)
+
+    async def fetch():
+        with metrics.span("encode"):
+            fragments = await asyncio.to_thread(fragment_cache.encode, window, blobs.image_part, config.IMAGE_HISTORY_TURNS)
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {FLAZU_API_KEY}"}
+
+        async def attempt(model, claim):
+            data = encode.Body(fragments, model=model, max_tokens=2000)
+            if on_delta is not None:
+                def delta(text):
+                    if claim():
+                        on_delta(text)
+                reply = await streaming.stream_completion(FLAZU_API_URL, data, headers=headers, on_delta=delta, timeout=120,
+                                                          on_usage=lambda block: spent.update(usage=block)) or "No response."
+            else:
+                j = await client.post_json(FLAZU_API_URL, data, headers=headers, timeout=120)
+                spent["usage"] = j.get("usage")
+                reply = j.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
+            spent["model"] = model
+            return reply
+        started = time.perf_counter()
+        with metrics.span("upstream"):
+            reply = await router.call(model_to_use, attempt)
+        spent["latency"] = time.perf_counter() - started
+        return reply
+
     try:
-        resp = requests.post(FLAZU_API_URL, headers=headers, json=data, timeout=120)
-        resp.raise_for_status()
-        j = resp.json()
-        reply = j.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
+        if cacheable:
+            # Image parts are still blob refs here, so the key hashes digests, not megabytes of base64
+            key = response_cache.key(model_to_use, window, {"max_tokens": 2000})
+            reply = await response_cache.get_or_fetch(key, fetch)
+        else:
+            reply = await fetch()
         if not isinstance(reply, str):
             reply = str(reply)
-        memory[user_id]["history"].append({"role": "assistant", "content": reply})
-        if len(memory[user_id]["history"]) > 50:
-            memory[user_id]["history"] = memory[user_id]["history"][-50:]
-        save_memory()
+        if "latency" in spent:
+            meter.record_reply(user_id, guild_id, spent["model"], spent.get("usage"), window, reply, spent["latency"])
+        if stateless:
+            return reply
+        with metrics.span("save_memory"):
+            remember(user_id, Message("assistant", reply))
+            if len(memory[user_id]["history"]) > 50:
+                memory[user_id]["history"] = memory[user_id]["history"][-50:]
+                store.trim(user_id, 50)
+        summarizer.maybe_schedule(user_id, memory[user_id], model_to_use, guild_id)
         return reply
-    except requests.exceptions.Timeout:
+    except client.Timeout as e:
+        metrics.error(e)
         return "The Flazu API took too long to respond."
-    except requests.exceptions.RequestException as e:
+    except client.RequestError as e:
+        metrics.error(e)
         return f"Flazu API error: {str(e)}"
     except Exception as e:
+        metrics.error(e)
         traceback.print_exc()
         return f"Unexpected error: {str(e)}"
 
-# Generate image
-def generate_image(prompt: str, model="dall-e-3", size="1024x1024", n=1) -> str:
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {FLAZU_API_KEY}"}
-    data = {"prompt": prompt, "model": model, "n": n, "size": size}
+# Scheduled AI call: one request per user at a time, fair across users and guilds
+scheduler = RequestScheduler()
+
+async def scheduled_ask(author, guild, channel, prompt, **kwargs) -> str:
+    async def notify(position):
+        await outbox.send(channel, f"{author.mention} Queued, position {position}.")
+    guild_id = guild.id if guild else None
+    queued = time.perf_counter()
+    try:
+        meter.check(author.id, guild_id)
+        async with scheduler.slot(author.id, guild_id, on_queued=notify):
+            metrics.record("queue", time.perf_counter() - queued)
+            async with typing_indicator.typing(channel):
+                return await ask_flazu(author.id, prompt, guild_id=guild_id, **kwargs)
+    except QuotaExceeded as e:
+        metrics.error(e)
+        return f"Usage limit reached: {e}."
+    except Overloaded as e:
+        metrics.error(e)
+        return "The bot is overloaded right now, please try again in a minute."
+
+# Image generation: background jobs whose results are kept as local blobs and re-uploaded for repeated prompts
+images = ImageGenerator(FLAZU_IMAGES_URL, FLAZU_API_KEY, upstream, blobs)
+
+async def generate_images(author, guild, channel, prompt, n=1):
+    """Run an image job; returns the reply text and ``[(filename, file object), ...]``."""
+    async def notify(position):
+        await outbox.send(channel, f"{author.mention} Image queued, position {position}.")
     try:
-        resp = requests.post(FLAZU_IMAGES_URL, headers=headers, json=data, timeout=60)
-        resp.raise_for_status()
-        j = resp.json()
-        return j['data'][0]['url'] if j.get('data') else None
+        async with typing_indicator.typing(channel):
+            result = await images.generate(prompt, n, on_queued=notify)
+        files = await images.attachments(result.refs)
+    except Overloaded:
+        return "Too many images are being generated right now, please try again in a minute.", []
     except Exception as e:
         print(f"Image generation error: {e}")
-        return None
-
-# Extract code blocks
-def extract_code_blocks(reply):
-    code_blocks = re.findall(r'```(\w+)?\n(.*?)\n```', reply, re.DOTALL)
-    non_code_parts = re.split(r'```(?:\w+)?\n.*?\n```', reply, flags=re.DOTALL)
-    message_text = "\n".join(part.strip() for part in non_code_parts if part.strip())
-    files = []
-    for lang, code in code_blocks:
-        ext = {"python": ".py", "javascript": ".js", "java": ".java", "c": ".c", "cpp": ".cpp",
-               "html": ".html", "css": ".css", "json": ".json", "bash": ".sh", "shell": ".sh",
-               "txt": ".txt"}.get(lang.lower() if lang else "", ".txt")
-        files.append((f"code{ext}", io.StringIO(code.strip())))
-    return message_text, files
+        return "Generation failed.", []
+    if result.fresh:
+        meter.record(author.id, guild.id if guild else None, result.model, images=len(result.refs), latency=result.latency)
+    return ("Here is your image:" if len(files) == 1 else f"Here are your {len(files)} images:"), files
 
 # On ready
 @bot.event
 async def on_ready():
-    global available_models
-    available_models = await asyncio.to_thread(get_available_models)
     print(f"Bot connected: {bot.user} ({bot.user.id})")
-    print(f"Available models: {len(available_models)} loaded.")
+    print(f"Available models: {len(catalog)} loaded.")
+    if config.SUMMARY_ENABLED and len(catalog) and config.SUMMARY_MODEL not in catalog:
+        print(f"[WARN] Summary model {config.SUMMARY_MODEL} is not in the model catalog; summarization will keep failing.")
+    if not shards.is_primary():
+        return  # Commands are synced once, by the process running shard 0
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} commands globally.")
@@ -268,20 +316,34 @@ async def on_ready():
 @app_commands.describe(user_message="Your message to the AI")
 async def slash_chat(interaction: discord.Interaction, user_message: str):
     await interaction.response.defer()
-    await safe_typing(interaction.channel)
-    reply = await ask_flazu(interaction.user.id, user_message, message=interaction.message)
-    text, files = extract_code_blocks(reply)
-    discord_files = [discord.File(fp=fp, filename=name) for name, fp in files]
-    content = f"{interaction.user.mention}\n{text}" if text else interaction.user.mention
-    await interaction.followup.send(content=content, files=discord_files)
-    for _, fp in files:
-        fp.close()
+    with metrics.request("slash_chat"):
+        live = None
+        if config.STREAM_REPLIES:
+            live = streaming.LiveReply(outbox.sender(interaction.channel_id, lambda **kw: interaction.followup.send(wait=True, **kw), merge=False),
+                                       interaction.user.mention)
+            live.start()
+        reply = await scheduled_ask(interaction.user, interaction.guild, interaction.channel, user_message,
+                                    message=interaction.message, on_delta=live.update if live else None,
+                                    cacheable=response_cache.enabled_for(interaction.channel_id))
+        text, files = extract_code_blocks(reply)
+        discord_files = [discord.File(fp=fp, filename=name) for name, fp in files]
+        content = f"{interaction.user.mention}\n{text}" if text else interaction.user.mention
+        with metrics.span("send"):
+            if live:
+                await live.finish(content, discord_files)
+            else:
+                await outbox.deliver(interaction.channel_id, interaction.followup.send, content, discord_files, merge=False)
+        for _, fp in files:
+            fp.close()
 
 @bot.tree.command(name="reset", description="Clear your conversation memory")
 async def slash_reset(interaction: discord.Interaction):
+    await memory.ensure(interaction.user.id)
     if interaction.user.id in memory:
         del memory[interaction.user.id]
-        save_memory()
+        store.delete(interaction.user.id)
+        context_budget.forget(interaction.user.id)
+        await asyncio.to_thread(store.flush)  # Other shard processes must see the reset now
         await interaction.response.send_message(f"{interaction.user.mention} Memory cleared.")
     else:
         await interaction.response.send_message(f"{interaction.user.mention} No memory to clear.")
@@ -289,18 +351,16 @@ async def slash_reset(interaction: discord.Interaction):
 @bot.tree.command(name="memory", description="Display your current memory")
 async def slash_memory(interaction: discord.Interaction):
     uid = interaction.user.id
+    await memory.ensure(uid)
     if uid not in memory or not memory[uid].get("history"):
         await interaction.response.send_message(f"{interaction.user.mention} No memory recorded.")
         return
     lines = []
     for m in memory[uid]["history"]:
-        role = m.get("role", "?")
-        content = m.get("content", "")
-        if isinstance(content, list):
-            content = " ".join([c.get("text", "") if c["type"] == "text" else "[image]" for c in content])
+        content = m.text()
         if len(content) > 600:
             content = content[:600] + "..."
-        lines.append(f"{role}: {content}")
+        lines.append(f"{m.role}: {content}")
     text = "\n".join(lines)
     if len(text) > 1900:
         text = text[-1900:] + "\n...(truncated)"
@@ -310,42 +370,58 @@ async def slash_memory(interaction: discord.Interaction):
 @app_commands.describe(new_model="The new model name (use /dispo to list)")
 async def slash_model(interaction: discord.Interaction, new_model: str):
     new_model = new_model.strip()
-    if new_model not in available_models:
+    if new_model not in catalog:
         await interaction.response.send_message(f"{interaction.user.mention} Model `{new_model}` not available. Use `/dispo`.")
         return
-    global global_model
-    global_model = new_model
-    save_global_model()
+    save_global_model(new_model)
     await interaction.response.send_message(f"{interaction.user.mention} Global model changed to `{new_model}` for everyone.")
 
 @bot.tree.command(name="dispo", description="List available models")
 async def slash_dispo(interaction: discord.Interaction):
-    if available_models:
-        liste = "\n".join(available_models)
+    if len(catalog):
+        liste = "\n".join(catalog.describe(m) for m in catalog.ids)
         await interaction.response.send_message(f"{interaction.user.mention} Available models:\n```{liste}```")
     else:
         await interaction.response.send_message(f"{interaction.user.mention} Retrieving models...")
+        asyncio.create_task(catalog.refresh())
 
-@bot.tree.command(name="usage", description="Display usage (not implemented)")
+@bot.tree.command(name="usage", description="Display your token and image usage")
 async def slash_usage(interaction: discord.Interaction):
-    await interaction.response.send_message(f"{interaction.user.mention} Usage: endpoint not implemented. Contact Flazu support.")
+    guild_id = interaction.guild.id if interaction.guild else None
+    await interaction.response.send_message(f"{interaction.user.mention} {meter.report(interaction.user.id, guild_id)}")
 
 @bot.tree.command(name="image", description="Generate an image")
-@app_commands.describe(prompt="The image prompt")
-async def slash_image(interaction: discord.Interaction, prompt: str):
-    await interaction.response.send_message(f"{interaction.user.mention} Generate an image for: `{prompt}`?\nReply **yes** to confirm.")
-    def check(m):
-        return m.author == interaction.user and m.channel == interaction.channel and m.content.lower() == "yes"
+@app_commands.describe(prompt="The image prompt", variants="How many variants to generate")
+async def slash_image(interaction: discord.Interaction, prompt: str, variants: app_commands.Range[int, 1, 10] = 1):
+    n = min(variants, images.max_variants)
+    if images.cached(prompt, n) is not None:
+        # Already generated: no cost, so no quota check or confirmation
+        await interaction.response.defer()
+        text, files = await generate_images(interaction.user, interaction.guild, interaction.channel, prompt, n)
+        send = interaction.followup.send
+    else:
+        try:
+            meter.check(interaction.user.id, interaction.guild.id if interaction.guild else None, images=n)
+        except QuotaExceeded as e:
+            await interaction.response.send_message(f"{interaction.user.mention} Usage limit reached: {e}.")
+            return
+        what = "an image" if n == 1 else f"{n} images"
+        await interaction.response.send_message(f"{interaction.user.mention} Generate {what} for: `{prompt}`?\nReply **yes** to confirm.")
+        def check(m):
+            return m.author == interaction.user and m.channel == interaction.channel and m.content.lower() == "yes"
+        try:
+            await bot.wait_for("message", check=check, timeout=60)
+        except asyncio.TimeoutError:
+            await interaction.channel.send(f"{interaction.user.mention} Cancelled (timeout).")
+            return
+        text, files = await generate_images(interaction.user, interaction.guild, interaction.channel, prompt, n)
+        send = interaction.channel.send
     try:
-        msg = await bot.wait_for("message", check=check, timeout=60)
-        await safe_typing(interaction.channel)
-        url = await asyncio.to_thread(generate_image, prompt)
-        if url:
-            await interaction.channel.send(f"{interaction.user.mention} Here is your image:\n{url}")
-        else:
-            await interaction.channel.send(f"{interaction.user.mention} Generation failed.")
-    except asyncio.TimeoutError:
-        await interaction.channel.send(f"{interaction.user.mention} Cancelled (timeout).")
+        await outbox.deliver(interaction.channel_id, send, f"{interaction.user.mention} {text}",
+                             [discord.File(fp=fp, filename=name) for name, fp in files], merge=False)
+    finally:
+        for _, fp in files:
+            fp.close()
 
 @bot.tree.command(name="whelp", description="Show available commands")
 async def slash_whelp(interaction: discord.Interaction):
@@ -356,8 +432,8 @@ Available commands:
 - `/memory`: Display your current memory.
 - `/model <name>`: Change the global AI model for everyone (see `/dispo`).
 - `/dispo`: List available models.
-- `/usage`: Display usage (not implemented).
-- `/image <prompt>`: Generate an image (confirmation required).
+- `/usage`: Display your token and image usage.
+- `/image <prompt> [variants]`: Generate images (confirmation required unless already generated).
 - `/bypass <link>`: Bypass a link using Flazu API.
 - Mention the bot or use `,` for quick chat.
 
@@ -385,11 +461,9 @@ async def slash_sync(interaction: discord.Interaction, guild_only: bool = False)
 @app_commands.describe(link="The link to bypass")
 async def slash_bypass(interaction: discord.Interaction, link: str):
     await interaction.response.defer()
-    await safe_typing(interaction.channel)
     try:
-        resp = requests.get(f"https://bypass.flazu.my/v1/free/bypass?link={link}", timeout=100)
-        resp.raise_for_status()
-        result = resp.text  # Assuming text response; change to resp.json() if JSON
+        async with typing_indicator.typing(interaction.channel):
+            result = await client.get_text("https://bypass.flazu.my/v1/free/bypass", params={"link": link}, timeout=100)
         content = f"{interaction.user.mention}\n{result}"
         await interaction.followup.send(content=content)
     except Exception as e:
@@ -399,11 +473,64 @@ async def slash_bypass(interaction: discord.Interaction, link: str):
 @bot.command(name="IP")
 async def cmd_ip(ctx):
     try:
-        ip = requests.get('https://api.ipify.org').text
+        ip = await client.get_text('https://api.ipify.org', timeout=10)
         await ctx.send(f"{ctx.author.mention} The bot's IP address is: {ip}")
     except Exception as e:
         await ctx.send(f"{ctx.author.mention} Failed to retrieve IP: {str(e)}")
 
+# Cache stats command (bot owner only)
+@bot.command(name="cachestats")
+@commands.is_owner()
+async def cmd_cachestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in response_cache.snapshot().items())
+    encoding = ", ".join(f"{k}={v}" for k, v in encode.snapshot().items())
+    await ctx.send(f"{ctx.author.mention} Response cache: {stats}\nRequest encoding: {encoding}")
+
+# Queue stats command (bot owner only)
+@bot.command(name="queuestats")
+@commands.is_owner()
+async def cmd_queuestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in scheduler.snapshot().items())
+    await ctx.send(f"{ctx.author.mention} Request queue: {stats}")
+
+# Working set stats command (bot owner only)
+@bot.command(name="memstats")
+@commands.is_owner()
+async def cmd_memstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in memory.snapshot().items())
+    await ctx.send(f"{ctx.author.mention} Conversations in memory: {stats}")
+
+# Model routing stats command (bot owner only)
+@bot.command(name="routestats")
+@commands.is_owner()
+async def cmd_routestats(ctx):
+    lines = [f"{model}: " + ", ".join(f"{k}={v}" for k, v in s.items()) for model, s in router.snapshot().items()]
+    await ctx.send(f"{ctx.author.mention} Model routing:\n" + ("\n".join(lines) or "no requests yet"))
+
+# Outbound message stats command (bot owner only)
+@bot.command(name="sendstats")
+@commands.is_owner()
+async def cmd_sendstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in outbox.snapshot().items())
+    await ctx.send(f"{ctx.author.mention} Outbound messages: {stats}")
+
+# Usage stats command (bot owner only)
+@bot.command(name="usagestats")
+@commands.is_owner()
+async def cmd_usagestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in meter.snapshot().items())
+    lines = [f"{scope} {key}: {t['requests']} requests, {t['prompt_tokens'] + t['completion_tokens']} tokens, {t['images']} images"
+             for scope in ("model", "user", "guild") for key, t in meter.top(scope)]
+    await outbox.send(ctx.channel, f"{ctx.author.mention} Usage (last 24h): {stats}\n" + ("\n".join(lines) or "no requests yet"))
+
+# Event loop stall stats command (bot owner only)
+@bot.command(name="loopstats")
+@commands.is_owner()
+async def cmd_loopstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in watchdog.snapshot().items())
+    lines = [f"{e['count']}x {e['total']:.2f}s (max {e['max']:.2f}s) {site} [{e['task']}]" for site, e in watchdog.worst()]
+    await outbox.send(ctx.channel, f"{ctx.author.mention} Event loop: {stats}\n" + ("\n".join(lines) or "no stalls recorded"))
+
 # On message
 @bot.event
 async def on_message(msg):
@@ -420,24 +547,72 @@ async def on_message(msg):
             return  # Skip if looks like a prefix command
         if not prompt and not msg.attachments and not re.search(r"https?://[^\s]+\.(png|jpe?g|webp|gif)", msg.content):
             return
-        await safe_typing(msg.channel)
-        reply = await ask_flazu(msg.author.id, prompt, message=msg)
-        text, files = extract_code_blocks(reply)
-        discord_files = [discord.File(fp=fp, filename=name) for name, fp in files]
-        content = f"{msg.author.mention}\n{text}" if text else msg.author.mention
+        with metrics.request("on_message"):
+            live = None
+            if config.STREAM_REPLIES:
+                live = streaming.LiveReply(outbox.sender(msg.channel.id, msg.channel.send, merge=False), msg.author.mention)
+                live.start()
+            quick = msg.content.startswith(',') and config.QUICK_CHAT_STATELESS
+            reply = await scheduled_ask(msg.author, msg.guild, msg.channel, prompt, message=msg,
+                                        on_delta=live.update if live else None,
+                                        stateless=quick, cacheable=response_cache.enabled_for(msg.channel.id))
+            text, files = extract_code_blocks(reply)
+            discord_files = [discord.File(fp=fp, filename=name) for name, fp in files]
+            content = f"{msg.author.mention}\n{text}" if text else msg.author.mention
+            try:
+                with metrics.span("send"):
+                    if live:
+                        await live.finish(content, discord_files)
+                    else:
+                        await outbox.send(msg.channel, content, discord_files)
+            except Exception as e:
+                print(f"[ERROR] Send failed: {e}")
+                await outbox.send(msg.channel, f"{msg.author.mention} Error during send.")
+            finally:
+                for _, fp in files:
+                    fp.close()
+
+# Run bot
+async def main():
+    discord.utils.setup_logging()
+    async with bot:
+        background = [
+            asyncio.create_task(store.run_flusher()),
+            asyncio.create_task(catalog.run_refresher()),
+            asyncio.create_task(memory.run_sweeper()),
+            asyncio.create_task(meter.run_flusher()),
+            asyncio.create_task(blobs.run_publisher(cached_images)),
+        ]
+        if config.WATCHDOG_STALL > 0:
+            background.append(asyncio.create_task(watchdog.run()))
+        if shards.is_primary():
+            background.append(asyncio.create_task(blobs.run_collector(referenced_images)))
+        metrics.open_log()
+        for name, component in (("scheduler", scheduler), ("memory", memory), ("outbox", outbox), ("cache", response_cache),
+                                ("usage", meter), ("images", images)):
+            metrics.add_collector(name, component.snapshot)
+        metrics.add_collector("encode", encode.snapshot)
+        metrics.add_collector("loop", watchdog.snapshot)
+        metrics_runner = await metrics.serve(port=shards.port_offset(config.METRICS_PORT))
         try:
-            await msg.channel.send(content=content, files=discord_files)
-        except Exception as e:
-            print(f"[ERROR] Send failed: {e}")
-            await msg.channel.send(f"{msg.author.mention} Error during send.")
+            await bot.start(DISCORD_TOKEN)
         finally:
-            for _, fp in files:
-                fp.close()
+            for task in background:
+                task.cancel()
+            images.close()
+            if metrics_runner:
+                await metrics_runner.cleanup()
+            await client.close_session()
+            store.close()
+            meter.close()
+            if image_prep:
+                image_prep.close()
 
-# Run bot
 if __name__ == "__main__":
     try:
-        bot.run(DISCORD_TOKEN)
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"[FATAL] bot.run error: {str(e)}")
         traceback.print_exc()
@@ -1,25 +1,38 @@
 #!/usr/bin/env python3
 import os
-import requests
 import asyncio
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-import json
-import traceback
-import io
 import re
-from collections import defaultdict
 import time
+import traceback
+from flazu import client, config, encode, metrics, shards, streaming, tokens
+from flazu.blobs import BlobStore, digests_in
+from flazu.cache import ResponseCache
+from flazu.catalog import ModelCatalog
+from flazu.fences import extract_code_blocks
+from flazu.imagegen import ImageGenerator
+from flazu.indicator import TypingManager
+from flazu.messages import Message
+from flazu.outbox import Outbox
+from flazu.resilience import Upstream
+from flazu.router import ModelRouter
+from flazu.scheduler import Overloaded, RequestScheduler
+from flazu.store import ConversationStore
+from flazu.summarize import Summarizer
+from flazu.usage import QuotaExceeded, UsageMeter
+from flazu.watchdog import Watchdog
+from flazu.workingset import WorkingSet
 
 # === Loading .env ===
 load_dotenv()
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 FLAZU_API_KEY = os.getenv("FLAZU_API_KEY")
-FLAZU_API_URL = "https://ai.flazu.my/v1/chat/completions"
-FLAZU_MODELS_URL = "https://ai.flazu.my/v1/models"
-FLAZU_IMAGES_URL = "https://ai.flazu.my/v1/images/generations"
+FLAZU_API_URL = f"{config.API_BASE}/chat/completions"
+FLAZU_MODELS_URL = f"{config.API_BASE}/models"
+FLAZU_IMAGES_URL = f"{config.API_BASE}/images/generations"
 
 if not DISCORD_TOKEN or not FLAZU_API_KEY:
     print("ERROR: DISCORD_TOKEN or FLAZU_API_KEY missing in .env")
@@ -29,231 +42,262 @@ if not DISCORD_TOKEN or not FLAZU_API_KEY:
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = shards.make_bot(intents, command_prefix="!")
 
 # === Persistent Memory ===
-MEMORY_FILE = "memory.json"
-memory = {}
+MEMORY_FILE = "memory.json"  # Legacy format, migrated into MEMORY_DB on first start
+MEMORY_DB = "memory.db"
+SYSTEM_PROMPT = "You are a helpful and concise AI."
+SYSTEM_MESSAGE = Message("system", SYSTEM_PROMPT)  # Shared by every new history
+store = ConversationStore(MEMORY_DB)
+
+def on_memory_evict(uid):
+    context_budget.forget(uid)
+    summarizer.forget(uid)
 
-# List of available models (will be filled on ready)
-available_models = []
+# Conversations are loaded on first use and dropped again when idle (with their token ledgers and summary backoff)
+memory = WorkingSet(store, on_load=lambda uid, data: data.setdefault("model", "gpt-5"), shared=shards.sharded(),
+                   on_evict=on_memory_evict)
+
+# Available models (warm from disk, refreshed in the background)
+catalog = ModelCatalog(FLAZU_MODELS_URL, FLAZU_API_KEY)
+catalog.load()
 
 # === SAFE TYPING SYSTEM (NO MORE 429 RATE LIMITS) ===
-typing_queue = defaultdict(asyncio.Semaphore)
-typing_last = defaultdict(float)
-TYPING_COOLDOWN = 5.0  # Discord allows ~1 typing per 5 sec per channel
-
-async def safe_typing(channel):
-    """Send typing with queue + lock to avoid rate limits."""
-    semaphore = typing_queue[channel.id]
-    async with semaphore:
-        now = time.time()
-        last = typing_last[channel.id]
-        if now - last < TYPING_COOLDOWN:
-            await asyncio.sleep(TYPING_COOLDOWN - (now - last))
-        try:
-            async with channel.typing():
-                typing_last[channel.id] = time.time()
-                await asyncio.sleep(1)  # Simulate typing
-        except discord.HTTPException as e:
-            if e.status == 429:
-                retry_after = e.response.headers.get("Retry-After", 5)
-                print(f"[RATE LIMITED] Typing blocked, retry in {retry_after}s")
-                await asyncio.sleep(float(retry_after))
-            else:
-                print(f"[ERROR] Typing failed: {e}")
+# Kept alive in the background per channel; never delays the API call
+typing_indicator = TypingManager()
 
-def load_memory():
-    global memory
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                loaded = json.load(f)
-                temp_memory = {int(k): v for k, v in loaded.items()}
-            for uid, data in temp_memory.items():
-                if isinstance(data, list):
-                    temp_memory[uid] = {"history": data, "model": "gpt-5"}
-            memory = temp_memory
-            print("[INFO] Memory loaded successfully.")
-        except Exception as e:
-            print(f"[WARN] Unable to load memory.json: {str(e)}. Initializing new memory.")
-            memory = {}
-    else:
-        print("[INFO] No memory.json file found. Initializing new memory.")
-        memory = {}
+# Outbound messages: per-channel queues that split long replies and respect rate limits
+outbox = Outbox()
 
-def save_memory():
+# Event-loop stall detector (opt-in with FLAZU_WATCHDOG_STALL)
+watchdog = Watchdog()
+
+def upgrade_memory_entry(data):
+    if isinstance(data, list):
+        return {"history": data, "model": "gpt-5"}
+    return data
+
+def load_memory():
     try:
-        json_memory = {str(k): v for k, v in memory.items()}
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(json_memory, f, ensure_ascii=False, indent=2)
+        store.migrate_json(MEMORY_FILE, upgrade_memory_entry)
     except Exception as e:
-        print(f"[ERROR] Unable to save memory.json: {str(e)}")
+        print(f"[WARN] Unable to migrate memory.json: {str(e)}. Keeping it untouched.")
+
+def remember(user_id, *messages):
+    """Record new turns in memory and queue only those for the store."""
+    memory[user_id]["history"].extend(messages)
+    store.append(user_id, *messages)
 
 load_memory()
 
+# Token, image and latency metering per user, guild and model (with optional quotas)
+meter = UsageMeter(MEMORY_DB, shared=shards.sharded())
+meter.load()
+
 # === Utilities ===
-def sanitize_messages(msgs, max_chars=3000):
-    out = []
-    total = 0
-    for m in reversed(msgs):
-        content = m.get("content", "")
-        if not isinstance(content, str):
-            content = str(content)
-        if total + len(content) > max_chars:
-            allowed = max_chars - total
-            if allowed <= 0:
-                break
-            content = content[-allowed:]
-        out.append({"role": m.get("role", "user"), "content": content})
-        total += len(content)
-    return list(reversed(out))
+context_budget = tokens.ContextBudget()
+
+def sanitize_messages(user_id, msgs, model):
+    return context_budget.select(user_id, msgs, model)
+
+fragment_cache = encode.FragmentCache()
+response_cache = ResponseCache()
+upstream = Upstream(FLAZU_API_URL)
+router = ModelRouter(upstream)
+summarizer = Summarizer(store, context_budget, memory.peek, FLAZU_API_URL, FLAZU_API_KEY, upstream, meter)
 
 def debug_print(*args, **kwargs):
     print("[DEBUG]", *args, **kwargs)
 
-# === Get available models ===
-def get_available_models():
-    headers = {"Authorization": f"Bearer {FLAZU_API_KEY}"}
-    try:
-        resp = requests.get(FLAZU_MODELS_URL, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        return [m['id'] for m in data.get('data', [])]
-    except Exception as e:
-        print(f"[ERROR] Unable to retrieve models: {str(e)}")
-        return []
-
 # === Call Flazu ===
-def ask_flazu(user_id: int, user_prompt: str) -> str:
+async def ask_flazu(user_id: int, user_prompt: str, on_delta=None, stateless=False, cacheable=False, guild_id=None) -> str:
     try:
         user_id = int(user_id)
     except Exception:
         return "Internal error: invalid user_id."
 
     user_prompt = str(user_prompt) if user_prompt is not None else ""
+    await memory.ensure(user_id)
 
-    if user_id not in memory:
-        memory[user_id] = {
-            "history": [{"role": "system", "content": "You are a helpful and concise AI."}],
-            "model": "gpt-5"
-        }
+    if stateless:
+        model = memory[user_id]["model"] if user_id in memory else "gpt-5"
+        msgs = [SYSTEM_MESSAGE, Message("user", user_prompt)]
+    else:
+        if user_id not in memory:
+            memory[user_id] = {"history": [], "model": "gpt-5"}
+            store.set_meta(user_id, model="gpt-5")
+            remember(user_id, SYSTEM_MESSAGE)
 
-    memory[user_id]["history"].append({"role": "user", "content": user_prompt})
-    msgs = sanitize_messages(memory[user_id]["history"], max_chars=3000)
+        remember(user_id, Message("user", user_prompt))
+        model = memory[user_id]["model"]
+        with metrics.span("sanitize"):
+            msgs = sanitize_messages(user_id, memory[user_id]["history"], model)
+    metrics.tag(model=model)
 
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {FLAZU_API_KEY}"
     }
-    data = {
-        "model": memory[user_id]["model"],
-        "messages": msgs
-    }
+    debug_print(f"Call Flazu: user={user_id}, model={model}, prompt='{user_prompt[:50]}...'")
+
+    with metrics.span("encode"):
+        fragments = fragment_cache.encode(msgs)
+    spent = {}  # Filled in when the answer really came from upstream (not the cache)
+
+    async def attempt(model, claim):
+        data = encode.Body(fragments, model=model)
+        if on_delta is not None:
+            def delta(text):
+                if claim():
+                    on_delta(text)
+            reply = await streaming.stream_completion(FLAZU_API_URL, data, headers=headers, on_delta=delta, timeout=30,
+                                                      on_usage=lambda block: spent.update(usage=block))
+        else:
+            j = await client.post_json(FLAZU_API_URL, data, headers=headers, timeout=30)
+            spent["usage"] = j.get("usage")
+            reply = j.get("choices", [{}])[0].get("message", {}).get("content", "")
+        spent["model"] = model
+        return reply
 
-    debug_print(f"Call Flazu: user={user_id}, model={memory[user_id]['model']}, prompt='{user_prompt[:50]}...'")
+    async def fetch():
+        started = time.perf_counter()
+        with metrics.span("upstream"):
+            reply = await router.call(model, attempt)
+        spent["latency"] = time.perf_counter() - started
+        return reply
 
     try:
-        resp = requests.post(FLAZU_API_URL, headers=headers, json=data, timeout=30)
-        resp.raise_for_status()
-        j = resp.json()
-        reply = j.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if cacheable:
+            reply = await response_cache.get_or_fetch(response_cache.key(model, msgs), fetch)
+        else:
+            reply = await fetch()
         if not isinstance(reply, str):
             reply = str(reply) if reply is not None else "Empty response."
-
-        memory[user_id]["history"].append({"role": "assistant", "content": reply})
-        if len(memory[user_id]["history"]) > 50:
-            memory[user_id]["history"] = memory[user_id]["history"][-50:]
-        save_memory()
+        if "latency" in spent:
+            meter.record_reply(user_id, guild_id, spent["model"], spent.get("usage"), msgs, reply, spent["latency"])
+        if stateless:
+            return reply
+
+        with metrics.span("save_memory"):
+            remember(user_id, Message("assistant", reply))
+            if len(memory[user_id]["history"]) > 50:
+                memory[user_id]["history"] = memory[user_id]["history"][-50:]
+                store.trim(user_id, 50)
+        summarizer.maybe_schedule(user_id, memory[user_id], model, guild_id)
         return reply
 
-    except requests.exceptions.Timeout:
+    except client.Timeout as e:
+        metrics.error(e)
         return "The Flazu API took too long to respond."
-    except requests.exceptions.RequestException as e:
+    except client.RequestError as e:
+        metrics.error(e)
         debug_print(f"Flazu request error: {e}")
         traceback.print_exc()
         return f"Flazu API error: {str(e)}"
     except Exception as e:
+        metrics.error(e)
         debug_print(f"Flazu unexpected error: {e}")
         traceback.print_exc()
         return f"Unexpected error: {str(e)}"
 
+# === Scheduled call: one request per user at a time, fair across users and guilds ===
+scheduler = RequestScheduler()
+
+async def scheduled_ask(author, guild, channel, prompt, **kwargs) -> str:
+    async def notify(position):
+        await outbox.send(channel, f"{author.mention} Queued, position {position}.")
+    guild_id = guild.id if guild else None
+    queued = time.perf_counter()
+    try:
+        meter.check(author.id, guild_id)
+        async with scheduler.slot(author.id, guild_id, on_queued=notify):
+            metrics.record("queue", time.perf_counter() - queued)
+            async with typing_indicator.typing(channel):
+                return await ask_flazu(author.id, prompt, guild_id=guild_id, **kwargs)
+    except QuotaExceeded as e:
+        metrics.error(e)
+        return f"Usage limit reached: {e}."
+    except Overloaded as e:
+        metrics.error(e)
+        return "The bot is overloaded right now, please try again in a minute."
+
 # === Generate Image ===
-def generate_image(prompt: str, model="dall-e-3", size="1024x1024", n=1) -> str:
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {FLAZU_API_KEY}"
-    }
-    data = {
-        "prompt": prompt,
-        "model": model,
-        "n": n,
-        "size": size
-    }
+# Background jobs; results are kept as local blobs so a repeated prompt is re-uploaded, not regenerated
+IMAGE_VARIANTS_RE = re.compile(r"--n\s+(\d+)\s+(\S.*)", re.DOTALL)
+blobs = BlobStore()
+images = ImageGenerator(FLAZU_IMAGES_URL, FLAZU_API_KEY, upstream, blobs)
+
+# chat31.py started from the same directory shares memory.db and the blob store, so the images
+# its conversations keep must survive this bot's collection too (its caches publish pin files)
+def referenced_images():
+    store.flush()
+    return digests_in(store.scan('"image_ref"')) | images.digests()
+
+async def generate_images(author, guild, channel, prompt, n=1):
+    """Run an image job; returns the reply text and ``[(filename, file object), ...]``."""
+    async def notify(position):
+        await outbox.send(channel, f"{author.mention} Image queued, position {position}.")
     try:
-        resp = requests.post(FLAZU_IMAGES_URL, headers=headers, json=data, timeout=60)
-        resp.raise_for_status()
-        j = resp.json()
-        if 'data' in j and len(j['data']) > 0 and 'url' in j['data'][0]:
-            return j['data'][0]['url']
-        return None
+        async with typing_indicator.typing(channel):
+            result = await images.generate(prompt, n, on_queued=notify)
+        files = await images.attachments(result.refs)
+    except Overloaded:
+        return "Too many images are being generated right now, please try again in a minute.", []
     except Exception as e:
         debug_print(f"Image generation error: {e}")
-        return None
-
-# === Extract code blocks ===
-def extract_code_blocks(reply):
-    code_blocks = re.findall(r'```(\w+)?\n(.*?)\n```', reply, re.DOTALL)
-    non_code_parts = re.split(r'```(?:\w+)?\n.*?\n```', reply, flags=re.DOTALL)
-    message_text = "\n".join(part for part in non_code_parts if part.strip())
-    files = []
-    for lang, code in code_blocks:
-        ext = get_extension(lang)
-        files.append((f"code{ext}", io.StringIO(code.strip())))
-    return message_text.strip(), files
-
-def get_extension(lang):
-    lang = lang.lower() if lang else "txt"
-    extensions = {
-        "python": ".py", "javascript": ".js", "java": ".java", "c": ".c", "cpp": ".cpp",
-        "html": ".html", "css": ".css", "json": ".json", "markdown": ".md", "bash": ".sh", "shell": ".sh"
-    }
-    return extensions.get(lang, ".txt")
+        return "Failed to generate image.", []
+    if result.fresh:
+        meter.record(author.id, guild.id if guild else None, result.model, images=len(result.refs), latency=result.latency)
+    return ("Here is your image:" if len(files) == 1 else f"Here are your {len(files)} images:"), files
 
 # === Events ===
 @bot.event
 async def on_ready():
-    global available_models
-    available_models = await asyncio.to_thread(get_available_models)
     print(f"Connected as {bot.user} (ID: {bot.user.id})")
-    if available_models:
-        print(f"[INFO] {len(available_models)} available models loaded.")
+    if len(catalog):
+        print(f"[INFO] {len(catalog)} available models loaded.")
+        if config.SUMMARY_ENABLED and config.SUMMARY_MODEL not in catalog:
+            print(f"[WARN] Summary model {config.SUMMARY_MODEL} is not in the model catalog; summarization will keep failing.")
     else:
-        print("[WARN] No available models retrieved.")
+        print("[WARN] No available models retrieved yet.")
 
 # === Commands ===
 @bot.command(name="chat")
 async def cmd_chat(ctx, *, user_message: str):
-    user_id = ctx.author.id
-    await safe_typing(ctx.channel)
-    reply = await asyncio.to_thread(ask_flazu, user_id, user_message)
-    message_text, files = extract_code_blocks(reply)
-    discord_files = [discord.File(fp=fp, filename=filename) for filename, fp in files]
-    ping = f"{ctx.author.mention}"
-    content = f"{ping}\n{message_text}" if message_text else ping
-    try:
-        await ctx.channel.send(content=content, files=discord_files)
-    except Exception:
-        await ctx.channel.send(f"{ping} An error occurred.")
-    for fp in [f[1] for f in files]:
-        fp.close()
+    with metrics.request("cmd_chat"):
+        live = None
+        if config.STREAM_REPLIES:
+            live = streaming.LiveReply(outbox.sender(ctx.channel.id, ctx.channel.send, merge=False), ctx.author.mention)
+            live.start()
+        reply = await scheduled_ask(ctx.author, ctx.guild, ctx.channel, user_message,
+                                    on_delta=live.update if live else None,
+                                    cacheable=response_cache.enabled_for(ctx.channel.id))
+        message_text, files = extract_code_blocks(reply)
+        discord_files = [discord.File(fp=fp, filename=filename) for filename, fp in files]
+        ping = f"{ctx.author.mention}"
+        content = f"{ping}\n{message_text}" if message_text else ping
+        try:
+            with metrics.span("send"):
+                if live:
+                    await live.finish(content, discord_files)
+                else:
+                    await outbox.send(ctx.channel, content, discord_files)
+        except Exception as e:
+            print(f"[ERROR] Failed to send message: {e}")
+            await outbox.send(ctx.channel, f"{ping} An error occurred.")
+        for fp in [f[1] for f in files]:
+            fp.close()
 
 @bot.command(name="reset")
 async def cmd_reset(ctx):
     uid = ctx.author.id
+    await memory.ensure(uid)
     if uid in memory:
         del memory[uid]
-        save_memory()
+        store.delete(uid)
+        context_budget.forget(uid)
+        await asyncio.to_thread(store.flush)  # Other shard processes must see the reset now
         await ctx.channel.send(f"{ctx.author.mention} Your memory has been cleared.")
     else:
         await ctx.channel.send(f"{ctx.author.mention} You had no memory recorded.")
@@ -261,69 +305,125 @@ async def cmd_reset(ctx):
 @bot.command(name="memory")
 async def cmd_memory(ctx):
     uid = ctx.author.id
+    await memory.ensure(uid)
     if uid not in memory or not memory[uid].get("history"):
         await ctx.channel.send(f"{ctx.author.mention} No memory for you.")
         return
     lines = []
     for m in memory[uid]["history"]:
-        role = m.get("role", "?")
-        content = m.get("content", "")
+        content = m.text()
         if len(content) > 600:
             content = content[:600] + "..."
-        lines.append(f"{role}: {content}")
+        lines.append(f"{m.role}: {content}")
     text = "\n".join(lines)
     if len(text) > 1900:
         text = text[-1900:] + "\n...(truncated)"
-    await ctx.channel.send(f"{ctx.author.mention} Memory:\n{text}")
+    await outbox.send(ctx.channel, f"{ctx.author.mention} Memory:\n{text}")
 
 @bot.command(name="model")
 async def cmd_model(ctx, new_model: str):
     uid = ctx.author.id
     new_model = new_model.strip()
-    if new_model not in available_models:
+    if new_model not in catalog:
         await ctx.channel.send(f"{ctx.author.mention} Model '{new_model}' not available. Use !dispo.")
         return
+    await memory.ensure(uid)
     if uid not in memory:
         memory[uid] = {"history": [], "model": new_model}
     else:
         memory[uid]["model"] = new_model
-    save_memory()
+    store.set_meta(uid, model=new_model)
     await ctx.channel.send(f"{ctx.author.mention} Model changed to `{new_model}` for you.")
 
 @bot.command(name="dispo")
 async def cmd_dispo(ctx):
-    global available_models
-    if available_models:
-        models_list = "\n".join(available_models)
-        await ctx.channel.send(f"{ctx.author.mention} Available models:\n{models_list}")
+    if not len(catalog):
+        await catalog.refresh()
+    if len(catalog):
+        models_list = "\n".join(catalog.ids)
+        await outbox.send(ctx.channel, f"{ctx.author.mention} Available models:\n{models_list}")
     else:
-        models = await asyncio.to_thread(get_available_models)
-        if models:
-            available_models = models
-            models_list = "\n".join(models)
-            await ctx.channel.send(f"{ctx.author.mention} Available models:\n{models_list}")
-        else:
-            await ctx.channel.send(f"{ctx.author.mention} Unable to retrieve models.")
+        await ctx.channel.send(f"{ctx.author.mention} Unable to retrieve models.")
 
 @bot.command(name="usage")
 async def cmd_usage(ctx):
-    await ctx.channel.send(f"{ctx.author.mention} Usage: endpoint not implemented. Contact Flazu support.")
+    await outbox.send(ctx.channel, f"{ctx.author.mention} {meter.report(ctx.author.id, ctx.guild.id if ctx.guild else None)}")
 
 @bot.command(name="image")
 async def cmd_image(ctx, *, prompt: str):
-    await ctx.channel.send(f"{ctx.author.mention} Do you want me to generate an image for: '{prompt}'? Reply 'yes' to confirm.")
-    def check(m):
-        return m.author == ctx.author and m.channel == ctx.channel and m.content.lower() == 'yes'
+    # "!image --n 3 a red fox" asks for three variants; any other prompt is used as written
+    n = 1
+    variants = IMAGE_VARIANTS_RE.match(prompt)
+    if variants:
+        n, prompt = min(max(int(variants.group(1)), 1), images.max_variants), variants.group(2)
+    if images.cached(prompt, n) is None:
+        # Only new images cost anything, so cached ones skip the quota and the confirmation
+        try:
+            meter.check(ctx.author.id, ctx.guild.id if ctx.guild else None, images=n)
+        except QuotaExceeded as e:
+            await ctx.channel.send(f"{ctx.author.mention} Usage limit reached: {e}.")
+            return
+        what = "an image" if n == 1 else f"{n} images"
+        await ctx.channel.send(f"{ctx.author.mention} Do you want me to generate {what} for: '{prompt}'? Reply 'yes' to confirm.")
+        def check(m):
+            return m.author == ctx.author and m.channel == ctx.channel and m.content.lower() == 'yes'
+        try:
+            await bot.wait_for('message', check=check, timeout=60.0)
+        except asyncio.TimeoutError:
+            await ctx.channel.send(f"{ctx.author.mention} Image generation cancelled due to timeout.")
+            return
+    text, files = await generate_images(ctx.author, ctx.guild, ctx.channel, prompt, n)
     try:
-        await bot.wait_for('message', check=check, timeout=60.0)
-        await safe_typing(ctx.channel)
-        image_url = await asyncio.to_thread(generate_image, prompt)
-        if image_url:
-            await ctx.channel.send(f"{ctx.author.mention} {image_url}")
-        else:
-            await ctx.channel.send(f"{ctx.author.mention} Failed to generate image.")
-    except asyncio.TimeoutError:
-        await ctx.channel.send(f"{ctx.author.mention} Image generation cancelled due to timeout.")
+        await outbox.send(ctx.channel, f"{ctx.author.mention} {text}", [discord.File(fp=fp, filename=name) for name, fp in files])
+    finally:
+        for _, fp in files:
+            fp.close()
+
+@bot.command(name="cachestats")
+@commands.is_owner()
+async def cmd_cachestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in response_cache.snapshot().items())
+    encoding = ", ".join(f"{k}={v}" for k, v in encode.snapshot().items())
+    await ctx.channel.send(f"{ctx.author.mention} Response cache: {stats}\nRequest encoding: {encoding}")
+
+@bot.command(name="queuestats")
+@commands.is_owner()
+async def cmd_queuestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in scheduler.snapshot().items())
+    await ctx.channel.send(f"{ctx.author.mention} Request queue: {stats}")
+
+@bot.command(name="memstats")
+@commands.is_owner()
+async def cmd_memstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in memory.snapshot().items())
+    await ctx.channel.send(f"{ctx.author.mention} Conversations in memory: {stats}")
+
+@bot.command(name="routestats")
+@commands.is_owner()
+async def cmd_routestats(ctx):
+    lines = [f"{model}: " + ", ".join(f"{k}={v}" for k, v in s.items()) for model, s in router.snapshot().items()]
+    await ctx.channel.send(f"{ctx.author.mention} Model routing:\n" + ("\n".join(lines) or "no requests yet"))
+
+@bot.command(name="sendstats")
+@commands.is_owner()
+async def cmd_sendstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in outbox.snapshot().items())
+    await ctx.channel.send(f"{ctx.author.mention} Outbound messages: {stats}")
+
+@bot.command(name="usagestats")
+@commands.is_owner()
+async def cmd_usagestats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in meter.snapshot().items())
+    lines = [f"{scope} {key}: {t['requests']} requests, {t['prompt_tokens'] + t['completion_tokens']} tokens, {t['images']} images"
+             for scope in ("model", "user", "guild") for key, t in meter.top(scope)]
+    await outbox.send(ctx.channel, f"{ctx.author.mention} Usage (last 24h): {stats}\n" + ("\n".join(lines) or "no requests yet"))
+
+@bot.command(name="loopstats")
+@commands.is_owner()
+async def cmd_loopstats(ctx):
+    stats = ", ".join(f"{k}={v}" for k, v in watchdog.snapshot().items())
+    lines = [f"{e['count']}x {e['total']:.2f}s (max {e['max']:.2f}s) {site} [{e['task']}]" for site, e in watchdog.worst()]
+    await outbox.send(ctx.channel, f"{ctx.author.mention} Event loop: {stats}\n" + ("\n".join(lines) or "no stalls recorded"))
 
 # === on_message : PING USER + NO REPLY ===
 @bot.event
@@ -334,7 +434,6 @@ async def on_message(msg):
     await bot.process_commands(msg)
 
     if bot.user.mentioned_in(msg) or msg.content.startswith(','):
-        uid = msg.author.id
         prompt = msg.content
         if bot.user.mentioned_in(msg):
             prompt = prompt.replace(f"<@{bot.user.id}>", "").strip()
@@ -342,27 +441,73 @@ async def on_message(msg):
             prompt = prompt[1:].strip()
 
         if prompt:
-            await safe_typing(msg.channel)
-            reply = await asyncio.to_thread(ask_flazu, uid, prompt)
-            message_text, files = extract_code_blocks(reply)
-            discord_files = [discord.File(fp=fp, filename=filename) for filename, fp in files]
-
-            ping = f"{msg.author.mention}"
-            content = f"{ping}\n{message_text}" if message_text else ping
-
-            try:
-                await msg.channel.send(content=content, files=discord_files)
-            except Exception as e:
-                print(f"[ERROR] Failed to send message: {e}")
-                await msg.channel.send(f"{ping} An error occurred.")
-            finally:
-                for fp in [f[1] for f in files]:
-                    fp.close()
+            with metrics.request("on_message"):
+                live = None
+                if config.STREAM_REPLIES:
+                    live = streaming.LiveReply(outbox.sender(msg.channel.id, msg.channel.send, merge=False), msg.author.mention)
+                    live.start()
+                quick = msg.content.startswith(',') and config.QUICK_CHAT_STATELESS
+                reply = await scheduled_ask(msg.author, msg.guild, msg.channel, prompt,
+                                            on_delta=live.update if live else None,
+                                            stateless=quick, cacheable=response_cache.enabled_for(msg.channel.id))
+                message_text, files = extract_code_blocks(reply)
+                discord_files = [discord.File(fp=fp, filename=filename) for filename, fp in files]
+
+                ping = f"{msg.author.mention}"
+                content = f"{ping}\n{message_text}" if message_text else ping
+
+                try:
+                    with metrics.span("send"):
+                        if live:
+                            await live.finish(content, discord_files)
+                        else:
+                            await outbox.send(msg.channel, content, discord_files)
+                except Exception as e:
+                    print(f"[ERROR] Failed to send message: {e}")
+                    await outbox.send(msg.channel, f"{ping} An error occurred.")
+                finally:
+                    for fp in [f[1] for f in files]:
+                        fp.close()
 
 # === Launch ===
+async def main():
+    discord.utils.setup_logging()
+    async with bot:
+        background = [
+            asyncio.create_task(store.run_flusher()),
+            asyncio.create_task(catalog.run_refresher()),
+            asyncio.create_task(memory.run_sweeper()),
+            asyncio.create_task(meter.run_flusher()),
+            asyncio.create_task(blobs.run_publisher(images.digests)),
+        ]
+        if shards.is_primary():
+            background.append(asyncio.create_task(blobs.run_collector(referenced_images)))
+        if config.WATCHDOG_STALL > 0:
+            background.append(asyncio.create_task(watchdog.run()))
+        metrics.open_log()
+        for name, component in (("scheduler", scheduler), ("memory", memory), ("outbox", outbox), ("cache", response_cache),
+                                ("usage", meter), ("images", images)):
+            metrics.add_collector(name, component.snapshot)
+        metrics.add_collector("encode", encode.snapshot)
+        metrics.add_collector("loop", watchdog.snapshot)
+        metrics_runner = await metrics.serve(port=shards.port_offset(config.METRICS_PORT))
+        try:
+            await bot.start(DISCORD_TOKEN)
+        finally:
+            for task in background:
+                task.cancel()
+            images.close()
+            if metrics_runner:
+                await metrics_runner.cleanup()
+            await client.close_session()
+            store.close()
+            meter.close()
+
 if __name__ == "__main__":
     try:
-        bot.run(DISCORD_TOKEN)
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"[FATAL] bot.run raised: {str(e)}")
         traceback.print_exc()
\ No newline at end of file
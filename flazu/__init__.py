@@ -0,0 +1 @@
+"""Shared runtime for the Flazu Discord bots (chat31.py and code.py)."""
@@ -0,0 +1,213 @@
+"""Content-addressed storage for vision images.
+
+Conversation history keeps a small ``image_ref`` part (sha256 + mime) instead
+of an inline base64 data URL. The bytes live once on disk under ``BLOB_DIR``
+and are turned back into (cached, pre-encoded) data URLs only when a
+request body is built.
+
+Blobs named by stored conversations are found by scanning the store. Blobs
+only an in-memory cache points at (ingested or generated images) are
+*published*: every process sharing the directory periodically writes its
+cached digests to ``pins/<owner>``, and collection keeps everything named
+by a pin file that is still being refreshed, whichever process runs it.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flazu import config, encode
+from flazu.messages import ImageRef, ImageUrl
+
+SHA_RE = re.compile(r'"sha256"\s*:\s*"([0-9a-f]{64})"')
+DATA_URL_RE = re.compile(r"^data:([\w/+.-]+);base64,(.*)$", re.DOTALL)
+PINS_DIR = "pins"
+
+
+def image_ref(digest, mime):
+    return ImageRef(digest, mime)
+
+
+def is_image_part(part):
+    return isinstance(part, (ImageRef, ImageUrl))
+
+
+def digests_in(texts):
+    """Collect every blob digest referenced by the given JSON strings."""
+    found = set()
+    for text in texts:
+        found.update(SHA_RE.findall(text))
+    return found
+
+
+class BlobStore:
+    def __init__(self, root=None, cache_bytes=None):
+        self.root = root or config.BLOB_DIR
+        self.cache_bytes = config.BLOB_CACHE_BYTES if cache_bytes is None else cache_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._cache = OrderedDict()
+        self._cached = 0
+        self._lock = threading.Lock()
+        self.owner = uuid.uuid4().hex  # This process's pin file
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data, mime):
+        """Store ``data`` (deduplicated by hash) and return its ``image_ref`` part."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return image_ref(digest, mime)
+
+    def touch(self, digest):
+        """Refresh a blob's mtime so collection spares it; False if it is gone."""
+        try:
+            os.utime(self._path(digest))
+            return True
+        except OSError:
+            return False
+
+    def get(self, digest):
+        with open(self._path(digest), "rb") as f:
+            return f.read()
+
+    # --- request building ---
+    def image_part(self, ref):
+        """Encoded ``image_url`` request part for ``ref``, as a base64 data URL.
+
+        Parts are cached (LRU, ``BLOB_CACHE_BYTES``) so an image that stays in
+        the context window is read and encoded once, not once per request.
+        """
+        key = (ref.sha256, ref.mime)
+        with self._lock:
+            part = self._cache.get(key)
+            if part is not None:
+                self._cache.move_to_end(key)
+                return part
+        try:
+            data = self.get(ref.sha256)
+        except OSError:
+            print(f"[WARN] Missing image blob {ref.sha256[:12]}, dropping it from the request.")
+            return encode.OMITTED_IMAGE
+        url = f"data:{ref.mime};base64,{base64.b64encode(data).decode('ascii')}"
+        part = encode.dumps({"type": "image_url", "image_url": {"url": url}})
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = part
+                self._cached += len(part)
+            while self._cached > self.cache_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._cached -= len(old)
+        return part
+
+    # --- migration ---
+    def externalize(self, history):
+        """Move inline base64 images of ``history`` into the store, in place.
+
+        Returns True when anything changed.
+        """
+        changed = False
+        for m in history:
+            if isinstance(m.content, str):
+                continue
+            parts = list(m.content)
+            for i, part in enumerate(parts):
+                match = DATA_URL_RE.match(part.url) if isinstance(part, ImageUrl) else None
+                if match:
+                    parts[i] = self.put(base64.b64decode(match.group(2)), match.group(1))
+            if parts != list(m.content):
+                m.content = tuple(parts)
+                changed = True
+        return changed
+
+    # --- references held in memory, shared across processes ---
+    def publish(self, digests):
+        """Replace this process's pin file with ``digests``."""
+        folder = os.path.join(self.root, PINS_DIR)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, self.owner)
+        with open(f"{path}.tmp", "w", encoding="ascii") as f:
+            f.write("\n".join(sorted(digests)))
+        os.replace(f"{path}.tmp", path)
+
+    def pinned(self, max_age):
+        """Digests in pin files refreshed within ``max_age`` seconds; older ones belong to gone processes."""
+        folder = os.path.join(self.root, PINS_DIR)
+        found = set()
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return found
+        now = time.time()
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                if name.endswith(".tmp"):
+                    continue
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    continue
+                with open(path, "r", encoding="ascii") as f:
+                    found.update(f.read().split())
+            except OSError:
+                pass
+        return found
+
+    async def run_publisher(self, cached, interval=None):
+        """Background task: publish ``cached()`` every ``BLOB_PIN_INTERVAL`` seconds."""
+        interval = config.BLOB_PIN_INTERVAL if interval is None else interval
+        while True:
+            try:
+                digests = cached()
+                await asyncio.to_thread(self.publish, digests)
+            except Exception as e:
+                print(f"[ERROR] Unable to publish cached image references: {e}")
+            await asyncio.sleep(interval)
+
+    # --- garbage collection ---
+    def collect(self, referenced, grace=None):
+        """Delete blobs not in ``referenced`` or any live pin file and untouched for ``grace`` seconds."""
+        grace = config.BLOB_GC_GRACE if grace is None else grace
+        cutoff = time.time() - grace
+        referenced = set(referenced) | self.pinned(max(grace, 2 * config.BLOB_PIN_INTERVAL))
+        removed = 0
+        for sub in os.listdir(self.root):
+            folder = os.path.join(self.root, sub)
+            if sub == PINS_DIR or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                if name in referenced or name.endswith(".tmp"):
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    async def run_collector(self, referenced, interval=None):
+        """Background task: periodically drop blobs ``referenced()`` no longer names."""
+        interval = config.BLOB_GC_INTERVAL if interval is None else interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await asyncio.to_thread(lambda: self.collect(referenced()))
+                if removed:
+                    print(f"[INFO] Image store: removed {removed} unreferenced blobs.")
+            except Exception as e:
+                print(f"[ERROR] Image store collection failed: {e}")
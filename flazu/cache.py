@@ -0,0 +1,159 @@
+"""Small in-memory caches shared by the ingestion and response layers."""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flazu import config
+from flazu.messages import to_json
+
+
+class TTLCache:
+    """LRU mapping whose entries also expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def values(self):
+        """Unexpired values, oldest first."""
+        now = time.monotonic()
+        return [value for expires, value in list(self._data.values()) if expires >= now]
+
+    def __len__(self):
+        return len(self._data)
+
+
+ALL_CHANNELS = object()
+
+
+def _parse_channels(value):
+    value = (value or "").strip()
+    if value == "*":
+        return ALL_CHANNELS
+    return {int(v) for v in value.split(",") if v.strip().isdigit()}
+
+
+class ResponseCache:
+    """Completion cache with single-flight coalescing.
+
+    Keys hash (model, messages, parameters). Lookups go to an in-memory
+    LRU+TTL tier first, then an optional SQLite tier on disk; concurrent
+    misses for the same key share one upstream call.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, disk_path=None, channels=None):
+        self.ttl = config.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self._memory = TTLCache(config.RESPONSE_CACHE_SIZE if maxsize is None else maxsize, self.ttl)
+        self._channels = _parse_channels(config.RESPONSE_CACHE_CHANNELS if channels is None else channels)
+        self._inflight = {}
+        self._disk = None
+        self._disk_lock = threading.Lock()
+        disk_path = config.RESPONSE_CACHE_DISK if disk_path is None else disk_path
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    def enabled_for(self, channel_id):
+        return self._channels is ALL_CHANNELS or channel_id in self._channels
+
+    @staticmethod
+    def key(model, messages, params=None):
+        raw = json.dumps([model, messages, params or {}], sort_keys=True, ensure_ascii=False,
+                         separators=(",", ":"), default=to_json)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_fetch(self, key, fetch):
+        """Return the cached reply for ``key`` or await ``fetch()`` exactly once."""
+        reply = self._memory.get(key)
+        if reply is not None:
+            self.stats["hits"] += 1
+            return reply
+        # Every caller, the first included, waits through a shield so one going away doesn't cancel the rest
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch_shared(key, fetch))
+            # Retrieve the error even if every caller has gone, so it isn't logged as never retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _fetch_shared(self, key, fetch):
+        try:
+            reply = await self._disk_get(key)
+            if reply is not None:
+                self.stats["disk_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                reply = await fetch()
+                await self._disk_set(key, reply)
+        finally:
+            self._inflight.pop(key, None)
+        self._memory.set(key, reply)
+        return reply
+
+    async def _disk_get(self, key):
+        if self._disk is None:
+            return None
+
+        def read():
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT reply FROM responses WHERE key = ? AND expires > ?", (key, time.time())
+                ).fetchone()
+            return row[0] if row else None
+
+        return await asyncio.to_thread(read)
+
+    async def _disk_set(self, key, reply):
+        if self._disk is None:
+            return
+
+        def write():
+            now = time.time()
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, reply, expires) VALUES (?, ?, ?)",
+                    (key, reply, now + self.ttl),
+                )
+                self._disk.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+
+        await asyncio.to_thread(write)
+
+    def snapshot(self):
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        hit_rate = (lookups - self.stats["misses"]) / lookups if lookups else 0.0
+        return dict(self.stats, entries=len(self._memory), inflight=len(self._inflight), hit_rate=round(hit_rate, 3))
@@ -0,0 +1,201 @@
+"""Cached ``/v1/models`` catalog with a capability index.
+
+The last good listing is kept on disk, so a restart can validate ``/model``
+and route vision requests before the API has answered. A background task
+refreshes the listing once it is older than ``MODEL_CATALOG_TTL``.
+
+Capabilities come from whatever the listing advertises (``capabilities``,
+``input_modalities``, ``architecture.input_modalities``, ...). Models whose
+entry says nothing fall back to well-known name patterns. Every lookup is a
+dict or set membership test.
+"""
+import asyncio
+import json
+import os
+import time
+
+from flazu import client, config, tokens
+
+VISION_PATTERNS = ("gpt-4o", "gpt-4.1", "gpt-4-turbo", "gpt-4-vision", "gpt-5", "o1", "o3", "o4",
+                   "chatgpt-4o", "claude-3", "claude-sonnet", "claude-opus", "claude-haiku", "gemini",
+                   "pixtral", "llava", "qwen-vl", "qwen2-vl", "grok-2-vision", "llama-3.2-90b-vision")
+IMAGE_GEN_PATTERNS = ("dall-e", "gpt-image", "flux", "stable-diffusion", "sdxl", "imagen", "midjourney",
+                      "playground-v")
+NON_VISION_PATTERNS = ("o1-mini", "o3-mini", "gpt-4o-audio", "gpt-4o-realtime", "gpt-4o-transcribe",
+                       "gpt-4o-mini-tts", "embedding", "whisper", "tts")
+
+
+def _modalities(entry):
+    found = set()
+    for holder in (entry, entry.get("architecture") or {}):
+        for key in ("input_modalities", "modalities"):
+            value = holder.get(key)
+            if isinstance(value, list):
+                found.update(str(v).lower() for v in value)
+            elif isinstance(value, dict):
+                found.update(str(v).lower() for v in value.get("input", []))
+        modality = holder.get("modality")
+        if isinstance(modality, str) and "->" in modality:
+            found.update(modality.split("->")[0].split("+"))
+    return found
+
+
+def _advertised(entry, capability):
+    """True/False if the entry says, None if it doesn't."""
+    caps = entry.get("capabilities")
+    if isinstance(caps, dict) and capability in caps:
+        return bool(caps[capability])
+    if isinstance(caps, list):
+        return capability in caps
+    flag = entry.get(f"supports_{capability}")
+    if isinstance(flag, bool):
+        return flag
+    if capability == "vision":
+        modalities = _modalities(entry)
+        if modalities:
+            return "image" in modalities
+    return None
+
+
+def _guess_vision(model):
+    model = model.lower()
+    if any(p in model for p in NON_VISION_PATTERNS):
+        return False
+    return model.startswith(VISION_PATTERNS) or "vision" in model or "-vl" in model
+
+
+def _guess_image_generation(model):
+    return model.lower().startswith(IMAGE_GEN_PATTERNS)
+
+
+class ModelCatalog:
+    def __init__(self, models_url, api_key, path=None, ttl=None):
+        self.models_url = models_url
+        self.api_key = api_key
+        self.path = config.MODEL_CATALOG_FILE if path is None else path
+        self.ttl = config.MODEL_CATALOG_TTL if ttl is None else ttl
+        self.fetched_at = 0.0
+        self.ids = []
+        self._entries = {}
+        self._vision = set()
+        self._image_gen = set()
+        self._guessed = {}
+        self._refreshing = None
+
+    def __contains__(self, model):
+        return model in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _index(self, entries):
+        by_id = {}
+        vision, image_gen = set(), set()
+        for entry in entries:
+            model = entry.get("id")
+            if not model:
+                continue
+            by_id[model] = entry
+            says = _advertised(entry, "vision")
+            if says if says is not None else _guess_vision(model):
+                vision.add(model)
+            says = _advertised(entry, "image_generation")
+            if says if says is not None else _guess_image_generation(model):
+                image_gen.add(model)
+        tokens.register_models(entries)
+        self._entries, self._vision, self._image_gen = by_id, vision, image_gen
+        self.ids = sorted(by_id)
+        self._guessed.clear()
+
+    def load(self):
+        """Warm start from the last listing saved on disk."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self._index(saved.get("data", []))
+            self.fetched_at = float(saved.get("fetched_at", 0))
+            print(f"[INFO] Model catalog loaded from {self.path} ({len(self)} models).")
+        except FileNotFoundError:
+            print(f"[INFO] No {self.path} found; models will be fetched in the background.")
+        except Exception as e:
+            print(f"[WARN] Unable to load {self.path}: {str(e)}. Fetching models in the background.")
+
+    def _save(self, entries):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "data": entries}, f)
+        os.replace(tmp, self.path)
+
+    async def _fetch(self):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        try:
+            data = await client.get_json(self.models_url, headers=headers, timeout=30)
+        except Exception as e:
+            print(f"[ERROR] Unable to retrieve models: {str(e)}")
+            return False
+        entries = [e for e in data.get("data", []) if isinstance(e, dict)]
+        if not entries:
+            print("[WARN] Model listing came back empty; keeping the previous catalog.")
+            return False
+        self.fetched_at = time.time()
+        self._index(entries)
+        try:
+            await asyncio.to_thread(self._save, entries)
+        except Exception as e:
+            print(f"[WARN] Unable to save {self.path}: {str(e)}")
+        print(f"[INFO] Model catalog refreshed ({len(self)} models, {len(self._vision)} with vision).")
+        return True
+
+    async def refresh(self):
+        """Fetch the listing now; concurrent callers share one request."""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._fetch())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        return await asyncio.shield(self._refreshing)
+
+    def stale(self):
+        return time.time() - self.fetched_at >= self.ttl
+
+    async def run_refresher(self):
+        """Background task: refresh whenever the listing is older than the TTL."""
+        while True:
+            if self.stale():
+                ok = await self.refresh()
+                wait = self.ttl if ok else min(self.ttl, config.MODEL_CATALOG_RETRY)
+            else:
+                wait = self.ttl - (time.time() - self.fetched_at)
+            await asyncio.sleep(max(wait, 1.0))
+
+    def supports_vision(self, model):
+        if model in self._entries:
+            return model in self._vision
+        if model not in self._guessed:
+            self._guessed[model] = _guess_vision(model)
+        return self._guessed[model]
+
+    def generates_images(self, model):
+        if model in self._entries:
+            return model in self._image_gen
+        return _guess_image_generation(model)
+
+    def context_window(self, model):
+        return tokens.context_window(model)
+
+    def vision_model(self, preferred=None):
+        """A vision-capable model for image turns: the configured default if available."""
+        for model in (preferred, config.VISION_MODEL):
+            if model and (model in self._vision or (not self._entries and _guess_vision(model))):
+                return model
+        return min(self._vision) if self._vision else config.VISION_MODEL
+
+    def describe(self, model):
+        """``model`` with its capability tags, e.g. ``gpt-4o (vision, 128k)``."""
+        tags = []
+        if model in self._vision:
+            tags.append("vision")
+        if model in self._image_gen:
+            tags.append("image")
+        window = tokens.advertised_context(model)
+        if window:
+            tags.append(f"{window // 1000}k")
+        return f"{model} ({', '.join(tags)})" if tags else model
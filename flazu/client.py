@@ -0,0 +1,149 @@
+"""Shared keep-alive aiohttp session for every outbound HTTP call.
+
+One pooled session is created lazily inside the running event loop and reused
+by both bots, so concurrent chats share warm TCP/TLS connections instead of
+opening a new one per request.
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from flazu import config, encode
+
+# Exception aliases so callers don't need to import aiohttp themselves.
+# Timeout must be caught before RequestError: aiohttp's timeout errors are both.
+Timeout = asyncio.TimeoutError
+RequestError = aiohttp.ClientError
+
+_session = None
+_observers = []
+
+
+def _build_session():
+    connector = aiohttp.TCPConnector(
+        limit=config.HTTP_POOL_LIMIT,
+        limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=config.HTTP_KEEPALIVE,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=config.HTTP_CONNECT_TIMEOUT,
+        sock_read=config.HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, json_serialize=encode.dumps_str)
+
+
+def get_session():
+    """Return the shared session, creating it on first use."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _build_session()
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _timeout(seconds):
+    return aiohttp.ClientTimeout(total=seconds) if seconds else None
+
+
+def add_response_observer(callback):
+    """Call ``callback(url, status, headers)`` for every API response (e.g. to learn rate limits)."""
+    _observers.append(callback)
+
+
+def _observe(resp):
+    for callback in _observers:
+        try:
+            callback(resp.url, resp.status, resp.headers)
+        except Exception as e:
+            print(f"[WARN] Response observer failed: {e}")
+
+
+def _body(payload, headers):
+    """Request kwargs for a dict payload or a pre-encoded ``encode.Body``."""
+    if isinstance(payload, encode.Body):
+        return {"data": payload.encode(), "headers": dict(headers or {}, **{"Content-Type": "application/json"})}
+    return {"json": payload, "headers": headers}
+
+
+async def post_json(url, payload, headers=None, timeout=120):
+    async with get_session().post(url, timeout=_timeout(timeout), **_body(payload, headers)) as resp:
+        _observe(resp)
+        resp.raise_for_status()
+        return await resp.json(content_type=None)
+
+
+async def get_json(url, headers=None, params=None, timeout=10):
+    async with get_session().get(url, headers=headers, params=params, timeout=_timeout(timeout)) as resp:
+        _observe(resp)
+        resp.raise_for_status()
+        return await resp.json(content_type=None)
+
+
+async def get_text(url, headers=None, params=None, timeout=30):
+    async with get_session().get(url, headers=headers, params=params, timeout=_timeout(timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.text()
+
+
+async def get_bytes(url, headers=None, timeout=15):
+    """Download a URL and return ``(body, content_type)``."""
+    async with get_session().get(url, headers=headers, timeout=_timeout(timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.read(), resp.headers.get("Content-Type", "")
+
+
+async def stream_sse(url, payload, headers=None, timeout=120):
+    """POST ``payload`` and yield each decoded JSON event of an SSE response.
+
+    Servers that ignore ``stream: true`` and answer with plain JSON are
+    tolerated: the whole body is yielded as a single event.
+    """
+    async with get_session().post(url, timeout=_timeout(timeout), **_body(payload, headers)) as resp:
+        _observe(resp)
+        resp.raise_for_status()
+        if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+            yield await resp.json(content_type=None)
+            return
+        async for raw in resp.content:
+            line = raw.decode("utf-8", "replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            try:
+                yield json.loads(data)
+            except ValueError:
+                continue
+
+
+class TooLarge(ValueError):
+    pass
+
+
+async def get_bytes_capped(url, max_bytes, headers=None, timeout=15):
+    """Stream a download, aborting once it exceeds ``max_bytes``.
+
+    Returns ``(body, content_type)``; raises ``TooLarge`` past the ceiling.
+    """
+    async with get_session().get(url, headers=headers, timeout=_timeout(timeout)) as resp:
+        resp.raise_for_status()
+        if resp.content_length is not None and resp.content_length > max_bytes:
+            raise TooLarge(f"{resp.content_length} bytes exceeds the {max_bytes} byte limit")
+        chunks = []
+        size = 0
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise TooLarge(f"body exceeds the {max_bytes} byte limit")
+            chunks.append(chunk)
+        return b"".join(chunks), resp.headers.get("Content-Type", "")
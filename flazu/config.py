@@ -0,0 +1,208 @@
+"""Runtime settings shared by both bots, read once from the environment."""
+import os
+
+
+def env_str(name, default=""):
+    value = os.getenv(name)
+    return value.strip() if value is not None and value.strip() else default
+
+
+def env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"[WARN] Invalid integer for {name}, using {default}.")
+        return default
+
+
+def env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"[WARN] Invalid number for {name}, using {default}.")
+        return default
+
+
+def env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# === Flazu API ===
+# Base URL of the OpenAI-compatible API (point it at bench/mock_flazu.py for load tests)
+API_BASE = env_str("FLAZU_API_BASE", "https://ai.flazu.my/v1").rstrip("/")
+
+# === HTTP client pool ===
+HTTP_POOL_LIMIT = env_int("FLAZU_HTTP_POOL_LIMIT", 200)
+HTTP_POOL_LIMIT_PER_HOST = env_int("FLAZU_HTTP_POOL_LIMIT_PER_HOST", 64)
+HTTP_KEEPALIVE = env_float("FLAZU_HTTP_KEEPALIVE", 60.0)
+HTTP_CONNECT_TIMEOUT = env_float("FLAZU_HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT = env_float("FLAZU_HTTP_READ_TIMEOUT", 120.0)
+
+# === Streaming replies ===
+STREAM_REPLIES = env_bool("FLAZU_STREAM_REPLIES", True)
+STREAM_EDIT_INTERVAL = env_float("FLAZU_STREAM_EDIT_INTERVAL", 1.2)
+
+# === Conversation store ===
+MEMORY_FLUSH_INTERVAL = env_float("FLAZU_MEMORY_FLUSH_INTERVAL", 1.0)
+MEMORY_FLUSH_BATCH = env_int("FLAZU_MEMORY_FLUSH_BATCH", 256)
+
+# === Image blob store ===
+BLOB_DIR = env_str("FLAZU_BLOB_DIR", "blobs")
+BLOB_CACHE_BYTES = env_int("FLAZU_BLOB_CACHE_BYTES", 64 * 1024 * 1024)
+BLOB_GC_INTERVAL = env_float("FLAZU_BLOB_GC_INTERVAL", 3600.0)
+BLOB_GC_GRACE = env_float("FLAZU_BLOB_GC_GRACE", 600.0)
+# How often each process republishes the blobs its caches hold (keep it well under the grace period)
+BLOB_PIN_INTERVAL = env_float("FLAZU_BLOB_PIN_INTERVAL", 120.0)
+# Images are only resent for the most recent N user turns (0 keeps them all)
+IMAGE_HISTORY_TURNS = env_int("FLAZU_IMAGE_HISTORY_TURNS", 4)
+
+# === Image ingestion ===
+INGEST_CONCURRENCY = env_int("FLAZU_INGEST_CONCURRENCY", 8)
+INGEST_MAX_BYTES = env_int("FLAZU_INGEST_MAX_BYTES", 20 * 1024 * 1024)
+INGEST_TIMEOUT = env_float("FLAZU_INGEST_TIMEOUT", 15.0)
+INGEST_CACHE_TTL = env_float("FLAZU_INGEST_CACHE_TTL", 3600.0)
+INGEST_CACHE_SIZE = env_int("FLAZU_INGEST_CACHE_SIZE", 1024)
+
+# === Image preprocessing (requires Pillow) ===
+IMAGE_PREP = env_bool("FLAZU_IMAGE_PREP", True)
+IMAGE_MAX_DIM = env_int("FLAZU_IMAGE_MAX_DIM", 1568)
+IMAGE_FORMAT = env_str("FLAZU_IMAGE_FORMAT", "webp")
+IMAGE_QUALITY = env_int("FLAZU_IMAGE_QUALITY", 80)
+IMAGE_PREP_WORKERS = env_int("FLAZU_IMAGE_PREP_WORKERS", 2)
+
+# === Context budgeting ===
+IMAGE_TOKENS = env_int("FLAZU_IMAGE_TOKENS", 850)
+COMPLETION_RESERVE = env_int("FLAZU_COMPLETION_RESERVE", 1024)
+CONTEXT_SAFETY_TOKENS = env_int("FLAZU_CONTEXT_SAFETY_TOKENS", 256)
+# Hard ceiling on prompt tokens per request regardless of the model window (0 = no ceiling)
+MAX_PROMPT_TOKENS = env_int("FLAZU_MAX_PROMPT_TOKENS", 32000)
+
+# === Rolling summarization ===
+SUMMARY_ENABLED = env_bool("FLAZU_SUMMARY_ENABLED", True)
+SUMMARY_MODEL = env_str("FLAZU_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_TRIGGER_TOKENS = env_int("FLAZU_SUMMARY_TRIGGER_TOKENS", 6000)
+SUMMARY_TRIGGER_MESSAGES = env_int("FLAZU_SUMMARY_TRIGGER_MESSAGES", 40)
+SUMMARY_KEEP_MESSAGES = env_int("FLAZU_SUMMARY_KEEP_MESSAGES", 8)
+SUMMARY_MAX_TOKENS = env_int("FLAZU_SUMMARY_MAX_TOKENS", 400)
+SUMMARY_INPUT_CHARS = env_int("FLAZU_SUMMARY_INPUT_CHARS", 24000)
+# After a failed summarization, wait this long before trying that user again (doubling per failure)
+SUMMARY_RETRY_BASE = env_float("FLAZU_SUMMARY_RETRY_BASE", 60.0)
+SUMMARY_RETRY_MAX = env_float("FLAZU_SUMMARY_RETRY_MAX", 3600.0)
+
+# === Response cache ===
+# Channel ids (comma separated) whose requests may be answered from cache, "*" for all, empty disables
+RESPONSE_CACHE_CHANNELS = env_str("FLAZU_RESPONSE_CACHE_CHANNELS", "")
+RESPONSE_CACHE_SIZE = env_int("FLAZU_RESPONSE_CACHE_SIZE", 2048)
+RESPONSE_CACHE_TTL = env_float("FLAZU_RESPONSE_CACHE_TTL", 6 * 3600.0)
+RESPONSE_CACHE_DISK = env_str("FLAZU_RESPONSE_CACHE_DISK", "")
+# Answer `,` quick-chat without reading or writing the user's history (makes it cacheable)
+QUICK_CHAT_STATELESS = env_bool("FLAZU_QUICK_CHAT_STATELESS", False)
+
+# === Typing indicator ===
+# Discord shows "typing" for ~10s per trigger; refresh a little before it lapses
+TYPING_REFRESH = env_float("FLAZU_TYPING_REFRESH", 8.0)
+
+# === Request scheduler ===
+SCHED_MAX_INFLIGHT = env_int("FLAZU_SCHED_MAX_INFLIGHT", 32)
+# Tell users their queue position once they are at least this far back
+SCHED_NOTIFY_POSITION = env_int("FLAZU_SCHED_NOTIFY_POSITION", 5)
+SCHED_MAX_QUEUE = env_int("FLAZU_SCHED_MAX_QUEUE", 500)
+# "id:weight,..." for users or guilds that deserve a larger (or smaller) share
+SCHED_WEIGHTS = env_str("FLAZU_SCHED_WEIGHTS", "")
+
+# === Upstream resilience ===
+# Client-side pacing; 0 means unpaced until the API's x-ratelimit-* headers are seen
+RATE_LIMIT_RPS = env_float("FLAZU_RATE_LIMIT_RPS", 0.0)
+RATE_LIMIT_BURST = env_float("FLAZU_RATE_LIMIT_BURST", 10.0)
+RATE_LIMIT_BURST_SECONDS = env_float("FLAZU_RATE_LIMIT_BURST_SECONDS", 10.0)
+RETRY_ATTEMPTS = env_int("FLAZU_RETRY_ATTEMPTS", 3)
+RETRY_BASE_DELAY = env_float("FLAZU_RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = env_float("FLAZU_RETRY_MAX_DELAY", 20.0)
+BREAKER_FAILURES = env_int("FLAZU_BREAKER_FAILURES", 5)
+BREAKER_RESET = env_float("FLAZU_BREAKER_RESET", 30.0)
+FALLBACK_MODEL = env_str("FLAZU_FALLBACK_MODEL", "")
+
+# === Model routing ===
+# Groups of interchangeable models, "a,b,c;d,e"; requests for a member go to the fastest healthy one
+ROUTER_GROUPS = env_str("FLAZU_ROUTER_GROUPS", "")
+# Seconds before a slow request is duplicated to the next-best model in its group (0 = no hedging)
+ROUTER_HEDGE_DELAY = env_float("FLAZU_ROUTER_HEDGE_DELAY", 0.0)
+ROUTER_WINDOW = env_int("FLAZU_ROUTER_WINDOW", 200)
+ROUTER_MIN_SAMPLES = env_int("FLAZU_ROUTER_MIN_SAMPLES", 5)
+ROUTER_MAX_ERROR_RATE = env_float("FLAZU_ROUTER_MAX_ERROR_RATE", 0.5)
+
+# === Model catalog ===
+MODEL_CATALOG_FILE = env_str("FLAZU_MODEL_CATALOG_FILE", "models.json")
+MODEL_CATALOG_TTL = env_float("FLAZU_MODEL_CATALOG_TTL", 3600.0)
+# How soon to try again after a failed refresh
+MODEL_CATALOG_RETRY = env_float("FLAZU_MODEL_CATALOG_RETRY", 60.0)
+# Used for image turns when the selected model has no vision support
+VISION_MODEL = env_str("FLAZU_VISION_MODEL", "gpt-5.1")
+
+# === Conversation working set ===
+# Idle conversations are dropped from memory after this many seconds (0 = never)
+WORKING_SET_TTL = env_float("FLAZU_WORKING_SET_TTL", 1800.0)
+WORKING_SET_MAX_BYTES = env_int("FLAZU_WORKING_SET_MAX_BYTES", 256 * 1024 * 1024)
+WORKING_SET_MAX_USERS = env_int("FLAZU_WORKING_SET_MAX_USERS", 0)
+WORKING_SET_SWEEP_INTERVAL = env_float("FLAZU_WORKING_SET_SWEEP_INTERVAL", 60.0)
+
+# === Request encoding ===
+# Encoded JSON of stored messages kept for reuse across requests
+ENCODE_CACHE_BYTES = env_int("FLAZU_ENCODE_CACHE_BYTES", 32 * 1024 * 1024)
+
+# === Sharding ===
+# Total shard count across all processes (0 = one unsharded process) and the ids this process runs
+SHARD_COUNT = env_int("FLAZU_SHARD_COUNT", 0)
+SHARD_IDS = env_str("FLAZU_SHARD_IDS", "")
+# How stale a process's copy of shared state (conversations, global model) may get, in seconds
+SHARED_STATE_CHECK = env_float("FLAZU_SHARED_STATE_CHECK", 1.0)
+
+# === Outbound Discord messages ===
+OUTBOX_RETRIES = env_int("FLAZU_OUTBOX_RETRIES", 3)
+OUTBOX_RETRY_DELAY = env_float("FLAZU_OUTBOX_RETRY_DELAY", 1.0)
+# Discord allows about 5 messages per 5 seconds per channel
+OUTBOX_CHANNEL_RATE = env_int("FLAZU_OUTBOX_CHANNEL_RATE", 5)
+OUTBOX_CHANNEL_PER = env_float("FLAZU_OUTBOX_CHANNEL_PER", 5.0)
+# How long a small send waits for others to merge with (0 = only merge what is already queued)
+OUTBOX_BATCH_WINDOW = env_float("FLAZU_OUTBOX_BATCH_WINDOW", 0.0)
+
+# === Metrics ===
+# Local Prometheus endpoint (0 = off); sharded workers add their first shard id to the port
+METRICS_PORT = env_int("FLAZU_METRICS_PORT", 0)
+METRICS_HOST = env_str("FLAZU_METRICS_HOST", "127.0.0.1")
+# Append one JSON line with per-stage timings for every request (empty = off)
+METRICS_LOG = env_str("FLAZU_METRICS_LOG", "")
+
+# === Event loop watchdog ===
+# Record and report event-loop stalls longer than this many seconds (0 = off)
+WATCHDOG_STALL = env_float("FLAZU_WATCHDOG_STALL", 0.0)
+WATCHDOG_INTERVAL = env_float("FLAZU_WATCHDOG_INTERVAL", 0.1)
+WATCHDOG_REPORT_INTERVAL = env_float("FLAZU_WATCHDOG_REPORT_INTERVAL", 300.0)
+
+# === Usage metering ===
+USAGE_FLUSH_INTERVAL = env_float("FLAZU_USAGE_FLUSH_INTERVAL", 10.0)
+# Quotas per rolling window (0 = unlimited); the window is at most 48 hours
+USAGE_QUOTA_WINDOW = env_float("FLAZU_USAGE_QUOTA_WINDOW", 86400.0)
+USAGE_USER_TOKENS = env_int("FLAZU_USAGE_USER_TOKENS", 0)
+USAGE_GUILD_TOKENS = env_int("FLAZU_USAGE_GUILD_TOKENS", 0)
+USAGE_USER_IMAGES = env_int("FLAZU_USAGE_USER_IMAGES", 0)
+USAGE_GUILD_IMAGES = env_int("FLAZU_USAGE_GUILD_IMAGES", 0)
+# "id:tokens,..." token quota for specific users or guilds, overriding the defaults (0 = unlimited)
+USAGE_QUOTA_OVERRIDES = env_str("FLAZU_USAGE_QUOTA_OVERRIDES", "")
+# "model:in:out" USD per 1M prompt/completion tokens, or "model:per_image", comma separated (cost estimates)
+USAGE_PRICES = env_str("FLAZU_USAGE_PRICES", "")
+
+# === Image generation ===
+IMAGEGEN_MODEL = env_str("FLAZU_IMAGEGEN_MODEL", "dall-e-3")
+IMAGEGEN_SIZE = env_str("FLAZU_IMAGEGEN_SIZE", "1024x1024")
+IMAGEGEN_WORKERS = env_int("FLAZU_IMAGEGEN_WORKERS", 2)
+IMAGEGEN_MAX_QUEUE = env_int("FLAZU_IMAGEGEN_MAX_QUEUE", 50)
+# Most variants one request may ask for (they come back in one call with n > 1 where the model allows)
+IMAGEGEN_MAX_VARIANTS = env_int("FLAZU_IMAGEGEN_MAX_VARIANTS", 4)
+IMAGEGEN_TIMEOUT = env_float("FLAZU_IMAGEGEN_TIMEOUT", 120.0)
+# Results kept as local blobs and reused for identical (prompt, model, size) requests
+IMAGEGEN_CACHE_SIZE = env_int("FLAZU_IMAGEGEN_CACHE_SIZE", 256)
+IMAGEGEN_CACHE_TTL = env_float("FLAZU_IMAGEGEN_CACHE_TTL", 24 * 3600.0)
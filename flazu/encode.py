@@ -0,0 +1,129 @@
+"""Request bodies assembled from pre-encoded message fragments.
+
+A stored message never changes once it is in a history, so its JSON is
+encoded once and cached; building a chat request then only joins byte
+strings. Image parts are cached the same way by the blob store, which is
+where the multi-megabyte base64 goes. Uses orjson when installed and the
+standard library otherwise.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flazu import config
+from flazu.messages import ImageRef, Text
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OMITTED_IMAGE = b'{"type":"text","text":"[image omitted]"}'
+
+stats = {"requests": 0, "bytes": 0, "encode_seconds": 0.0, "fragment_hits": 0, "fragment_misses": 0}
+
+
+def dumps(value):
+    """Compact JSON as bytes."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(value):
+    """Compact JSON as str, for aiohttp's ``json_serialize``."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class Body:
+    """A chat request body whose ``messages`` are already encoded."""
+    __slots__ = ("fragments", "fields")
+
+    def __init__(self, fragments, **fields):
+        self.fragments = fragments
+        self.fields = fields
+
+    def with_fields(self, **fields):
+        return Body(self.fragments, **dict(self.fields, **fields))
+
+    def encode(self):
+        raw = b'{"messages":[' + b",".join(self.fragments) + b"]"
+        raw += b"," + dumps(self.fields)[1:] if self.fields else b"}"
+        stats["requests"] += 1
+        stats["bytes"] += len(raw)
+        return raw
+
+
+class FragmentCache:
+    """Encoded JSON per message object, LRU-bounded by ``ENCODE_CACHE_BYTES``."""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = config.ENCODE_CACHE_BYTES if max_bytes is None else max_bytes
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _text_message(self, m):
+        key = id(m)
+        with self._lock:
+            hit = self._cache.get(key)
+            # The message is kept alongside so its id can't be reused while cached
+            if hit is not None and hit[0] is m and hit[1] is m.content:
+                self._cache.move_to_end(key)
+                stats["fragment_hits"] += 1
+                return hit[2]
+        fragment = dumps({"role": m.role, "content": m.content})
+        with self._lock:
+            stats["fragment_misses"] += 1
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[2])
+            self._cache[key] = (m, m.content, fragment)
+            self._bytes += len(fragment)
+            while self._bytes > self.max_bytes and len(self._cache) > 1:
+                _, (_, _, evicted) = self._cache.popitem(last=False)
+                self._bytes -= len(evicted)
+        return fragment
+
+    def encode(self, msgs, image_part=None, keep_image_turns=0):
+        """Encoded fragments for ``msgs``.
+
+        ``image_part(ref)`` returns the encoded request part for a blob ref;
+        images older than the last ``keep_image_turns`` user turns are
+        replaced by a short placeholder (0 keeps them all).
+        """
+        started = time.perf_counter()
+        out = []
+        user_turns = 0
+        for m in reversed(msgs):
+            if m.role == "user":
+                user_turns += 1
+            if isinstance(m.content, str):
+                out.append(self._text_message(m))
+                continue
+            drop = keep_image_turns > 0 and user_turns > keep_image_turns
+            parts = []
+            for part in m.content:
+                if isinstance(part, Text):
+                    parts.append(dumps(part.to_dict()))
+                elif drop:
+                    parts.append(OMITTED_IMAGE)
+                elif isinstance(part, ImageRef) and image_part is not None:
+                    parts.append(image_part(part))
+                else:
+                    parts.append(dumps(part.to_dict()))
+            out.append(b'{"role":' + dumps(m.role) + b',"content":[' + b",".join(parts) + b"]}")
+        out.reverse()
+        stats["encode_seconds"] += time.perf_counter() - started
+        return out
+
+
+def snapshot():
+    requests = stats["requests"] or 1
+    return dict(stats, encode_seconds=round(stats["encode_seconds"], 3),
+                backend="orjson" if orjson is not None else "json",
+                avg_bytes=stats["bytes"] // requests,
+                avg_encode_ms=round(1000 * stats["encode_seconds"] / requests, 3))
@@ -0,0 +1,180 @@
+"""Fenced code blocks in replies, turned into file attachments.
+
+``FenceParser`` is incremental: feed it text as it arrives and it hands back
+prose and finished code blocks in one pass, holding back only the few
+characters that could still turn out to be a fence. ``extract_code_blocks``
+runs it over a complete reply for the bots.
+
+Fences are recognised the way Discord and CommonMark do it, one whole line
+at a time: optional indentation, a run of three or more backticks and, on an
+opening fence, a short language tag with nothing after it. A block closes at
+a bare run at least as long as the one that opened it, so a four-backtick
+fence can wrap Markdown that has ``` blocks of its own, and an inline
+"```pip install x```" stays prose.
+"""
+import io
+import re
+
+FENCE = "```"
+MAX_MARKER = 16  # Longer backtick runs are not taken for fences
+MAX_LANG = 32
+
+_FENCE_RE = re.compile(rf"[ \t]*(`{{3,{MAX_MARKER}}})([^\s`]{{0,{MAX_LANG}}})[ \t]*\r?")
+# What a line may look like while it can still grow into a fence
+_PREFIX_RE = re.compile(rf"[ \t]*(`{{0,{MAX_MARKER}}}|`{{3,{MAX_MARKER}}}[^\s`]{{0,{MAX_LANG}}}[ \t]*\r?)")
+
+# Fence language (lower-cased) -> attachment extension, shared by both bots
+EXTENSIONS = {
+    "python": ".py", "py": ".py", "python3": ".py",
+    "javascript": ".js", "js": ".js", "jsx": ".jsx", "typescript": ".ts", "ts": ".ts", "tsx": ".tsx",
+    "java": ".java", "kotlin": ".kt", "scala": ".scala", "c": ".c", "h": ".h",
+    "cpp": ".cpp", "c++": ".cpp", "cc": ".cpp", "hpp": ".hpp", "csharp": ".cs", "cs": ".cs", "c#": ".cs",
+    "go": ".go", "golang": ".go", "rust": ".rs", "rs": ".rs", "swift": ".swift", "php": ".php",
+    "ruby": ".rb", "rb": ".rb", "lua": ".lua", "perl": ".pl", "r": ".r", "dart": ".dart",
+    "html": ".html", "xml": ".xml", "css": ".css", "scss": ".scss", "svg": ".svg",
+    "json": ".json", "yaml": ".yaml", "yml": ".yaml", "toml": ".toml", "ini": ".ini", "sql": ".sql",
+    "markdown": ".md", "md": ".md", "bash": ".sh", "shell": ".sh", "sh": ".sh", "zsh": ".sh",
+    "powershell": ".ps1", "ps1": ".ps1", "bat": ".bat", "dockerfile": ".dockerfile",
+    "diff": ".diff", "txt": ".txt", "text": ".txt",
+}
+
+
+def fence_line(line):
+    """``(marker, lang)`` if ``line`` is a fence line, else None; ``lang`` is "" on a bare fence."""
+    match = _FENCE_RE.fullmatch(line)
+    return match.groups() if match else None
+
+
+def extension(lang):
+    return EXTENSIONS.get(lang.lower() if lang else "", ".txt")
+
+
+class Prose:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class CodeBlock:
+    __slots__ = ("lang", "code")
+
+    def __init__(self, lang, code):
+        self.lang = lang
+        self.code = code
+
+
+class FenceParser:
+    def __init__(self):
+        self._buf = ""  # the current, unfinished line
+        self._midline = False  # part of the current line already went out as prose, so it is no fence
+        self._marker = None  # backtick run of the open block; None outside code
+        self._lang = None
+        self._indent = ""  # the opening fence's indentation, removed from its code lines
+        self._code = []
+
+    def feed(self, chunk):
+        """Consume ``chunk`` and return the ``Prose``/``CodeBlock`` segments it completed."""
+        if self._marker is not None and "\n" not in chunk:
+            self._buf += chunk  # Code is only handed out whole; nothing to scan until the line ends
+            return []
+        self._buf += chunk
+        return self._drain(final=False)
+
+    def close(self):
+        """End of input: flush held-back prose and any unterminated block."""
+        return self._drain(final=True)
+
+    def _drain(self, final):
+        out, prose = [], []
+        buf = self._buf
+        pos = 0
+        while True:
+            if self._midline:
+                nl = buf.find("\n", pos)
+                if nl < 0:
+                    break
+                self._midline = False
+                prose.append(buf[pos:nl + 1])
+                pos = nl + 1
+            # Only a line holding ``` can be a fence; everything before that line goes out in bulk
+            tick = buf.find(FENCE, pos)
+            last = buf.rfind("\n", pos, len(buf) if tick < 0 else tick) + 1
+            if last > pos:
+                self._plain(buf[pos:last], prose)
+                pos = last
+            if tick < 0:
+                break
+            nl = buf.find("\n", tick)
+            if nl < 0:
+                break
+            self._line(buf[pos:nl], buf[pos:nl + 1], prose, out)
+            pos = nl + 1
+        rest = buf[pos:]
+        if final:
+            if rest:
+                self._line(rest, rest, prose, out)
+            if self._marker is not None:
+                out.append(self._finish())
+            rest = ""
+        elif self._marker is None and rest and (self._midline or not _PREFIX_RE.fullmatch(rest)):
+            # This line can no longer turn into a fence: hand it out now
+            prose.append(rest)
+            self._midline = True
+            rest = ""
+        if prose:
+            out.append(Prose("".join(prose)))
+        self._buf = rest
+        return out
+
+    def _plain(self, text, prose):
+        """Whole lines that hold no fence."""
+        if self._marker is None:
+            prose.append(text)
+        elif not self._indent:
+            self._code.append(text)
+        else:
+            for raw in text.splitlines(keepends=True):
+                self._code.append(raw[len(self._indent):] if raw.startswith(self._indent) else raw)
+
+    def _line(self, line, raw, prose, out):
+        """Handle one line that may be a fence (``raw`` keeps its newline)."""
+        fence = fence_line(line)
+        if self._marker is None:
+            if fence is None:
+                prose.append(raw)
+                return
+            if prose:
+                out.append(Prose("".join(prose)))
+                prose.clear()
+            self._marker, self._lang = fence
+            self._indent = line[:len(line) - len(line.lstrip(" \t"))]
+        elif fence is not None and not fence[1] and len(fence[0]) >= len(self._marker):
+            out.append(self._finish())
+        else:
+            self._plain(raw, prose)
+
+    def _finish(self):
+        block = CodeBlock(self._lang, "".join(self._code).strip("\n"))
+        self._marker = self._lang = None
+        self._code = []
+        return block
+
+
+def extract_code_blocks(reply):
+    """Split ``reply`` into message text and ``[(filename, file object), ...]`` code attachments."""
+    parser = FenceParser()
+    gaps, current, files = [], [], []
+    for segment in parser.feed(reply) + parser.close():
+        if isinstance(segment, Prose):
+            current.append(segment.text)
+            continue
+        gaps.append("".join(current))
+        current = []
+        if not segment.code.strip():
+            continue
+        ext = extension(segment.lang)
+        name = f"code{ext}" if not files else f"code_{len(files) + 1}{ext}"
+        files.append((name, io.BytesIO(segment.code.encode("utf-8"))))
+    gaps.append("".join(current))
+    return "\n".join(gap.strip() for gap in gaps if gap.strip()), files
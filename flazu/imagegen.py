@@ -0,0 +1,216 @@
+"""Image generation as background jobs with a local result cache.
+
+Requests become jobs served by a pool of ``IMAGEGEN_WORKERS`` workers, and
+callers are told their queue position while they wait. Generated images are
+downloaded into the blob store as soon as they arrive, since the API's URLs
+expire. They are cached by (prompt, model, size), so an identical prompt is
+answered from disk and re-uploaded as attachments. Identical requests in
+flight share one job, and several variants are asked for in a single call
+with ``n`` > 1 unless the model has rejected that before.
+"""
+import asyncio
+import base64
+import io
+import time
+from collections import deque
+
+from flazu import client, config
+from flazu.cache import TTLCache
+from flazu.ingest import sniff_mime
+from flazu.scheduler import Overloaded
+
+EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/gif": ".gif", "image/webp": ".webp"}
+
+
+class GenerationFailed(Exception):
+    pass
+
+
+class GeneratedImages:
+    __slots__ = ("refs", "model", "fresh", "latency")
+
+    def __init__(self, refs, model, fresh, latency=0.0):
+        self.refs = refs  # blob store ``image_ref`` parts
+        self.model = model
+        self.fresh = fresh  # False for cache hits and requests that joined another's job
+        self.latency = latency
+
+
+class _Job:
+    __slots__ = ("key", "prompt", "model", "size", "n", "future")
+
+    def __init__(self, key, prompt, model, size, n):
+        self.key = key
+        self.prompt = prompt
+        self.model = model
+        self.size = size
+        self.n = n
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class ImageGenerator:
+    def __init__(self, url, api_key, upstream, blobs, workers=None, max_queue=None, max_variants=None):
+        self.url = url
+        self.headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+        self.upstream = upstream
+        self.blobs = blobs
+        self.workers = config.IMAGEGEN_WORKERS if workers is None else workers
+        self.max_queue = config.IMAGEGEN_MAX_QUEUE if max_queue is None else max_queue
+        self.max_variants = config.IMAGEGEN_MAX_VARIANTS if max_variants is None else max_variants
+        self._cache = TTLCache(config.IMAGEGEN_CACHE_SIZE, config.IMAGEGEN_CACHE_TTL)
+        self._queue = deque()
+        self._ready = None
+        self._tasks = []
+        self._busy = 0
+        self._inflight = {}
+        self._single = set()  # Models that refused n > 1
+        self.stats = {"jobs": 0, "hits": 0, "coalesced": 0, "failed": 0, "images": 0, "calls": 0}
+
+    @staticmethod
+    def key(prompt, model, size):
+        # Case can change what gets drawn (text in the image, names), so only whitespace is normalized
+        return " ".join(prompt.split()), model, size
+
+    def _defaults(self, n, model, size):
+        return max(1, min(n, self.max_variants)), model or config.IMAGEGEN_MODEL, size or config.IMAGEGEN_SIZE
+
+    def cached(self, prompt, n=1, model=None, size=None):
+        """Cached ``image_ref`` parts for the request, or None; also keeps their blobs alive."""
+        n, model, size = self._defaults(n, model, size)
+        refs = self._cache.get(self.key(prompt, model, size))
+        if refs is None or len(refs) < n:
+            return None
+        if not all(self.blobs.touch(ref.sha256) for ref in refs[:n]):
+            return None  # Collected anyway (e.g. after a restart dropped its pin); generate again
+        return refs[:n]
+
+    async def generate(self, prompt, n=1, model=None, size=None, on_queued=None):
+        """Return ``GeneratedImages`` for ``prompt``: cached, shared with an identical job, or from a new one.
+
+        ``on_queued(position)`` is awaited once if every worker is busy.
+        Raises ``Overloaded`` when the queue is full and ``GenerationFailed``
+        (or the upstream error) when the API gives nothing back.
+        """
+        n, model, size = self._defaults(n, model, size)
+        refs = self.cached(prompt, n, model, size)
+        if refs is not None:
+            self.stats["hits"] += 1
+            return GeneratedImages(refs, model, False)
+        key = self.key(prompt, model, size)
+        job = self._inflight.get(key)
+        if job is not None and job.n >= n:
+            self.stats["coalesced"] += 1
+            refs, _ = await asyncio.shield(job.future)
+            return GeneratedImages(refs[:n], model, False)
+        # Jobs an idle worker is about to pick up are not waiting
+        waiting = len(self._queue) - (self.workers - self._busy)
+        if waiting >= self.max_queue:
+            raise Overloaded(f"{waiting} image jobs already waiting")
+        job = self._inflight[key] = _Job(key, prompt, model, size, n)
+        self._queue.append(job)
+        self._start()
+        self._ready.set()
+        position = waiting + 1
+        if position > 0 and on_queued is not None:
+            try:
+                await on_queued(position)
+            except Exception as e:
+                print(f"[WARN] Image queue notification failed: {e}")
+        # Shielded: the job keeps going for anyone else waiting on it if this caller goes away
+        refs, latency = await asyncio.shield(job.future)
+        return GeneratedImages(refs, model, True, latency)
+
+    # --- workers ---
+    def _start(self):
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+            job = self._queue.popleft()
+            self._busy += 1
+            try:
+                started = time.perf_counter()
+                refs = await self._run(job)
+                job.future.set_result((refs, time.perf_counter() - started))
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                job.future.set_exception(e)
+                # Waiters re-raise it; mark it retrieved so a job nobody awaits anymore isn't logged
+                job.future.exception()
+            finally:
+                self._busy -= 1
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+
+    async def _run(self, job):
+        self.stats["jobs"] += 1
+        items = []
+        if job.n == 1 or job.model not in self._single:
+            try:
+                items = await self._call(job, job.n)
+            except client.RequestError as e:
+                if job.n == 1 or getattr(e, "status", None) != 400:
+                    raise
+                self._single.add(job.model)
+                print(f"[INFO] {job.model} refused n={job.n}; generating its variants one call each.")
+        if len(items) < job.n:
+            rest = await asyncio.gather(*(self._call(job, 1) for _ in range(job.n - len(items))))
+            items += [item for batch in rest for item in batch]
+        refs = list(await asyncio.gather(*(self._store(item) for item in items[:job.n])))
+        self.stats["images"] += len(refs)
+        previous = self._cache.get(job.key)
+        if previous is None or len(previous) < len(refs):
+            self._cache.set(job.key, refs)
+        return refs
+
+    async def _call(self, job, n):
+        async def attempt(model):
+            data = {"prompt": job.prompt, "model": model, "n": n, "size": job.size}
+            return await client.post_json(self.url, data, headers=self.headers, timeout=config.IMAGEGEN_TIMEOUT)
+        self.stats["calls"] += 1
+        j = await self.upstream.call(job.model, attempt)
+        items = [item for item in j.get("data") or [] if item.get("url") or item.get("b64_json")]
+        if not items:
+            raise GenerationFailed("the API returned no image")
+        return items
+
+    async def _store(self, item):
+        """Download (or decode) one result into the blob store."""
+        if item.get("b64_json"):
+            body = base64.b64decode(item["b64_json"])
+        else:
+            body, _ = await client.get_bytes_capped(item["url"], config.INGEST_MAX_BYTES, timeout=config.INGEST_TIMEOUT)
+        mime = sniff_mime(body[:16])
+        if mime is None:
+            raise GenerationFailed("the API returned something that is not an image")
+        return await asyncio.to_thread(self.blobs.put, body, mime)
+
+    # --- results ---
+    async def attachments(self, refs):
+        """``[(filename, file object), ...]`` for uploading ``refs``."""
+        bodies = await asyncio.gather(*(asyncio.to_thread(self.blobs.get, ref.sha256) for ref in refs))
+        suffix = [""] if len(refs) == 1 else [f"_{i + 1}" for i in range(len(refs))]
+        return [(f"image{s}{EXTENSIONS.get(ref.mime, '.png')}", io.BytesIO(body))
+                for s, ref, body in zip(suffix, refs, bodies)]
+
+    def digests(self):
+        """Blob digests of every cached result, so collection keeps them."""
+        return {ref.sha256 for refs in self._cache.values() for ref in refs}
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def snapshot(self):
+        return dict(self.stats, queued=len(self._queue), busy=self._busy, workers=self.workers,
+                    cached=len(self._cache), single_models=len(self._single))
@@ -0,0 +1,79 @@
+"""Optional downscaling and re-encoding of images before they reach the model.
+
+Phone photos and screenshots are resized to ``IMAGE_MAX_DIM``, stripped of
+metadata and re-encoded as WebP/JPEG in a process pool, so the CPU work never
+runs on the event loop. Results are memoized by the hash of the original
+bytes. Needs Pillow; without it the stage is skipped.
+"""
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+from flazu import config
+from flazu.cache import TTLCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "jpg": ("JPEG", "image/jpeg")}
+
+
+def _shrink(data, max_dim, fmt, quality):
+    """Runs in a worker process. Returns ``(bytes, mime)`` or None to keep the original."""
+    img = Image.open(io.BytesIO(data))
+    if getattr(img, "is_animated", False):
+        return None
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_dim, max_dim))
+    pil_format, mime = FORMATS.get(fmt, FORMATS["webp"])
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA")
+    out = io.BytesIO()
+    # Saving without exif=/icc_profile= drops the source metadata
+    img.save(out, format=pil_format, quality=quality, optimize=True)
+    return out.getvalue(), mime
+
+
+class ImagePreprocessor:
+    def __init__(self, blobs, max_dim=None, fmt=None, quality=None, workers=None):
+        self.blobs = blobs
+        self.max_dim = config.IMAGE_MAX_DIM if max_dim is None else max_dim
+        self.fmt = (fmt or config.IMAGE_FORMAT).lower()
+        self.quality = config.IMAGE_QUALITY if quality is None else quality
+        self.workers = config.IMAGE_PREP_WORKERS if workers is None else workers
+        self._memo = TTLCache(config.INGEST_CACHE_SIZE, config.INGEST_CACHE_TTL)
+        self._pool = None
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    async def put(self, data, mime):
+        """Store a (possibly shrunk) copy of ``data``; return ``(ref, stored_bytes)``."""
+        digest = hashlib.sha256(data).hexdigest()
+        memo = self._memo.get(digest)
+        if memo is not None and self.blobs.touch(memo[0].sha256):
+            return memo
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._pool, _shrink, data, self.max_dim, self.fmt, self.quality)
+        except Exception as e:
+            print(f"[WARN] Image preprocessing failed, sending original: {e}")
+            result = None
+        if result is not None and len(result[0]) < len(data):
+            data, mime = result
+        ref = await asyncio.to_thread(self.blobs.put, data, mime)
+        self._memo.set(digest, (ref, len(data)))
+        return ref, len(data)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,59 @@
+"""Background typing indicator, decoupled from the request path.
+
+Handlers wrap their work in ``async with typing_manager.typing(channel)``;
+entering never waits on Discord. One keep-alive task per channel re-triggers
+the indicator while at least one request for that channel is in flight, so
+overlapping requests share it, and a 429 pauses that channel's task for the
+advertised Retry-After instead of delaying any reply.
+"""
+import asyncio
+import contextlib
+import time
+
+import discord
+
+from flazu import config
+
+
+class TypingManager:
+    def __init__(self, refresh=None):
+        self.refresh = config.TYPING_REFRESH if refresh is None else refresh
+        self._active = {}
+        self._tasks = {}
+        self._blocked_until = {}
+
+    @contextlib.asynccontextmanager
+    async def typing(self, channel):
+        cid = channel.id
+        self._active[cid] = self._active.get(cid, 0) + 1
+        task = self._tasks.get(cid)
+        if task is None or task.done():  # A task that gave up on an error is restarted by the next request
+            self._tasks[cid] = asyncio.create_task(self._keep_alive(channel))
+        try:
+            yield
+        finally:
+            self._active[cid] -= 1
+            if self._active[cid] <= 0:
+                del self._active[cid]
+                task = self._tasks.pop(cid, None)
+                if task is not None:
+                    task.cancel()
+
+    async def _keep_alive(self, channel):
+        cid = channel.id
+        while True:
+            wait = self._blocked_until.get(cid, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await channel.typing()
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    print(f"[ERROR] Typing failed: {e}")
+                    return
+                retry_after = float(e.response.headers.get("Retry-After", 5))
+                print(f"[RATE LIMITED] Typing blocked, retry in {retry_after}s")
+                self._blocked_until[cid] = time.monotonic() + retry_after
+                continue
+            await asyncio.sleep(self.refresh)
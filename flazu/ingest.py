@@ -0,0 +1,112 @@
+"""Concurrent, size-capped ingestion of message images into the blob store.
+
+All attachments and image URLs of a message are fetched at the same time,
+under one global concurrency cap shared by every message in flight. Bodies
+are streamed with a byte ceiling, the real type is sniffed from the first
+bytes, and results are cached by attachment id / URL so an image that is asked
+about again is not downloaded twice.
+"""
+import asyncio
+import re
+
+from flazu import client, config
+from flazu.cache import TTLCache
+
+IMAGE_URL_RE = re.compile(r"https?://[^\s]+?\.(?:png|jpe?g|gif|webp)(?:\?[^\s]*)?", re.IGNORECASE)
+
+
+def sniff_mime(head):
+    """Return the image MIME type from magic bytes, or None if not an image."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class ImageIngestor:
+    def __init__(self, blobs, concurrency=None, max_bytes=None, prep=None):
+        self.blobs = blobs
+        self.prep = prep
+        self.concurrency = config.INGEST_CONCURRENCY if concurrency is None else concurrency
+        self.max_bytes = config.INGEST_MAX_BYTES if max_bytes is None else max_bytes
+        self._cache = TTLCache(config.INGEST_CACHE_SIZE, config.INGEST_CACHE_TTL)
+        self._inflight = {}
+        self._sem = None
+
+    def sources(self, message):
+        """List ``(cache_key, url, declared_size)`` for every image in ``message``."""
+        found = []
+        for attachment in message.attachments:
+            if attachment.content_type and attachment.content_type.startswith("image/"):
+                found.append((("attachment", attachment.id), attachment.url, attachment.size))
+        for url in dict.fromkeys(IMAGE_URL_RE.findall(message.content or "")):
+            found.append((("url", url), url, None))
+        return found
+
+    async def ingest(self, message):
+        """Fetch every image of ``message`` concurrently; return ``image_ref`` parts."""
+        sources = self.sources(message)
+        if not sources:
+            return []
+        results = await asyncio.gather(*(self._get(*src) for src in sources), return_exceptions=True)
+        images = []
+        fetched = stored = 0
+        for (key, url, _), result in zip(sources, results):
+            if isinstance(result, BaseException):
+                print(f"[ERROR] Failed to ingest image {url}: {result}")
+            elif result is not None:
+                ref, original_size, stored_size = result
+                images.append(ref)
+                fetched += original_size
+                stored += stored_size
+        if self.prep is not None and fetched:
+            print(f"[INFO] Image preprocessing: {fetched} -> {stored} bytes ({fetched - stored} saved).")
+        return images
+
+    def digests(self):
+        """Blob digests of every cached image, so collection keeps them."""
+        return {ref.sha256 for ref in self._cache.values()}
+
+    async def _get(self, key, url, size):
+        """Return ``(ref, fetched_bytes, stored_bytes)``; byte counts are 0 on cache hits."""
+        ref = self._cache.get(key)
+        if ref is not None and self.blobs.touch(ref.sha256):
+            return ref, 0, 0
+        # Single-flight: the same image requested twice at once is fetched once. Every caller,
+        # the first included, waits through a shield so one going away doesn't cancel the rest.
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch_shared(key, url, size))
+            # Retrieve the error even if every caller has gone, so it isn't logged as never retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _fetch_shared(self, key, url, size):
+        try:
+            result = await self._fetch(url, size)
+        finally:
+            self._inflight.pop(key, None)
+        if result is not None:
+            self._cache.set(key, result[0])
+        return result
+
+    async def _fetch(self, url, size):
+        if size is not None and size > self.max_bytes:
+            raise client.TooLarge(f"{size} bytes exceeds the {self.max_bytes} byte limit")
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        async with self._sem:
+            body, _ = await client.get_bytes_capped(url, self.max_bytes, timeout=config.INGEST_TIMEOUT)
+        mime = sniff_mime(body[:16])
+        if mime is None:
+            print(f"[WARN] Ignoring {url}: not a supported image.")
+            return None
+        if self.prep is not None:
+            ref, stored = await self.prep.put(body, mime)
+            return ref, len(body), stored
+        return await asyncio.to_thread(self.blobs.put, body, mime), len(body), len(body)
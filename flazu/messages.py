@@ -0,0 +1,105 @@
+"""Compact in-memory conversation messages.
+
+History used to be plain ``{"role": ..., "content": [...]}`` dicts with one
+more dict per content part (and another nested one per image). Here a
+message is a two-slot object with an interned role, text-only content is a
+plain string, and parts are slotted objects in a tuple. The OpenAI JSON
+shape only exists on disk (``to_dict``/``from_dict``) and in request bodies.
+"""
+import sys
+
+
+class Text:
+    __slots__ = ("text",)
+    type = "text"
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_dict(self):
+        return {"type": "text", "text": self.text}
+
+
+class ImageRef:
+    """An image kept in the blob store, by digest."""
+    __slots__ = ("sha256", "mime")
+    type = "image_ref"
+
+    def __init__(self, sha256, mime):
+        self.sha256 = sha256
+        self.mime = sys.intern(mime)
+
+    def to_dict(self):
+        return {"type": "image_ref", "image_ref": {"sha256": self.sha256, "mime": self.mime}}
+
+
+class ImageUrl:
+    """An image given by URL (or an inline data URL from old histories)."""
+    __slots__ = ("url",)
+    type = "image_url"
+
+    def __init__(self, url):
+        self.url = url
+
+    def to_dict(self):
+        return {"type": "image_url", "image_url": {"url": self.url}}
+
+
+class Message:
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        # A lone text part is stored as a plain string
+        if isinstance(content, (list, tuple)):
+            content = tuple(content)
+            if len(content) == 1 and isinstance(content[0], Text):
+                content = content[0].text
+        self.content = content
+
+    def parts(self):
+        return (Text(self.content),) if isinstance(self.content, str) else self.content
+
+    def text(self, image="[image]"):
+        if isinstance(self.content, str):
+            return self.content
+        return " ".join(p.text if isinstance(p, Text) else image for p in self.content)
+
+    def to_dict(self):
+        if isinstance(self.content, str):
+            return {"role": self.role, "content": self.content}
+        return {"role": self.role, "content": [p.to_dict() for p in self.content]}
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r})"
+
+
+def part_from_dict(part):
+    kind = part.get("type")
+    if kind == "text":
+        return Text(part.get("text", ""))
+    if kind == "image_ref":
+        ref = part["image_ref"]
+        return ImageRef(ref["sha256"], ref["mime"])
+    if kind == "image_url":
+        url = part.get("image_url", {})
+        return ImageUrl(url.get("url", "") if isinstance(url, dict) else url)
+    return Text(str(part.get("text", "")))
+
+
+def from_dict(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        content = [part_from_dict(p) for p in content if isinstance(p, dict)]
+    elif content is None:
+        content = ""
+    elif not isinstance(content, str):
+        content = str(content)
+    return Message(message.get("role", "user"), content)
+
+
+def to_json(value):
+    """``json.dumps`` ``default=`` hook for messages and parts."""
+    if isinstance(value, (Message, Text, ImageRef, ImageUrl)):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
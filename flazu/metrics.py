@@ -0,0 +1,204 @@
+"""Per-stage request tracing and a Prometheus-format metrics endpoint.
+
+A handler wraps one request in ``with metrics.request("on_message"):`` and
+the code it calls marks stages with ``with metrics.span("upstream"):``. The
+current trace travels in a context variable, so spans inside helper tasks
+land on the right request. Every span feeds an in-memory latency histogram;
+finished requests also count per command, model and outcome, and are
+appended to the JSON log when ``METRICS_LOG`` is set.
+
+``serve()`` exposes everything on ``http://METRICS_HOST:METRICS_PORT/metrics``
+along with gauges taken from the ``snapshot()`` of registered components.
+"""
+import bisect
+import contextlib
+import contextvars
+import time
+
+from flazu import config, encode
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_trace = contextvars.ContextVar("flazu_trace", default=None)
+_histograms = {}
+_counters = {}
+_collectors = []
+_log = None
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Trace:
+    __slots__ = ("command", "model", "outcome", "started", "stages")
+
+    def __init__(self, command):
+        self.command = command
+        self.model = ""
+        self.outcome = "ok"
+        self.started = time.perf_counter()
+        self.stages = []
+
+
+def observe(name, value, **labels):
+    key = (name, tuple(labels.items()))
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = Histogram()
+    hist.observe(value)
+
+
+def inc(name, value=1, **labels):
+    key = (name, tuple(labels.items()))
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def record(stage, seconds):
+    """Record a stage timed by the caller (e.g. a wait inside ``async with``)."""
+    observe("flazu_stage_seconds", seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.stages.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def request(command):
+    trace = Trace(command)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.outcome = type(e).__name__
+        raise
+    finally:
+        _trace.reset(token)
+        _finish(trace)
+
+
+def tag(model=None):
+    trace = _trace.get()
+    if trace is not None and model:
+        trace.model = model
+
+
+def error(exc):
+    """Count ``exc`` by class and mark the current request as failed with it."""
+    name = type(exc).__name__
+    inc("flazu_errors_total", error=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.outcome = name
+
+
+def _finish(trace):
+    total = time.perf_counter() - trace.started
+    observe("flazu_request_seconds", total, command=trace.command, model=trace.model)
+    inc("flazu_requests_total", command=trace.command, model=trace.model, outcome=trace.outcome)
+    if _log is not None:
+        line = {"ts": round(time.time(), 3), "command": trace.command, "model": trace.model,
+                "outcome": trace.outcome, "total_ms": round(1000 * total, 2),
+                "stages": [[stage, round(1000 * seconds, 2)] for stage, seconds in trace.stages]}
+        try:
+            _log.write(encode.dumps(line) + b"\n")
+        except OSError as e:
+            print(f"[WARN] Unable to write metrics log: {e}")
+
+
+def open_log(path=None):
+    """Start appending one JSON line per finished request to ``path``."""
+    global _log
+    path = config.METRICS_LOG if path is None else path
+    if path:
+        _log = open(path, "ab", buffering=0)
+        print(f"[INFO] Writing request traces to {path}.")
+
+
+def add_collector(prefix, snapshot):
+    """Export the numeric values of ``snapshot()`` as ``flazu_<prefix>_<key>`` gauges."""
+    _collectors.append((prefix, snapshot))
+
+
+# --- exposition ---
+def _labels(pairs, extra=None):
+    pairs = list(pairs) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    out = []
+    typed = set()
+    for (name, labels), hist in sorted(_histograms.items()):
+        if name not in typed:
+            out.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist.counts):
+            cumulative += count
+            out.append(f"{name}_bucket{_labels(labels, ('le', bound))} {cumulative}")
+        out.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {hist.count}")
+        out.append(f"{name}_sum{_labels(labels)} {hist.sum:.6f}")
+        out.append(f"{name}_count{_labels(labels)} {hist.count}")
+    for (name, labels), value in sorted(_counters.items()):
+        if name not in typed:
+            out.append(f"# TYPE {name} counter")
+            typed.add(name)
+        out.append(f"{name}{_labels(labels)} {value}")
+    for prefix, snapshot in _collectors:
+        try:
+            values = snapshot()
+        except Exception as e:
+            print(f"[WARN] Metrics collector {prefix} failed: {e}")
+            continue
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                out.append(f"# TYPE flazu_{prefix}_{key} gauge")
+                out.append(f"flazu_{prefix}_{key} {value}")
+    return "\n".join(out) + "\n"
+
+
+async def serve(host=None, port=None):
+    """Serve ``/metrics`` on a local port; returns the runner to clean up, or None if disabled."""
+    from aiohttp import web
+
+    host = config.METRICS_HOST if host is None else host
+    port = config.METRICS_PORT if port is None else port
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[INFO] Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,262 @@
+"""Outbound Discord delivery: per-channel send queues.
+
+Every reply goes through ``Outbox.send`` (or a ``sender`` callable). Content
+over Discord's 2000-character limit is split at paragraph or line
+boundaries, with code fences closed and reopened across chunks, and files
+ride on the last chunk. Each channel has one worker that sends its queue in
+order, paces itself to Discord's per-channel message bucket, merges small
+consecutive text-only sends into one message, and retries 429s (after the
+advertised Retry-After, which also pauses the channel) and 5xx errors (with
+jittered backoff).
+"""
+import asyncio
+import random
+import time
+from collections import deque
+
+import discord
+
+from flazu import config
+from flazu.fences import FENCE, fence_line
+
+DISCORD_LIMIT = 2000
+MAX_FILES = 10
+
+
+def _marker(fence):
+    return fence[:len(fence) - len(fence.lstrip("`"))]
+
+
+def _step(fence, line):
+    """Open fence (marker and language, e.g. ``"```py"``) after ``line``, or None."""
+    found = fence_line(line)
+    if found is None:
+        return fence
+    marker, lang = found
+    if fence is None:
+        return marker + lang
+    if not lang and len(marker) >= len(_marker(fence)):
+        return None
+    return fence
+
+
+def _fence_after(text, fence):
+    """Open fence at the end of ``text``; its last line is cut short, so it is not a fence line."""
+    for line in text.split("\n")[:-1]:
+        fence = _step(fence, line)
+    return fence
+
+
+def _cut(window, fence):
+    """Index of the separator to split ``window`` at, and the fence state there."""
+    floor = len(window) // 3
+    paragraph = line_out = line_any = None
+    pos = 0
+    lines = window.split("\n")
+    for line in lines[:-1]:
+        end = pos + len(line)
+        fence = _step(fence, line)
+        if fence is None:
+            if not line.strip() and end > 0:
+                paragraph = (end, None)
+            line_out = (end, None)
+        line_any = (end, fence)
+        pos = end + 1
+    for candidate in (paragraph, line_out):
+        if candidate is not None and candidate[0] >= floor:
+            return candidate
+    if line_any is not None and line_any[0] > 0:
+        return line_any
+    space = window.rfind(" ")
+    if space > 0:
+        return space, _fence_after(window[:space], fence)
+    return len(window), _fence_after(window, fence)
+
+
+def split_message(text, limit=DISCORD_LIMIT):
+    """Split ``text`` into chunks of at most ``limit`` characters."""
+    if len(text) <= limit:
+        return [text] if text else []
+    chunks = []
+    fence = None
+    while text:
+        head = fence + "\n" if fence else ""
+        if len(head) + len(text) <= limit:
+            chunks.append(head + text)
+            break
+        # Leave room to close a code block that is still open at the cut; a block
+        # opened inside the window with a longer marker needs a second, shorter try
+        reserve = len("\n" + (_marker(fence) if fence else FENCE))
+        while True:
+            # At least one character per chunk, so even an absurdly small limit ends
+            room = max(1, limit - len(head) - reserve)
+            window = text[:room]
+            cut, after = _cut(window, fence)
+            need = len("\n" + _marker(after)) if after else 0
+            if need <= reserve:
+                break
+            reserve = need
+        piece, text = text[:cut], text[cut + 1:] if cut < len(window) else text[cut:]
+        if after is None:
+            piece, text = piece.rstrip(), text.lstrip("\n")
+        if piece.strip():
+            chunks.append(head + piece + ("\n" + _marker(after) if after else ""))
+        fence = after
+    return chunks
+
+
+def plan(content, files=None, limit=DISCORD_LIMIT):
+    """``[(content, files), ...]`` messages for one reply; files go with the last chunk."""
+    files = list(files or [])
+    parts = [[chunk, []] for chunk in split_message(content or "", limit)] or [[None, []]]
+    parts[-1][1] = files[:MAX_FILES]
+    for i in range(MAX_FILES, len(files), MAX_FILES):
+        parts.append([None, files[i:i + MAX_FILES]])
+    return [tuple(p) for p in parts]
+
+
+class _Item:
+    __slots__ = ("send", "content", "files", "merge", "future", "delivery")
+
+    def __init__(self, send, content, files, merge, future, delivery):
+        self.send = send
+        self.content = content
+        self.files = files
+        self.merge = merge
+        self.future = future
+        self.delivery = delivery
+
+
+class Outbox:
+    def __init__(self, retries=None, batch_window=None, rate=None, per=None):
+        self.retries = config.OUTBOX_RETRIES if retries is None else retries
+        self.batch_window = config.OUTBOX_BATCH_WINDOW if batch_window is None else batch_window
+        self.rate = config.OUTBOX_CHANNEL_RATE if rate is None else rate
+        self.per = config.OUTBOX_CHANNEL_PER if per is None else per
+        self._queues = {}
+        self._workers = {}
+        self._sent_at = {}
+        self._blocked_until = {}
+        self.stats = {"messages": 0, "split": 0, "merged": 0, "retried": 0, "rate_limited": 0, "failed": 0}
+
+    async def send(self, channel, content=None, files=None, merge=True):
+        return await self.deliver(channel.id, channel.send, content, files, merge)
+
+    def sender(self, key, send, merge=True):
+        """A ``send(content=..., files=...)`` callable for ``key`` that goes through the queue.
+
+        Pass ``merge=False`` when the returned message will be edited later.
+        """
+        return lambda content=None, files=None: self.deliver(key, send, content, files, merge)
+
+    async def deliver(self, key, send, content=None, files=None, merge=True):
+        """Queue one reply on ``key``'s channel and return the last message sent."""
+        loop = asyncio.get_running_loop()
+        parts = plan(content, files)
+        self.stats["split"] += len(parts) - 1
+        queue = self._queues.setdefault(key, deque())
+        delivery = object()
+        futures = []
+        for text, batch in parts:
+            future = loop.create_future()
+            queue.append(_Item(send, text, batch, merge and len(parts) == 1, future, delivery))
+            futures.append(future)
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results[-1]
+
+    def _mergeable(self, item):
+        return item.merge and not item.files and item.content
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                item = queue.popleft()
+                batch = [item]
+                if self._mergeable(item):
+                    if self.batch_window > 0 and not queue:
+                        await asyncio.sleep(self.batch_window)
+                    size = len(item.content)
+                    while queue and self._mergeable(queue[0]) and queue[0].send == item.send \
+                            and size + 1 + len(queue[0].content) <= DISCORD_LIMIT:
+                        size += 1 + len(queue[0].content)
+                        batch.append(queue.popleft())
+                    self.stats["merged"] += len(batch) - 1
+                content = "\n".join(i.content for i in batch) if len(batch) > 1 else item.content
+                try:
+                    message = await self._send(key, item.send, content, item.files)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    failed = {i.delivery for i in batch}
+                    dropped = [i for i in queue if i.delivery in failed]
+                    for i in dropped:
+                        queue.remove(i)
+                    for i in batch + dropped:
+                        if not i.future.done():
+                            i.future.set_exception(e)
+                    continue
+                for i in batch:
+                    if not i.future.done():
+                        i.future.set_result(message)
+        finally:
+            del self._workers[key]
+            if not queue:
+                self._queues.pop(key, None)
+
+    async def _wait_turn(self, key):
+        sent_at = self._sent_at.setdefault(key, deque(maxlen=max(1, self.rate)))
+        while True:
+            now = time.monotonic()
+            wait = self._blocked_until.get(key, 0.0) - now
+            if self.rate > 0 and len(sent_at) == sent_at.maxlen:
+                wait = max(wait, sent_at[0] + self.per - now)
+            if wait <= 0:
+                return sent_at
+            await asyncio.sleep(wait)
+
+    async def _send(self, key, send, content, files):
+        kwargs = {"content": content}
+        if files:
+            kwargs["files"] = files
+        for attempt in range(self.retries + 1):
+            sent_at = await self._wait_turn(key)
+            if attempt:
+                self.stats["retried"] += 1
+                for f in files:
+                    f.reset()
+            try:
+                message = await send(**kwargs)
+            except discord.RateLimited as e:
+                if attempt >= self.retries:
+                    raise
+                self._limited(key, e.retry_after)
+                continue
+            except discord.HTTPException as e:
+                if attempt >= self.retries or (e.status != 429 and e.status < 500):
+                    raise
+                if e.status == 429:
+                    self._limited(key, float(e.response.headers.get("Retry-After", 5)))
+                else:
+                    delay = min(config.RETRY_MAX_DELAY, config.OUTBOX_RETRY_DELAY * 2 ** attempt)
+                    print(f"[WARN] Discord send failed ({e.status}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(random.uniform(delay / 2, delay))
+                continue
+            sent_at.append(time.monotonic())
+            self.stats["messages"] += 1
+            return message
+
+    def _limited(self, key, retry_after):
+        self.stats["rate_limited"] += 1
+        print(f"[RATE LIMITED] Channel {key} blocked, retry in {retry_after}s")
+        self._blocked_until[key] = time.monotonic() + retry_after
+
+    def snapshot(self):
+        now = time.monotonic()
+        return dict(self.stats, queued=sum(len(q) for q in self._queues.values()),
+                    channels=len(self._workers),
+                    blocked=sum(1 for until in self._blocked_until.values() if until > now))
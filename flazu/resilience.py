@@ -0,0 +1,213 @@
+"""Upstream resilience: client-side pacing, retries and per-model circuit breakers.
+
+* ``TokenBucket`` paces requests to the Flazu API and re-tunes itself from
+  the ``x-ratelimit-*`` headers the API sends back; a 429 or an exhausted
+  ``remaining`` count pauses everyone until the advertised reset.
+* 429, 5xx, connection errors and timeouts are retried with jittered
+  exponential backoff, honoring ``Retry-After``.
+* Each model has a circuit breaker. While it is open, calls fail fast, and an
+  optional fallback model takes over.
+"""
+import asyncio
+import random
+import re
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from flazu import client, config
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class CircuitOpen(aiohttp.ClientError):
+    pass
+
+
+def parse_duration(value):
+    """Parse ``"1.5"``, ``"20ms"`` or ``"6m0s"`` style durations into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    return sum(float(n) * _UNIT[u] for n, u in parts) if parts else None
+
+
+class TokenBucket:
+    def __init__(self, rate=None, capacity=None):
+        self.rate = config.RATE_LIMIT_RPS if rate is None else rate
+        self.capacity = max(1.0, config.RATE_LIMIT_BURST if capacity is None else capacity)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = None
+
+    def pause(self, seconds):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def learn(self, headers):
+        limit = headers.get("x-ratelimit-limit-requests")
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        if limit and limit.isdigit() and int(limit) > 0:
+            # Flazu (like OpenAI) advertises requests per minute
+            self.rate = int(limit) / 60.0
+            self.capacity = max(1.0, min(float(limit), self.rate * config.RATE_LIMIT_BURST_SECONDS))
+        if remaining == "0" and reset:
+            self.pause(reset)
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open probe after a cool-down."""
+
+    def __init__(self, failures=None, reset_after=None):
+        self.failures = config.BREAKER_FAILURES if failures is None else failures
+        self.reset_after = config.BREAKER_RESET if reset_after is None else reset_after
+        self._count = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def retry_in(self):
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_after - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        self._count = 0
+        self._opened_at = None
+        self._probing = False
+
+    def release(self):
+        """Give up a probe that was abandoned (cancelled) before it could succeed or fail."""
+        self._probing = False
+
+    def record_failure(self):
+        self._count += 1
+        if self._probing or self._count >= self.failures:
+            if self._opened_at is None or self._probing:
+                print(f"[WARN] Circuit opened after {self._count} failures.")
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+def _retryable(exc):
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status in RETRY_STATUSES
+    return isinstance(exc, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+def _retry_after(exc):
+    headers = getattr(exc, "headers", None) or {}
+    return parse_duration(headers.get("Retry-After") or headers.get("retry-after"))
+
+
+class Upstream:
+    """Runs calls to one API host through pacing, retries and breakers."""
+
+    def __init__(self, api_url, fallback_model=None):
+        self.host = urlsplit(api_url).hostname
+        self.fallback_model = config.FALLBACK_MODEL if fallback_model is None else fallback_model
+        self.bucket = TokenBucket()
+        self.breakers = {}
+        client.add_response_observer(self._observe)
+
+    def _observe(self, url, status, headers):
+        if url.host == self.host:
+            self.bucket.learn(headers)
+
+    def breaker(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+
+    async def call(self, model, attempt):
+        """Await ``attempt(model)`` with retries; switch to the fallback while ``model``'s breaker is open."""
+        candidates = [model]
+        if self.fallback_model and self.fallback_model != model:
+            candidates.append(self.fallback_model)
+        error = None
+        for candidate in candidates:
+            breaker = self.breaker(candidate)
+            probe = breaker.state == "half-open"
+            if not breaker.allow():
+                error = CircuitOpen(f"{candidate} is failing, retry in {breaker.retry_in():.0f}s")
+                continue
+            try:
+                result = await self._with_retries(candidate, attempt)
+            except asyncio.CancelledError:
+                # E.g. the losing side of a hedge; it proves nothing either way, so the next call may probe
+                if probe:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if _retryable(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if breaker.state == "closed":
+                    raise
+                error = e
+                continue
+            breaker.record_success()
+            if candidate != model:
+                print(f"[INFO] Served by fallback model {candidate} ({model} circuit open).")
+            return result
+        raise error
+
+    async def _with_retries(self, model, attempt):
+        for n in range(config.RETRY_ATTEMPTS + 1):
+            await self.bucket.acquire()
+            try:
+                return await attempt(model)
+            except Exception as e:
+                if not _retryable(e) or n == config.RETRY_ATTEMPTS:
+                    raise
+                delay = _retry_after(e)
+                if delay is not None and getattr(e, "status", None) == 429:
+                    self.bucket.pause(delay)
+                if delay is None:
+                    delay = random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** n))
+                print(f"[WARN] {model} request failed ({e}); retry {n + 1}/{config.RETRY_ATTEMPTS} in {delay:.1f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,170 @@
+"""Latency-aware routing across groups of equivalent models.
+
+``ROUTER_GROUPS`` lists models the operator considers interchangeable, e.g.
+``"gpt-5.1,gpt-4o,gpt-4.1;gpt-5,gpt-5-mini"``. A request for any member of a
+group goes to the member with the best recent p95/p50 time-to-answer,
+skipping members whose error rate or circuit breaker says they are sick.
+
+With ``ROUTER_HEDGE_DELAY`` > 0, a request that has not started answering
+after that many seconds is duplicated to the next-best member; whichever
+answers first wins and the other is cancelled. For streamed replies
+"answering" means the first delta, so only one racer ever writes to the
+live message.
+"""
+import asyncio
+import time
+from collections import deque
+
+from flazu import config
+
+
+def _parse_groups(value):
+    groups = {}
+    for chunk in (value or "").split(";"):
+        members = [m.strip() for m in chunk.split(",") if m.strip()]
+        if len(members) < 2:
+            continue
+        for model in members:
+            groups[model] = members
+    return groups
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+class ModelStats:
+    __slots__ = ("latencies", "outcomes", "hedges", "hedge_wins")
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, latency=None, ok=True):
+        if latency is not None:
+            self.latencies.append(latency)
+        self.outcomes.append(ok)
+
+    @property
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def p50(self):
+        return _percentile(self.latencies, 0.50)
+
+    def p95(self):
+        return _percentile(self.latencies, 0.95)
+
+
+class ModelRouter:
+    def __init__(self, upstream, groups=None, hedge_delay=None):
+        self.upstream = upstream
+        self.groups = _parse_groups(config.ROUTER_GROUPS) if groups is None else groups
+        self.hedge_delay = config.ROUTER_HEDGE_DELAY if hedge_delay is None else hedge_delay
+        self.stats = {}
+
+    def _stats(self, model):
+        if model not in self.stats:
+            self.stats[model] = ModelStats(config.ROUTER_WINDOW)
+        return self.stats[model]
+
+    def _score(self, model):
+        if self.upstream.breaker(model).state == "open":
+            return (2, 0.0, 0.0)
+        stats = self._stats(model)
+        if len(stats.latencies) < config.ROUTER_MIN_SAMPLES:
+            # Not enough data yet: try it so it gets some
+            return (0, 0.0, 0.0)
+        if stats.error_rate > config.ROUTER_MAX_ERROR_RATE:
+            return (1, stats.error_rate, 0.0)
+        return (0, stats.p95(), stats.p50())
+
+    def rank(self, model):
+        """Members of ``model``'s group, best first; the requested model wins ties."""
+        members = self.groups.get(model)
+        if not members:
+            return [model]
+        return sorted(members, key=lambda m: (self._score(m), m != model))
+
+    async def _run(self, model, attempt, claim, censor=False):
+        started = time.monotonic()
+        answered = []
+
+        def first():
+            if not answered:
+                answered.append(time.monotonic() - started)
+            return claim()
+
+        try:
+            result = await self.upstream.call(model, lambda m: attempt(m, first))
+        except asyncio.CancelledError:
+            if censor and not answered:
+                # Lost a hedge race: it took at least this long, which is worth knowing
+                self._stats(model).record(time.monotonic() - started)
+            raise
+        except Exception:
+            self._stats(model).record(ok=False)
+            raise
+        self._stats(model).record(answered[0] if answered else time.monotonic() - started)
+        return result
+
+    async def call(self, model, attempt):
+        """Await ``attempt(model, claim)`` on the best member of ``model``'s group.
+
+        A streaming ``attempt`` must call ``claim()`` before emitting output and
+        stay quiet if it returns False; plain attempts can ignore it.
+        """
+        order = self.rank(model)
+        if self.hedge_delay <= 0 or len(order) < 2:
+            return await self._run(order[0], attempt, lambda: True)
+
+        owner = []
+        tasks = {}
+
+        def claimer(name):
+            def claim():
+                if not owner:
+                    owner.append(name)
+                    for other, task in tasks.items():
+                        if other != name:
+                            task.cancel()
+                return owner[0] == name
+            return claim
+
+        primary, backup = order[0], order[1]
+        tasks[primary] = asyncio.create_task(self._run(primary, attempt, claimer(primary), censor=True))
+        try:
+            done, _ = await asyncio.wait({tasks[primary]}, timeout=self.hedge_delay)
+            if done or owner:
+                return await tasks[primary]
+            self._stats(backup).hedges += 1
+            tasks[backup] = asyncio.create_task(self._run(backup, attempt, claimer(backup), censor=True))
+            pending = set(tasks.values())
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is tasks[backup]:
+                        self._stats(backup).hedge_wins += 1
+                        print(f"[INFO] Hedged request: {backup} answered before {primary}.")
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def snapshot(self):
+        return {
+            model: dict(p50=round(s.p50(), 3), p95=round(s.p95(), 3), errors=round(s.error_rate, 3),
+                        samples=len(s.latencies), hedges=s.hedges, hedge_wins=s.hedge_wins,
+                        breaker=self.upstream.breaker(model).state)
+            for model, s in self.stats.items()
+        }
@@ -0,0 +1,173 @@
+"""Fair request scheduler in front of ask_flazu.
+
+* One request per user at a time, so quick double-posts can't interleave
+  turns in the same history.
+* A global cap on requests in flight upstream.
+* Start-time fair queuing across users and guilds: each user's next request
+  gets a virtual start tag after both its own and its guild's previous ones,
+  so one spammy user (or guild) can't starve everybody else.
+* Past a depth threshold, callers are told their queue position; past a hard
+  limit, new requests are shed with ``Overloaded``.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from collections import deque
+
+from flazu import config
+
+
+class Overloaded(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("user_id", "guild_id", "weight", "future", "tag", "seq", "cancelled", "queued_at")
+
+    def __init__(self, user_id, guild_id, weight):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.weight = weight
+        self.future = asyncio.get_running_loop().create_future()
+        self.tag = None
+        self.seq = None
+        self.cancelled = False
+        self.queued_at = time.monotonic()
+
+
+def _parse_weights(value):
+    weights = {}
+    for item in (value or "").split(","):
+        key, _, weight = item.partition(":")
+        try:
+            weights[int(key)] = float(weight)
+        except ValueError:
+            continue
+    return weights
+
+
+class RequestScheduler:
+    def __init__(self, max_inflight=None, notify_position=None, max_queue=None, weights=None):
+        self.max_inflight = config.SCHED_MAX_INFLIGHT if max_inflight is None else max_inflight
+        self.notify_position = config.SCHED_NOTIFY_POSITION if notify_position is None else notify_position
+        self.max_queue = config.SCHED_MAX_QUEUE if max_queue is None else max_queue
+        self.weights = _parse_weights(config.SCHED_WEIGHTS) if weights is None else weights
+        self._queues = {}
+        self._busy = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._user_finish = {}
+        self._guild_finish = {}
+        self._inflight = 0
+        self._waiting = 0
+        self._waits = deque(maxlen=1000)
+        self.stats = {"submitted": 0, "completed": 0, "shed": 0, "max_depth": 0}
+
+    def _weight(self, key):
+        return self.weights.get(key, 1.0)
+
+    def _push_head(self, user_id):
+        job = self._queues[user_id][0]
+        start = max(self._vtime, self._user_finish.get(user_id, 0.0))
+        if job.guild_id is not None:
+            start = max(start, self._guild_finish.get(job.guild_id, 0.0))
+            self._guild_finish[job.guild_id] = start + 1.0 / self._weight(job.guild_id)
+        job.tag = start + 1.0 / (job.weight * self._weight(user_id))
+        self._user_finish[user_id] = job.tag
+        job.seq = next(self._seq)
+        heapq.heappush(self._heap, (job.tag, job.seq, job))
+
+    def _dispatch(self):
+        while self._inflight < self.max_inflight and self._heap:
+            tag, _, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            if job.future.cancelled():
+                # Waiter was cancelled but hasn't run its cleanup yet
+                self._forget(job)
+                continue
+            queue = self._queues[job.user_id]
+            queue.popleft()
+            if not queue:
+                del self._queues[job.user_id]
+            self._waiting -= 1
+            self._busy.add(job.user_id)
+            self._inflight += 1
+            self._vtime = tag
+            self._waits.append(time.monotonic() - job.queued_at)
+            job.future.set_result(None)
+
+    def _release(self, job):
+        self._inflight -= 1
+        self._busy.discard(job.user_id)
+        self.stats["completed"] += 1
+        if job.user_id in self._queues:
+            self._push_head(job.user_id)
+        self._dispatch()
+
+    def _forget(self, job):
+        job.cancelled = True
+        queue = self._queues.get(job.user_id)
+        if not queue or job not in queue:
+            return
+        was_head = queue[0] is job
+        queue.remove(job)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[job.user_id]
+        elif was_head and job.user_id not in self._busy:
+            self._push_head(job.user_id)
+
+    def _position(self, job):
+        queue = self._queues.get(job.user_id, ())
+        own = next((i for i, j in enumerate(queue) if j is job), 0)
+        if own == 0 and job.tag is not None:
+            # Users new to the queue share a start tag, so ties go by arrival like the heap does
+            return 1 + sum(1 for tag, seq, j in self._heap if (tag, seq) < (job.tag, job.seq) and not j.cancelled)
+        return own + len(self._heap) + 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id, guild_id=None, weight=1.0, on_queued=None):
+        """Wait for this user's turn and a free upstream slot, then hold it."""
+        if self._waiting >= self.max_queue:
+            self.stats["shed"] += 1
+            raise Overloaded(f"{self._waiting} requests already queued")
+        job = _Job(user_id, guild_id, weight)
+        self.stats["submitted"] += 1
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._waiting += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._waiting)
+        if len(self._queues[user_id]) == 1 and user_id not in self._busy:
+            self._push_head(user_id)
+        self._dispatch()
+        try:
+            if not job.future.done() and on_queued is not None:
+                position = self._position(job)
+                if position >= self.notify_position:
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        print(f"[WARN] Queue notice failed: {e}")
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                self._release(job)
+            else:
+                self._forget(job)
+            raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def snapshot(self):
+        waits = sorted(self._waits)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else 0.0
+
+        return dict(self.stats, depth=self._waiting, inflight=self._inflight,
+                    wait_p50=pct(0.50), wait_p95=pct(0.95))
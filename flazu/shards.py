@@ -0,0 +1,114 @@
+"""Sharded multi-process deployment.
+
+    python -m flazu.shards chat31.py --workers 4 [--shards 8]
+
+starts the bot script ``--workers`` times. Each worker gets a contiguous
+slice of the ``--shards`` gateway shards through ``FLAZU_SHARD_COUNT`` and
+``FLAZU_SHARD_IDS`` and runs them with an ``AutoShardedBot``. All workers
+share the same SQLite store (conversations, global model) and blob
+directory, so run them from the same working directory. Usage quotas
+count every worker's traffic (each re-reads the window when it flushes).
+Only the primary collects blobs, but every worker publishes the ones its
+caches hold, so none are collected from under it. Workers that crash are
+restarted.
+
+Caches stay per process: the response, ingest and image-generation caches
+just hit less often, and a user writing on two shards at once is not
+serialized across processes (both turns are stored, in commit order).
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from flazu import config
+
+
+def shard_ids():
+    return [int(i) for i in config.SHARD_IDS.split(",") if i.strip()] or None
+
+
+def sharded():
+    return config.SHARD_COUNT > 0
+
+
+def make_bot(intents, **kwargs):
+    """``commands.Bot``, or an ``AutoShardedBot`` for this process's shards in sharded mode."""
+    from discord.ext import commands
+
+    if not sharded():
+        return commands.Bot(intents=intents, **kwargs)
+    ids = shard_ids()
+    print(f"[INFO] Running shards {ids if ids else 'all'} of {config.SHARD_COUNT}.")
+    return commands.AutoShardedBot(intents=intents, shard_count=config.SHARD_COUNT, shard_ids=ids, **kwargs)
+
+
+def is_primary():
+    """True for the one process that does once-per-deployment work (command sync, blob collection)."""
+    ids = shard_ids()
+    return ids is None or 0 in ids
+
+
+def port_offset(port):
+    """``port`` shifted by this process's first shard id so sharded workers don't collide."""
+    ids = shard_ids()
+    return port + ids[0] if port and ids else port
+
+
+def partition(shards, workers):
+    base, extra = divmod(shards, workers)
+    out, start = [], 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        out.append(list(range(start, start + size)))
+        start += size
+    return [ids for ids in out if ids]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a bot script as several sharded worker processes.")
+    parser.add_argument("script", help="bot script to run, e.g. chat31.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, default=0, help="total shard count (default: one per worker)")
+    args = parser.parse_args(argv)
+    shards = args.shards or args.workers
+    groups = partition(shards, min(args.workers, shards))
+
+    def spawn(ids):
+        env = dict(os.environ, FLAZU_SHARD_COUNT=str(shards), FLAZU_SHARD_IDS=",".join(map(str, ids)))
+        return subprocess.Popen([sys.executable, args.script], env=env)
+
+    workers = {tuple(ids): spawn(ids) for ids in groups}
+    print(f"[INFO] Started {len(workers)} workers for {shards} shards.")
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for proc in workers.values():
+            if proc.poll() is None:
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while not stopping:
+            time.sleep(1.0)
+            for ids, proc in list(workers.items()):
+                code = proc.poll()
+                if code is not None and not stopping:
+                    print(f"[WARN] Worker for shards {list(ids)} exited with {code}; restarting in 5s.")
+                    time.sleep(5.0)
+                    workers[ids] = spawn(list(ids))
+    except KeyboardInterrupt:
+        stop()
+    for proc in workers.values():
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    main()
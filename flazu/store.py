@@ -0,0 +1,286 @@
+"""Incremental, crash-safe conversation storage backed by SQLite.
+
+Each user's history lives as one row per message, so a turn only writes the
+messages it added. Writes are queued in memory and applied in batches by a
+background flusher, one transaction per batch, so a crash can lose at most the
+last unflushed batch and never leaves a half-written file behind.
+
+Several bot processes (sharded mode) can share one database: sequence numbers
+are assigned inside the write transaction, every write stamps the user's row
+with a new ``version`` so other processes can tell their copy is stale, and
+small shared settings (the global model) live in the ``settings`` table.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from flazu import config, metrics
+from flazu.messages import from_dict, to_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    meta TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    user_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=to_json)
+
+
+class ConversationStore:
+    """Per-user message log with write-behind batching.
+
+    Mutations (``append``, ``trim``, ``replace``, ``delete``, ``set_meta``)
+    only enqueue an operation and return immediately; ``flush`` applies the
+    queue atomically and is meant to run off the event loop.
+    """
+
+    def __init__(self, path, flush_interval=None, batch_size=None):
+        self.path = path
+        self.flush_interval = config.MEMORY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.batch_size = config.MEMORY_FLUSH_BATCH if batch_size is None else batch_size
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if "version" not in columns:
+            self._conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._db_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._versions = {}
+        self._settings = {}
+        self._wake = None
+
+    # --- reads ---
+    def is_empty(self):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM users) OR EXISTS(SELECT 1 FROM messages)"
+            ).fetchone()
+        return not row[0]
+
+    def load_all(self):
+        """Return ``{user_id: {"history": [...], **meta}}`` for every user."""
+        out = {}
+        with self._db_lock:
+            for uid, meta in self._conn.execute("SELECT user_id, meta FROM users"):
+                out[uid] = dict(json.loads(meta), history=[])
+            rows = self._conn.execute("SELECT user_id, message FROM messages ORDER BY user_id, seq")
+            for uid, message in rows:
+                out.setdefault(uid, {"history": []})["history"].append(from_dict(json.loads(message)))
+        return out
+
+    def load(self, user_id):
+        """Return ``{"history": [...], **meta}`` for one user, or None if unknown.
+
+        Queued writes for that user are flushed first, so a conversation
+        dropped from memory and reloaded right away comes back complete.
+        """
+        if self._has_pending(user_id):
+            self.flush()
+        with self._db_lock:
+            row = self._conn.execute("SELECT meta, version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE user_id = ? ORDER BY seq", (user_id,)
+            ).fetchall()
+        self._versions[user_id] = row[1] if row else None
+        if row is None and not rows:
+            return None
+        return dict(json.loads(row[0]) if row else {}, history=[from_dict(json.loads(m)) for m, in rows])
+
+    def _has_pending(self, user_id):
+        with self._pending_lock:
+            return any(op[1] == user_id for op in self._pending)
+
+    def changed_elsewhere(self, user_id):
+        """True if another process wrote ``user_id`` since this one last loaded or flushed it."""
+        if self._has_pending(user_id):
+            return False
+        with self._db_lock:
+            row = self._conn.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return (row[0] if row else None) != self._versions.get(user_id)
+
+    # --- shared settings (written through immediately) ---
+    def setting(self, key, default=None, max_age=None):
+        """Value of a shared setting, re-read at most every ``max_age`` seconds."""
+        max_age = config.SHARED_STATE_CHECK if max_age is None else max_age
+        cached = self._settings.get(key)
+        if cached is None or time.monotonic() - cached[1] >= max_age:
+            with self._db_lock:
+                row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            # Cache the row itself, not the default, so callers with different defaults agree
+            cached = self._settings[key] = (json.loads(row[0]) if row else None, time.monotonic())
+        return default if cached[0] is None else cached[0]
+
+    def set_setting(self, key, value):
+        with self._db_lock:
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, _dumps(value)))
+        self._settings[key] = (value, time.monotonic())
+
+    def scan(self, needle):
+        """Return the raw JSON of every stored message containing ``needle``."""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE instr(message, ?) > 0", (needle,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # --- writes (queued) ---
+    def _enqueue(self, op):
+        with self._pending_lock:
+            self._pending.append(op)
+            full = len(self._pending) >= self.batch_size
+        if full and self._wake is not None:
+            self._wake.set()
+
+    def append(self, user_id, *messages):
+        """Queue ``messages`` to be appended to ``user_id``'s history."""
+        if messages:
+            self._enqueue(("append", user_id, messages))
+
+    def trim(self, user_id, keep):
+        """Drop all but the newest ``keep`` stored messages for ``user_id``."""
+        self._enqueue(("trim", user_id, keep))
+
+    def replace(self, user_id, history):
+        """Rewrite ``user_id``'s history wholesale (used after compaction)."""
+        self._enqueue(("replace", user_id, list(history)))
+
+    def delete(self, user_id):
+        self._enqueue(("delete", user_id))
+
+    def set_meta(self, user_id, **fields):
+        self._enqueue(("meta", user_id, fields))
+
+    # --- flushing ---
+    def flush(self):
+        """Apply every queued operation in a single transaction."""
+        # Drain under the database lock so concurrent flushes (the flusher thread,
+        # /reset, a reload) commit their batches in the order they were queued
+        with self._db_lock:
+            with self._pending_lock:
+                ops, self._pending = self._pending, []
+            if not ops:
+                return 0
+            version = time.time_ns()
+            cur = self._conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                touched = {}
+                for op in ops:
+                    self._apply(cur, op)
+                    touched[op[1]] = op[0] != "delete"
+                for user_id, alive in touched.items():
+                    if alive:
+                        cur.execute(
+                            "INSERT INTO users (user_id, version) VALUES (?, ?) "
+                            "ON CONFLICT(user_id) DO UPDATE SET version = excluded.version",
+                            (user_id, version),
+                        )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                with self._pending_lock:
+                    self._pending[:0] = ops
+                raise
+            for user_id, alive in touched.items():
+                self._versions[user_id] = version if alive else None
+        return len(ops)
+
+    def _apply(self, cur, op):
+        kind, user_id = op[0], op[1]
+        if kind == "append":
+            row = cur.execute("SELECT MAX(seq) FROM messages WHERE user_id = ?", (user_id,)).fetchone()
+            start = 0 if row[0] is None else row[0] + 1
+            cur.executemany(
+                "INSERT INTO messages (user_id, seq, message) VALUES (?, ?, ?)",
+                [(user_id, start + i, _dumps(m)) for i, m in enumerate(op[2])],
+            )
+        elif kind == "trim":
+            cur.execute(
+                "DELETE FROM messages WHERE user_id = ? AND seq <= "
+                "(SELECT MAX(seq) FROM messages WHERE user_id = ?) - ?",
+                (user_id, user_id, op[2]),
+            )
+        elif kind == "replace":
+            cur.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            cur.executemany(
+                "INSERT INTO messages (user_id, seq, message) VALUES (?, ?, ?)",
+                [(user_id, i, _dumps(m)) for i, m in enumerate(op[2])],
+            )
+        elif kind == "delete":
+            cur.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        elif kind == "meta":
+            row = cur.execute("SELECT meta FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            meta = json.loads(row[0]) if row else {}
+            meta.update(op[2])
+            cur.execute(
+                "INSERT INTO users (user_id, meta) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET meta = excluded.meta",
+                (user_id, _dumps(meta)),
+            )
+
+    async def run_flusher(self):
+        """Background task: flush every ``flush_interval`` or when a batch fills."""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                with metrics.span("store_flush"):
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"[ERROR] Unable to flush conversation store: {e}")
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self._conn.close()
+
+    # --- migration ---
+    def migrate_json(self, json_path, upgrade):
+        """Import a legacy ``memory.json`` once, then rename it out of the way.
+
+        ``upgrade`` converts each raw entry (dict, or the old bare history
+        list) into the ``{"history": [...], ...meta}`` shape.
+        """
+        if not os.path.exists(json_path) or not self.is_empty():
+            return 0
+        with open(json_path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        count = 0
+        for key, data in loaded.items():
+            entry = upgrade(data)
+            uid = int(key)
+            meta = {k: v for k, v in entry.items() if k != "history"}
+            if meta:
+                self.set_meta(uid, **meta)
+            self.replace(uid, entry.get("history", []))
+            count += 1
+        self.flush()
+        os.replace(json_path, json_path + ".migrated")
+        print(f"[INFO] Migrated {count} conversations from {json_path} to {self.path}.")
+        return count
@@ -0,0 +1,124 @@
+"""Streaming chat completions rendered as a progressively edited message."""
+import asyncio
+import time
+
+from flazu import client, config, encode, metrics
+from flazu.outbox import DISCORD_LIMIT, plan
+
+PLACEHOLDER = "*Thinking...*"
+
+
+def _delta_text(event):
+    choice = (event.get("choices") or [{}])[0]
+    delta = choice.get("delta")
+    if delta is None:
+        # Non-streamed body handed back by a server that ignored stream=true.
+        delta = choice.get("message") or {}
+    return delta.get("content") or ""
+
+
+async def stream_completion(url, payload, headers=None, on_delta=None, timeout=120, on_usage=None):
+    """Run a ``stream: true`` completion and return the full reply text.
+
+    ``on_delta`` is called with the text accumulated so far after every chunk;
+    it must be cheap since it runs between network reads. ``on_usage`` gets
+    the ``usage`` block the server sends with its last chunk, if any.
+    """
+    fields = {"stream": True}
+    if on_usage is not None:
+        fields["stream_options"] = {"include_usage": True}
+    if isinstance(payload, encode.Body):
+        payload = payload.with_fields(**fields)
+    else:
+        payload = dict(payload, **fields)
+    text = ""
+    async for event in client.stream_sse(url, payload, headers=headers, timeout=timeout):
+        if on_usage is not None and event.get("usage"):
+            on_usage(event["usage"])
+        piece = _delta_text(event)
+        if not piece:
+            continue
+        text += piece
+        if on_delta is not None:
+            on_delta(text)
+    return text
+
+
+class LiveReply:
+    """A placeholder message that is edited as tokens arrive.
+
+    Edits happen on a background task at most once every
+    ``STREAM_EDIT_INTERVAL`` seconds so a fast stream never trips Discord's
+    per-channel edit rate limit, and the stream itself never waits on Discord.
+    """
+
+    def __init__(self, send, mention, interval=None):
+        self._send = send
+        self._prefix = f"{mention}\n"
+        self._interval = config.STREAM_EDIT_INTERVAL if interval is None else interval
+        self._pending = None
+        self._shown = None
+        self._task = None
+        self._posted = asyncio.Event()
+        self.message = None
+        self.started = time.monotonic()
+        self.first_token_after = None
+
+    def start(self):
+        """Post the placeholder in the background so the request isn't held up."""
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            self.message = await self._send(content=self._prefix + PLACEHOLDER)
+        finally:
+            self._posted.set()
+        await self._pump()
+
+    def update(self, text):
+        if self.first_token_after is None:
+            self.first_token_after = time.monotonic() - self.started
+        self._pending = text
+
+    def _render(self, text):
+        body = self._prefix + text
+        if len(body) > DISCORD_LIMIT:
+            body = body[:DISCORD_LIMIT - 4] + " ..."
+        return body
+
+    async def _pump(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            text = self._pending
+            if text is None or text == self._shown:
+                continue
+            try:
+                await self.message.edit(content=self._render(text))
+                self._shown = text
+            except Exception as e:
+                print(f"[WARN] Live edit failed: {e}")
+
+    async def finish(self, content, files=None):
+        """Stop live edits and replace the placeholder with the final reply.
+
+        A reply too long for one message continues in follow-up messages.
+        """
+        await self._posted.wait()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"[WARN] Placeholder send failed: {e}")
+        if self.first_token_after is not None:
+            metrics.record("first_token", self.first_token_after)
+        if self.message is None:
+            # Placeholder never made it; fall back to a plain send
+            await self._send(content=content, files=files or [])
+            return
+        (first, first_files), *rest = plan(content, files)
+        await self.message.edit(content=first, attachments=first_files)
+        for text, batch in rest:
+            await self._send(content=text, files=batch)
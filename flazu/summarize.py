@@ -0,0 +1,116 @@
+"""Rolling summarization that folds old turns into one summary message.
+
+Once a user's stored history grows past ``SUMMARY_TRIGGER_TOKENS`` (or
+``SUMMARY_TRIGGER_MESSAGES``, before the hard history cap drops turns), a
+background task asks a cheap model to summarize everything except the system
+prompt and the newest ``SUMMARY_KEEP_MESSAGES`` messages, then splices a
+single summary message in their place. The previous summary is folded into
+the next one, so a conversation of any length keeps a small, bounded prompt.
+A user whose summarization failed is not retried until an exponential
+backoff (``SUMMARY_RETRY_BASE`` doubling up to ``SUMMARY_RETRY_MAX``) expires.
+"""
+import asyncio
+import time
+
+from flazu import client, config
+from flazu.messages import Message
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+INSTRUCTIONS = (
+    "Summarize the conversation below for your own future reference. Keep facts, "
+    "names, decisions, code identifiers and open questions; drop small talk. "
+    "Write at most 200 words in the conversation's language."
+)
+
+
+def is_summary(message):
+    return message.role == "system" and isinstance(message.content, str) and message.content.startswith(SUMMARY_PREFIX)
+
+
+def _render(message):
+    return f"{message.role}: {message.text()}"
+
+
+class Summarizer:
+    def __init__(self, store, budget, lookup, api_url, api_key, upstream, meter=None, model=None):
+        self.store = store
+        self.lookup = lookup
+        self.budget = budget
+        self.api_url = api_url
+        self.api_key = api_key
+        self.upstream = upstream  # Shared with chat, so summaries respect the same pacing and breakers
+        self.meter = meter  # Summary tokens count against the user like any other request
+        self.model = model or config.SUMMARY_MODEL
+        self._running = {}
+        self._failures = {}  # user_id -> (consecutive failures, retry not before)
+
+    def maybe_schedule(self, user_id, entry, model, guild_id=None):
+        """Start a background compaction for ``user_id`` if its history is over threshold."""
+        if not config.SUMMARY_ENABLED or user_id in self._running:
+            return
+        failed = self._failures.get(user_id)
+        if failed is not None and time.monotonic() < failed[1]:
+            return
+        history = entry["history"]
+        if len(history) <= config.SUMMARY_KEEP_MESSAGES + 2:
+            return
+        if (len(history) < config.SUMMARY_TRIGGER_MESSAGES
+                and self.budget.history_tokens(user_id, history, model) < config.SUMMARY_TRIGGER_TOKENS):
+            return
+        task = asyncio.create_task(self._compact(user_id, entry, guild_id))
+        self._running[user_id] = task
+        task.add_done_callback(lambda _: self._running.pop(user_id, None))
+
+    async def _compact(self, user_id, entry, guild_id=None):
+        history = entry["history"]
+        start = 1 if history and history[0].role == "system" and not is_summary(history[0]) else 0
+        fold = history[start:len(history) - config.SUMMARY_KEEP_MESSAGES]
+        if len(fold) < 2:
+            return
+        transcript = "\n".join(_render(m) for m in fold)[-config.SUMMARY_INPUT_CHARS:]
+        prompt = [Message("system", INSTRUCTIONS), Message("user", transcript)]
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+        served = {}
+
+        async def attempt(model):
+            served["model"] = model
+            data = {
+                "model": model,
+                "messages": [m.to_dict() for m in prompt],
+                "max_tokens": config.SUMMARY_MAX_TOKENS,
+            }
+            return await client.post_json(self.api_url, data, headers=headers, timeout=120)
+        started = time.perf_counter()
+        try:
+            j = await self.upstream.call(self.model, attempt)
+            summary = j.get("choices", [{}])[0].get("message", {}).get("content", "")
+        except Exception as e:
+            self._failed(user_id, e)
+            return
+        if self.meter is not None:
+            self.meter.record_reply(user_id, guild_id, served["model"], j.get("usage"), prompt, summary,
+                                    time.perf_counter() - started)
+        if not summary:
+            self._failed(user_id, "empty summary")
+            return
+        self._failures.pop(user_id, None)
+        # The conversation may have moved on (new turns, trim, reset) while we waited;
+        # only splice if the folded messages are still exactly where we took them from.
+        if self.lookup(user_id) is not entry:
+            return
+        current = entry["history"]
+        if len(current) < start + len(fold) or any(a is not b for a, b in zip(current[start:], fold)):
+            return
+        summary_msg = Message("system", SUMMARY_PREFIX + summary.strip())
+        entry["history"] = current[:start] + [summary_msg] + current[start + len(fold):]
+        self.store.replace(user_id, entry["history"])
+        print(f"[INFO] Compacted {len(fold)} messages for {user_id} into a summary.")
+
+    def _failed(self, user_id, reason):
+        count = self._failures.get(user_id, (0, 0))[0] + 1
+        delay = min(config.SUMMARY_RETRY_BASE * 2 ** (count - 1), config.SUMMARY_RETRY_MAX)
+        self._failures[user_id] = (count, time.monotonic() + delay)
+        print(f"[WARN] Summarization failed for {user_id} ({reason}); retrying in {delay:.0f}s.")
+
+    def forget(self, user_id):
+        self._failures.pop(user_id, None)
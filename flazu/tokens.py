@@ -0,0 +1,178 @@
+"""Token-accurate context budgeting.
+
+Token counts are computed once per stored message and kept in a per-user
+ledger of running totals, so picking the request window costs
+O(new messages) plus a binary search instead of re-measuring the whole
+history on every call. Uses tiktoken when installed and a byte-length
+estimate otherwise.
+"""
+from bisect import bisect_left
+
+from flazu import config
+from flazu.messages import Text
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_CONTEXT = 8192
+KNOWN_CONTEXT = {
+    "gpt-5": 400000,
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "gemini": 1000000,
+}
+CONTEXT_KEYS = ("context_length", "context_window", "max_context_length", "max_model_len", "max_input_tokens")
+MESSAGE_OVERHEAD = 4
+
+_context_windows = {}
+_encoders = {}
+
+
+def register_models(entries):
+    """Record context windows advertised by ``/v1/models`` entries."""
+    for entry in entries:
+        for key in CONTEXT_KEYS:
+            value = entry.get(key)
+            if isinstance(value, int) and value > 0:
+                _context_windows[entry.get("id")] = value
+                break
+
+
+def advertised_context(model):
+    return _context_windows.get(model)
+
+
+def context_window(model):
+    if model in _context_windows:
+        return _context_windows[model]
+    # Longest known prefix wins, so "gpt-4o-mini" maps to gpt-4o rather than gpt-4
+    for prefix in sorted(KNOWN_CONTEXT, key=len, reverse=True):
+        if model.startswith(prefix):
+            return KNOWN_CONTEXT[prefix]
+    return DEFAULT_CONTEXT
+
+
+def _encoder(model):
+    if tiktoken is None:
+        return None
+    name = "o200k_base" if model.startswith(("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")) else "cl100k_base"
+    if name not in _encoders:
+        try:
+            _encoders[name] = tiktoken.get_encoding(name)
+        except Exception as e:
+            print(f"[WARN] tiktoken encoding {name} unavailable ({e}); estimating tokens.")
+            _encoders[name] = None
+    return _encoders[name]
+
+
+def count_text(text, model=""):
+    enc = _encoder(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def count_message(message, model=""):
+    content = message.content
+    if isinstance(content, str):
+        total = count_text(content, model)
+    else:
+        total = 0
+        for part in content:
+            if isinstance(part, Text):
+                total += count_text(part.text, model)
+            else:
+                total += config.IMAGE_TOKENS
+    return total + MESSAGE_OVERHEAD
+
+
+class TokenLedger:
+    """Cached token counts for one user's history, as running totals.
+
+    ``_cum[i]`` is the total before ``_msgs[i]``; histories only grow at the
+    end and get trimmed at the front, and both cases are handled without
+    recounting anything that was already measured.
+    """
+
+    def __init__(self):
+        self._msgs = []
+        self._cum = [0]
+
+    def sync(self, history, model=""):
+        msgs = self._msgs
+        if msgs and history and msgs[0] is not history[0]:
+            offset = next((i for i, m in enumerate(msgs) if m is history[0]), None)
+            if offset is None:
+                msgs.clear()
+                del self._cum[1:]
+            else:
+                del msgs[:offset]
+                del self._cum[:offset]
+        n = len(msgs)
+        if n > len(history) or (n and history[n - 1] is not msgs[n - 1]):
+            msgs.clear()
+            self._cum = [0]
+            n = 0
+        for m in history[n:]:
+            msgs.append(m)
+            self._cum.append(self._cum[-1] + count_message(m, model))
+
+    def tokens(self, start, end):
+        return self._cum[end] - self._cum[start]
+
+    def window_start(self, lo, budget):
+        """Smallest index >= lo whose suffix fits in ``budget`` tokens."""
+        end = len(self._msgs)
+        return bisect_left(self._cum, self._cum[end] - budget, lo, end + 1)
+
+
+class ContextBudget:
+    def __init__(self):
+        self._ledgers = {}
+
+    def forget(self, user_id):
+        self._ledgers.pop(user_id, None)
+
+    def prompt_budget(self, model, max_tokens=None):
+        reserve = max_tokens if max_tokens else config.COMPLETION_RESERVE
+        budget = context_window(model) - reserve - config.CONTEXT_SAFETY_TOKENS
+        if config.MAX_PROMPT_TOKENS > 0:
+            budget = min(budget, config.MAX_PROMPT_TOKENS)
+        return max(budget, 0)
+
+    def _ledger(self, user_id, history, model):
+        ledger = self._ledgers.get(user_id)
+        if ledger is None:
+            ledger = self._ledgers[user_id] = TokenLedger()
+        ledger.sync(history, model)
+        return ledger
+
+    def history_tokens(self, user_id, history, model):
+        return self._ledger(user_id, history, model).tokens(0, len(history))
+
+    def select(self, user_id, history, model, max_tokens=None):
+        """Newest messages of ``history`` that fit the model's prompt budget.
+
+        Leading system messages (prompt and running summary) are always kept,
+        and so is the newest message even if it alone is over budget.
+        """
+        if not history:
+            return []
+        ledger = self._ledger(user_id, history, model)
+        budget = self.prompt_budget(model, max_tokens)
+        pinned = 0
+        while pinned < len(history) - 1 and history[pinned].role == "system":
+            pinned += 1
+        budget -= ledger.tokens(0, pinned)
+        start = min(ledger.window_start(pinned, budget), len(history) - 1)
+        start = max(start, pinned)
+        return history[:pinned] + history[start:]
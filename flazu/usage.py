@@ -0,0 +1,470 @@
+"""Token, image and latency metering with optional quotas.
+
+Every answered request adds its prompt/completion tokens, generated images,
+upstream latency and estimated cost to three accounts: its user, its guild
+and the model that served it. Each account keeps hourly and daily
+ring buffers plus an all-time total, so ``/usage`` and quota checks are a
+few list sums and never touch the disk.
+
+Increments are coalesced per (account, hour) and written to the ``usage``
+table of the conversation database in one transaction every
+``USAGE_FLUSH_INTERVAL`` seconds; the rings are rebuilt from it on start.
+With ``shared=True`` (sharded mode) each flush also re-reads the quota
+window's user and guild rows, and quota checks count those plus this
+process's unflushed increments. A quota then holds across every process,
+lagging by at most a flush interval. ``/usage`` reports stay per process:
+this process's traffic plus whatever was stored when it started.
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+
+from flazu import config, tokens
+
+FIELDS = ("requests", "prompt_tokens", "completion_tokens", "images", "latency", "cost")
+REQUESTS, PROMPT, COMPLETION, IMAGES, LATENCY, COST = range(len(FIELDS))
+HOUR = 3600
+DAY = 86400
+HOURS_KEPT = 48
+DAYS_KEPT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    latency REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, key, bucket)
+);
+CREATE INDEX IF NOT EXISTS usage_bucket ON usage (bucket);
+"""
+# Bucket 0 holds the all-time total; the others are hour numbers since the epoch
+TOTAL_BUCKET = 0
+
+
+def _parse_limits(value):
+    """``"id:limit,..."`` -> ``{id: limit}`` (0 means unlimited for that id)."""
+    limits = {}
+    for item in (value or "").split(","):
+        key, _, limit = item.partition(":")
+        try:
+            limits[int(key)] = int(limit)
+        except ValueError:
+            continue
+    return limits
+
+
+def _parse_prices(value):
+    """``"model:in:out,model:per_image"`` (USD per 1M tokens / per image) -> ``{model: tuple}``."""
+    prices = {}
+    for item in (value or "").split(","):
+        model, *numbers = [part.strip() for part in item.split(":")]
+        try:
+            prices[model] = tuple(float(n) for n in numbers)
+        except ValueError:
+            continue
+    return {model: p for model, p in prices.items() if model and len(p) in (1, 2)}
+
+
+def _short(n):
+    if n >= 1_000_000:
+        return f"{n / 1_000_000:.1f}M"
+    if n >= 1000:
+        return f"{n / 1000:.1f}k"
+    return str(int(n))
+
+
+def _duration(seconds):
+    minutes = max(1, math.ceil(seconds / 60))
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60}m" if minutes % 60 else f"{minutes // 60}h"
+
+
+def counts(block, prompt_messages, reply, model=""):
+    """(prompt, completion) tokens from an API ``usage`` block, estimated when it is missing."""
+    block = block or {}
+    prompt = block.get("prompt_tokens")
+    completion = block.get("completion_tokens")
+    if prompt is None:
+        prompt = sum(tokens.count_message(m, model) for m in prompt_messages)
+    if completion is None:
+        completion = tokens.count_text(reply or "", model)
+    return int(prompt), int(completion)
+
+
+class Ring:
+    """Fixed number of time buckets; a slot is reused once its bucket has aged out."""
+    __slots__ = ("width", "stamps", "values")
+
+    def __init__(self, width, size):
+        self.width = width
+        self.stamps = [-1] * size
+        self.values = [None] * size
+
+    def add(self, bucket, deltas):
+        """Add ``deltas`` to bucket number ``bucket`` (time // width)."""
+        i = bucket % len(self.stamps)
+        if self.stamps[i] != bucket:
+            if self.stamps[i] > bucket:
+                return  # Older than anything the ring still holds
+            self.stamps[i] = bucket
+            self.values[i] = [0] * len(FIELDS)
+        values = self.values[i]
+        for j, delta in enumerate(deltas):
+            values[j] += delta
+
+    def buckets(self, now, span):
+        """``(bucket, values)`` for the buckets overlapping the last ``span`` seconds, oldest first."""
+        current = int(now // self.width)
+        first = current - min(len(self.stamps), math.ceil(span / self.width)) + 1
+        return sorted((b, v) for b, v in zip(self.stamps, self.values) if first <= b <= current)
+
+    def sum(self, now, span):
+        total = [0] * len(FIELDS)
+        for _, values in self.buckets(now, span):
+            for j, value in enumerate(values):
+                total[j] += value
+        return total
+
+
+class Account:
+    __slots__ = ("hours", "days", "total")
+
+    def __init__(self):
+        self.hours = Ring(HOUR, HOURS_KEPT)
+        self.days = Ring(DAY, DAYS_KEPT)
+        self.total = [0] * len(FIELDS)
+
+    def add(self, hour, deltas):
+        self.hours.add(hour, deltas)
+        self.days.add(hour * HOUR // DAY, deltas)
+        for j, delta in enumerate(deltas):
+            self.total[j] += delta
+
+    def window(self, now, span):
+        """Totals over the last ``span`` seconds (hourly resolution up to two days, daily beyond)."""
+        ring = self.hours if span <= HOURS_KEPT * HOUR else self.days
+        return ring.sum(now, span)
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, scope, unit, used, limit, retry_after):
+        self.scope = scope
+        self.unit = unit
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+        who = "your" if scope == "user" else "this server's"
+        super().__init__(f"{who} {unit} quota is used up ({_short(used)}/{_short(limit)}), "
+                         f"try again in {_duration(retry_after)}")
+
+
+class UsageMeter:
+    def __init__(self, path, flush_interval=None, window=None, limits=None, overrides=None, prices=None,
+                 shared=False):
+        self.path = path
+        self.shared = shared
+        self.flush_interval = config.USAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.window = min(config.USAGE_QUOTA_WINDOW if window is None else window, HOURS_KEPT * HOUR)
+        # scope -> (tokens, images) per window; 0 = unlimited
+        self.limits = {
+            "user": (config.USAGE_USER_TOKENS, config.USAGE_USER_IMAGES),
+            "guild": (config.USAGE_GUILD_TOKENS, config.USAGE_GUILD_IMAGES),
+        } if limits is None else limits
+        self.overrides = _parse_limits(config.USAGE_QUOTA_OVERRIDES) if overrides is None else overrides
+        self.prices = _parse_prices(config.USAGE_PRICES) if prices is None else prices
+        self._accounts = {}
+        self._pending = {}
+        self._flushing = {}  # Increments being written, counted by quota checks until the window is re-read
+        self._window_rows = {}  # shared mode: (scope, key) -> {hour: values} from the database
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pruned = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.stats = {"recorded": 0, "denied": 0, "flushes": 0, "rows_written": 0}
+
+    def _account(self, scope, key):
+        account = self._accounts.get((scope, key))
+        if account is None:
+            account = self._accounts[(scope, key)] = Account()
+        return account
+
+    # --- recording ---
+    def cost(self, model, prompt=0, completion=0, images=0):
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        if len(price) == 1:
+            return images * price[0]
+        return (prompt * price[0] + completion * price[1]) / 1_000_000
+
+    def record(self, user_id, guild_id, model, prompt=0, completion=0, images=0, latency=0.0):
+        """Count one answered request against its user, guild and model."""
+        deltas = (1, prompt, completion, images, latency, self.cost(model, prompt, completion, images))
+        hour = int(time.time() // HOUR)
+        keys = [("user", str(user_id)), ("model", model or "unknown")]
+        if guild_id is not None:
+            keys.append(("guild", str(guild_id)))
+        with self._pending_lock:
+            for scope, key in keys:
+                self._account(scope, key).add(hour, deltas)
+                pending = self._pending.get((scope, key, hour))
+                if pending is None:
+                    self._pending[(scope, key, hour)] = list(deltas)
+                else:
+                    for j, delta in enumerate(deltas):
+                        pending[j] += delta
+        self.stats["recorded"] += 1
+
+    def record_reply(self, user_id, guild_id, model, block, prompt_messages, reply, latency):
+        """Count an upstream chat answer, using its ``usage`` block or estimates."""
+        prompt, completion = counts(block, prompt_messages, reply, model)
+        self.record(user_id, guild_id, model, prompt, completion, latency=latency)
+
+    # --- quotas ---
+    def _limit(self, scope, key, unit):
+        limit = self.limits.get(scope, (0, 0))[0 if unit == "tokens" else 1]
+        if unit == "tokens":
+            limit = self.overrides.get(key, limit)
+        return limit
+
+    def _recent(self, scope, key, now):
+        """``(hour, values)`` buckets of one account that overlap the quota window, oldest first."""
+        if not self.shared:
+            account = self._accounts.get((scope, key))
+            return [] if account is None else account.hours.buckets(now, self.window)
+        current = int(now // HOUR)
+        first = current - math.ceil(self.window / HOUR) + 1
+        merged = {b: list(v) for b, v in self._window_rows.get((scope, key), {}).items() if b >= first}
+        for source in (self._flushing, self._pending):
+            for (s, k, hour), values in list(source.items()):
+                if s == scope and k == key and first <= hour <= current:
+                    totals = merged.setdefault(hour, [0] * len(FIELDS))
+                    for j, value in enumerate(values):
+                        totals[j] += value
+        return sorted(merged.items())
+
+    def check(self, user_id, guild_id=None, images=0):
+        """Raise ``QuotaExceeded`` if the user or guild is out of tokens (or of ``images``) for the window."""
+        now = time.time()
+        for scope, key in (("user", user_id), ("guild", guild_id)):
+            if key is None:
+                continue
+            buckets = self._recent(scope, str(key), now)
+            if not buckets:
+                continue
+            token_limit = self._limit(scope, key, "tokens")
+            if token_limit:
+                used = sum(v[PROMPT] + v[COMPLETION] for _, v in buckets)
+                if used >= token_limit:
+                    self._deny(scope, "token", used, token_limit, buckets, now,
+                               lambda v: v[PROMPT] + v[COMPLETION], used - token_limit + 1)
+            image_limit = self._limit(scope, key, "images")
+            if images and image_limit:
+                used = sum(v[IMAGES] for _, v in buckets)
+                if used + images > image_limit:
+                    self._deny(scope, "image", used, image_limit, buckets, now,
+                               lambda v: v[IMAGES], used + images - image_limit)
+
+    def _deny(self, scope, unit, used, limit, buckets, now, amount, excess):
+        # Usage leaves the rolling window a whole hour bucket at a time; wait until enough of it has
+        span = math.ceil(self.window / HOUR)
+        retry_after = self.window
+        for bucket, values in buckets:
+            excess -= amount(values)
+            if excess <= 0:
+                retry_after = (bucket + span) * HOUR - now
+                break
+        self.stats["denied"] += 1
+        raise QuotaExceeded(scope, unit, used, limit, max(60.0, retry_after))
+
+    # --- reporting ---
+    def totals(self, scope, key, span=None):
+        """Field dict for one account over the last ``span`` seconds (all time if None)."""
+        account = self._accounts.get((scope, str(key)))
+        if account is None:
+            values = [0] * len(FIELDS)
+        else:
+            values = account.total if span is None else account.window(time.time(), span)
+        return dict(zip(FIELDS, values))
+
+    def describe(self, scope, key):
+        """Human-readable usage of one account: last 24 hours, 30 days and all time."""
+        lines = []
+        for label, span in (("24h", DAY), ("30d", DAYS_KEPT * DAY), ("all time", None)):
+            t = self.totals(scope, key, span)
+            if not t["requests"]:
+                lines.append(f"{label}: no requests")
+                continue
+            line = (f"{label}: {t['requests']} requests, {_short(t['prompt_tokens'] + t['completion_tokens'])} tokens "
+                    f"({_short(t['prompt_tokens'])} in / {_short(t['completion_tokens'])} out), "
+                    f"{t['images']} images, avg {t['latency'] / t['requests']:.1f}s")
+            if t["cost"]:
+                line += f", ~${t['cost']:.2f}" if t["cost"] >= 0.01 else ", <$0.01"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def quota(self, scope, key):
+        """Remaining allowance in the quota window, or None if the account is unlimited."""
+        token_limit = self._limit(scope, key, "tokens")
+        image_limit = self._limit(scope, key, "images")
+        if not token_limit and not image_limit:
+            return None
+        used = [0] * len(FIELDS)
+        for _, values in self._recent(scope, str(key), time.time()):
+            used = [a + b for a, b in zip(used, values)]
+        parts = []
+        if token_limit:
+            parts.append(f"{_short(max(0, token_limit - used[PROMPT] - used[COMPLETION]))} "
+                         f"of {_short(token_limit)} tokens left")
+        if image_limit:
+            parts.append(f"{max(0, image_limit - used[IMAGES])} of {image_limit} images left")
+        return f"{', '.join(parts)} (rolling {_duration(self.window)})"
+
+    def report(self, user_id, guild_id=None):
+        """The ``/usage`` answer: the user's usage and quota, then the guild's."""
+        parts = [("Your usage", "user", user_id)]
+        if guild_id is not None:
+            parts.append(("This server", "guild", guild_id))
+        lines = []
+        for title, scope, key in parts:
+            lines.append(f"**{title}**\n{self.describe(scope, key)}")
+            quota = self.quota(scope, key)
+            if quota:
+                lines.append(f"Quota: {quota}")
+        return "\n".join(lines)
+
+    def top(self, scope, span=DAY, limit=5):
+        """``[(key, totals), ...]`` for the accounts in ``scope`` that used the most tokens."""
+        now = time.time()
+        ranked = []
+        for (s, key), account in list(self._accounts.items()):
+            if s != scope:
+                continue
+            values = dict(zip(FIELDS, account.window(now, span)))
+            if values["requests"]:
+                ranked.append((key, values))
+        ranked.sort(key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"], reverse=True)
+        return ranked[:limit]
+
+    # --- persistence ---
+    def load(self):
+        """Rebuild the in-memory accounts from the database."""
+        oldest = int(time.time() // HOUR) - DAYS_KEPT * 24
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT scope, key, bucket, {', '.join(FIELDS)} FROM usage WHERE bucket = ? OR bucket >= ?",
+                (TOTAL_BUCKET, oldest),
+            ).fetchall()
+        for scope, key, bucket, *values in rows:
+            account = self._account(scope, key)
+            if bucket == TOTAL_BUCKET:
+                account.total = list(values)
+            else:
+                account.hours.add(bucket, values)
+                account.days.add(bucket * HOUR // DAY, values)
+        if rows:
+            print(f"[INFO] Usage loaded for {len(self._accounts)} accounts.")
+        if self.shared:
+            self._read_window()
+
+    def _read_window(self):
+        """Shared mode: take every process's stored user and guild usage in the quota window."""
+        first = int(time.time() // HOUR) - math.ceil(self.window / HOUR) + 1
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT scope, key, bucket, {', '.join(FIELDS)} FROM usage "
+                "WHERE bucket >= ? AND scope IN ('user', 'guild')",
+                (first,),
+            ).fetchall()
+        window_rows = {}
+        for scope, key, bucket, *values in rows:
+            window_rows.setdefault((scope, key), {})[bucket] = values
+        # What was being flushed is in these rows now
+        self._window_rows, self._flushing = window_rows, {}
+
+    def flush(self):
+        """Add the queued increments to the database in one transaction."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            if self.shared:
+                self._flushing = pending
+        try:
+            written = self._write(pending) if pending else 0
+        except Exception:
+            self._flushing = {}
+            raise
+        if self.shared:
+            self._read_window()
+        return written
+
+    def _write(self, pending):
+        rows = []
+        for (scope, key, hour), values in pending.items():
+            rows.append((scope, key, hour, *values))
+            rows.append((scope, key, TOTAL_BUCKET, *values))
+        columns = ", ".join(FIELDS)
+        updates = ", ".join(f"{f} = {f} + excluded.{f}" for f in FIELDS)
+        with self._db_lock:
+            cur = self._conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.executemany(
+                    f"INSERT INTO usage (scope, key, bucket, {columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    f"ON CONFLICT(scope, key, bucket) DO UPDATE SET {updates}",
+                    rows,
+                )
+                hour = int(time.time() // HOUR)
+                if hour != self._pruned:
+                    # Hourly rows older than the daily ring are only needed for the total, which has its own row
+                    cur.execute("DELETE FROM usage WHERE bucket != ? AND bucket < ?",
+                                (TOTAL_BUCKET, hour - DAYS_KEPT * 24))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                with self._pending_lock:
+                    for k, values in pending.items():
+                        current = self._pending.setdefault(k, [0] * len(FIELDS))
+                        for j, value in enumerate(values):
+                            current[j] += value
+                raise
+        self._pruned = hour
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(rows)
+        return len(rows)
+
+    async def run_flusher(self):
+        """Background task: write the queued increments every ``flush_interval`` seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"[ERROR] Unable to flush usage: {e}")
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self._conn.close()
+
+    def snapshot(self):
+        now = time.time()
+        day = [0] * len(FIELDS)
+        for (scope, _), account in list(self._accounts.items()):
+            if scope == "model":
+                day = [a + b for a, b in zip(day, account.window(now, DAY))]
+        return dict(self.stats, accounts=len(self._accounts), pending=len(self._pending),
+                    requests_24h=day[REQUESTS], tokens_24h=day[PROMPT] + day[COMPLETION],
+                    images_24h=day[IMAGES], cost_24h=round(day[COST], 4))
@@ -0,0 +1,138 @@
+"""Event-loop stall detector.
+
+``Watchdog.run`` is a background task that sleeps in short ticks and measures
+how late each tick wakes up (the loop lag). A helper thread watches the same
+ticks; when one is overdue by more than ``WATCHDOG_STALL`` seconds the loop
+is stuck in synchronous code, so the thread snapshots the loop thread's
+stack and the task that was running. Stalls are grouped by the innermost
+frame in this project's code, and the worst offenders are reported
+periodically, long before a stall is long enough to miss a gateway
+heartbeat.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+from flazu import config, metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _site(stack):
+    """``file:line in function`` of the innermost frame in project code."""
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(ROOT) and path != os.path.abspath(__file__):
+            return f"{os.path.relpath(path, ROOT)}:{frame.lineno} in {frame.name}"
+    frame = stack[-1] if stack else None
+    return f"{frame.filename}:{frame.lineno} in {frame.name}" if frame else "unknown"
+
+
+def _task_name(task):
+    if task is None:
+        return "callback"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class Watchdog:
+    def __init__(self, threshold=None, interval=None, report_interval=None):
+        self.threshold = config.WATCHDOG_STALL if threshold is None else threshold
+        self.interval = config.WATCHDOG_INTERVAL if interval is None else interval
+        self.report_interval = config.WATCHDOG_REPORT_INTERVAL if report_interval is None else report_interval
+        self.offenders = {}
+        self.stats = {"stalls": 0, "stalled_seconds": 0.0, "max_lag": 0.0}
+        self._due = None
+        self._captured = None
+        self._reported = 0
+        self._stopped = threading.Event()
+
+    async def run(self):
+        """Background task: measure loop lag until cancelled."""
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(target=self._monitor, args=(loop, threading.get_ident()),
+                                  name="flazu-watchdog", daemon=True)
+        self._stopped.clear()
+        thread.start()
+        print(f"[INFO] Event loop watchdog on: stalls over {self.threshold}s are recorded.")
+        reported = time.monotonic()
+        try:
+            while True:
+                started = time.monotonic()
+                self._due = started + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = max(0.0, now - self._due)
+                metrics.observe("flazu_loop_lag_seconds", lag)
+                self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+                if lag > self.threshold:
+                    self._record(lag)
+                if self.report_interval and now - reported >= self.report_interval:
+                    reported = now
+                    self.report()
+        finally:
+            self._stopped.set()
+
+    def _monitor(self, loop, loop_thread):
+        """Thread: snapshot the loop thread's stack while a tick is overdue."""
+        step = max(0.01, self.threshold / 4)
+        seen = None
+        while not self._stopped.wait(step):
+            due = self._due
+            if due is None or due == seen or time.monotonic() - due <= self.threshold:
+                continue
+            seen = due
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            # Drop the event loop's own frames; what matters starts at the callback it ran
+            inner = [i for i, f in enumerate(stack) if f"{os.sep}asyncio{os.sep}" in f.filename]
+            stack = stack[inner[-1] + 1:] if inner and inner[-1] + 1 < len(stack) else stack
+            try:
+                task = asyncio.current_task(loop)
+            except RuntimeError:
+                task = None
+            self._captured = (due, stack, _task_name(task))
+
+    def _record(self, lag):
+        captured, self._captured = self._captured, None
+        if captured is not None and captured[0] == self._due:
+            _, stack, task = captured
+            site = _site(stack)
+        else:
+            # Over before the thread looked (or it never got the GIL)
+            stack, task, site = None, "unknown", "unknown"
+        self.stats["stalls"] += 1
+        self.stats["stalled_seconds"] += lag
+        metrics.inc("flazu_loop_stalls_total")
+        entry = self.offenders.get(site)
+        if entry is None:
+            entry = self.offenders[site] = {"count": 0, "total": 0.0, "max": 0.0, "task": task}
+            if stack:
+                text = "".join(traceback.format_list(stack[-8:]))
+                print(f"[WARN] Event loop blocked for {lag:.2f}s at {site}, task {task}:\n{text}", end="")
+        entry["count"] += 1
+        entry["total"] += lag
+        entry["max"] = max(entry["max"], lag)
+        entry["task"] = task
+
+    def worst(self, limit=5):
+        ranked = sorted(self.offenders.items(), key=lambda item: item[1]["total"], reverse=True)
+        return ranked[:limit]
+
+    def report(self):
+        """Print the worst offenders, if there were new stalls since the last report."""
+        if self.stats["stalls"] == self._reported:
+            return
+        self._reported = self.stats["stalls"]
+        lines = [f"  {e['count']}x, {e['total']:.2f}s total, {e['max']:.2f}s max  {site}  [{e['task']}]"
+                 for site, e in self.worst()]
+        print(f"[WARN] Event loop stalls (worst first, max lag {self.stats['max_lag']:.2f}s):\n" + "\n".join(lines))
+
+    def snapshot(self):
+        return dict(self.stats, stalled_seconds=round(self.stats["stalled_seconds"], 3),
+                    max_lag=round(self.stats["max_lag"], 3), sites=len(self.offenders))
@@ -0,0 +1,196 @@
+"""Bounded in-memory working set of conversations.
+
+Behaves like the old ``memory`` dict, but a user's conversation is read from
+the store on first access instead of at startup, and conversations are
+dropped again once idle for ``WORKING_SET_TTL`` or when the resident total
+goes over ``WORKING_SET_MAX_BYTES`` / ``WORKING_SET_MAX_USERS`` (least
+recently used first). Every change is already queued to the store by the
+time it reaches the dict, so dropping an entry loses nothing; reloading it
+flushes whatever is still queued for that user first. ``on_evict(user_id)``
+runs whenever an entry leaves memory, so caches keyed by user (token
+ledgers) can let go of its messages too.
+
+Handlers ``await ensure(user_id)`` before touching a conversation: it does
+the SQLite work (loading a miss and, with ``shared=True``, checking the
+store's version stamp at most every ``SHARED_STATE_CHECK`` seconds and
+reloading what another process changed) in a worker thread, so the mapping
+accesses that follow are plain dict lookups. A miss that was not ensured
+first still loads synchronously.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from flazu import config
+from flazu.messages import Text
+
+MESSAGE_OVERHEAD = 100  # slotted Message, list slot and string header, roughly
+PART_OVERHEAD = 120
+
+
+def entry_bytes(entry):
+    """Rough resident size of a conversation entry."""
+    total = 0
+    for message in entry.get("history", ()):
+        content = message.content
+        if isinstance(content, str):
+            total += len(content)
+        else:
+            for part in content:
+                total += PART_OVERHEAD + (len(part.text) if isinstance(part, Text) else 0)
+        total += MESSAGE_OVERHEAD
+    return total
+
+
+class WorkingSet:
+    def __init__(self, store, on_load=None, ttl=None, max_bytes=None, max_users=None, shared=False, on_evict=None):
+        self.store = store
+        self.on_load = on_load
+        self.on_evict = on_evict
+        self.shared = shared
+        self.ttl = config.WORKING_SET_TTL if ttl is None else ttl
+        self.max_bytes = config.WORKING_SET_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_users = config.WORKING_SET_MAX_USERS if max_users is None else max_users
+        self._entries = OrderedDict()
+        self._last_used = {}
+        self._sizes = {}
+        self._dirty = set()
+        self._absent = set()
+        self._checked = {}
+        self.bytes = 0
+        self.stats = {"hits": 0, "loads": 0, "evicted_idle": 0, "evicted_budget": 0, "stale_reloads": 0}
+
+    def _touch(self, user_id):
+        self._entries.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+        self._dirty.add(user_id)
+
+    async def ensure(self, user_id):
+        """Make ``user_id``'s resident entry current without blocking the event loop."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            if user_id in self._absent:
+                return
+        elif self.shared:
+            now = time.monotonic()
+            if now - self._checked.get(user_id, 0.0) < config.SHARED_STATE_CHECK:
+                return
+            self._checked[user_id] = now
+            if not await asyncio.to_thread(self.store.changed_elsewhere, user_id):
+                return
+        else:
+            return
+        loaded = await asyncio.to_thread(self.store.load, user_id)
+        if self._entries.get(user_id) is not entry:
+            return  # Replaced (new conversation, /reset) while we were reading; keep that
+        if entry is not None:
+            self._drop(user_id)
+            self.stats["stale_reloads"] += 1
+        self._install(user_id, loaded)
+
+    def _fetch(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.stats["hits"] += 1
+            self._touch(user_id)
+            return entry
+        if user_id in self._absent:
+            return None
+        return self._install(user_id, self.store.load(user_id))
+
+    def _install(self, user_id, entry):
+        if entry is None:
+            # Another process may create this user at any time
+            if not self.shared:
+                if len(self._absent) > 100000:
+                    self._absent.clear()
+                self._absent.add(user_id)
+            return None
+        self.stats["loads"] += 1
+        if self.on_load is not None:
+            self.on_load(user_id, entry)
+        self[user_id] = entry
+        return entry
+
+    # --- mapping interface ---
+    def __contains__(self, user_id):
+        return self._fetch(user_id) is not None
+
+    def __getitem__(self, user_id):
+        entry = self._fetch(user_id)
+        if entry is None:
+            raise KeyError(user_id)
+        return entry
+
+    def get(self, user_id, default=None):
+        entry = self._fetch(user_id)
+        return default if entry is None else entry
+
+    def peek(self, user_id):
+        """The resident entry for ``user_id``, without loading or touching it."""
+        return self._entries.get(user_id)
+
+    def __setitem__(self, user_id, entry):
+        self._entries[user_id] = entry
+        self._absent.discard(user_id)
+        self._checked[user_id] = time.monotonic()
+        self._touch(user_id)
+        self._measure(user_id)
+        if self.max_users and len(self._entries) > self.max_users:
+            self._evict(next(iter(self._entries)), "evicted_budget")
+
+    def __delitem__(self, user_id):
+        if user_id not in self._entries:
+            raise KeyError(user_id)
+        self._drop(user_id)
+        if not self.shared:
+            self._absent.add(user_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- eviction ---
+    def _measure(self, user_id):
+        size = entry_bytes(self._entries[user_id])
+        self.bytes += size - self._sizes.get(user_id, 0)
+        self._sizes[user_id] = size
+        self._dirty.discard(user_id)
+
+    def _drop(self, user_id):
+        del self._entries[user_id]
+        self._last_used.pop(user_id, None)
+        self._checked.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self.bytes -= self._sizes.pop(user_id, 0)
+        if self.on_evict is not None:
+            self.on_evict(user_id)
+
+    def _evict(self, user_id, reason):
+        self._drop(user_id)
+        self.stats[reason] += 1
+
+    def sweep(self):
+        """Re-measure recently used entries, then evict idle and over-budget ones."""
+        for user_id in list(self._dirty):
+            if user_id in self._entries:
+                self._measure(user_id)
+        now = time.monotonic()
+        idle = [uid for uid, used in self._last_used.items() if self.ttl and now - used >= self.ttl]
+        for user_id in idle:
+            self._evict(user_id, "evicted_idle")
+        while self._entries and self.max_bytes and self.bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)), "evicted_budget")
+        return len(idle)
+
+    async def run_sweeper(self, interval=None):
+        """Background task: sweep every ``interval`` seconds."""
+        interval = config.WORKING_SET_SWEEP_INTERVAL if interval is None else interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[ERROR] Working set sweep failed: {e}")
+
+    def snapshot(self):
+        return dict(self.stats, resident=len(self._entries), resident_bytes=self.bytes)
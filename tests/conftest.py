@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Appended, not prepended: the bot script code.py would otherwise shadow the stdlib ``code`` module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+import os
+import time
+
+from flazu.blobs import PINS_DIR, BlobStore, digests_in
+from flazu.messages import Message, Text
+from flazu.store import ConversationStore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def test_collection_keeps_blobs_pinned_by_other_processes(tmp_path):
+    root = str(tmp_path / "blobs")
+    worker, primary = BlobStore(root=root), BlobStore(root=root)
+    cached = worker.put(PNG, "image/png")
+    loose = worker.put(PNG + b"loose", "image/png")
+    worker.publish({cached.sha256})
+    assert primary.collect(set(), grace=0) == 1
+    assert worker.touch(cached.sha256) and not worker.touch(loose.sha256)
+
+    # A worker that stopped publishing no longer protects anything
+    pin = os.path.join(root, PINS_DIR, worker.owner)
+    old = time.time() - 7200
+    os.utime(pin, (old, old))
+    assert primary.collect(set(), grace=0) == 1
+    assert not worker.touch(cached.sha256)
+    assert not os.path.exists(pin)
+
+
+def test_referenced_blobs_survive_and_recent_ones_get_grace(tmp_path):
+    blobs = BlobStore(root=str(tmp_path / "blobs"))
+    kept = blobs.put(PNG, "image/png")
+    fresh = blobs.put(PNG + b"new", "image/png")
+    assert blobs.collect({kept.sha256}, grace=600) == 0
+    assert blobs.collect({kept.sha256}, grace=0) == 1
+    assert blobs.get(kept.sha256) == PNG and not blobs.touch(fresh.sha256)
+
+
+def test_one_bots_collection_spares_the_other_bots_images(tmp_path):
+    # chat31.py and code.py run from one directory share memory.db and the blob directory
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    vision, imagegen = BlobStore(root=str(tmp_path / "blobs")), BlobStore(root=str(tmp_path / "blobs"))
+    stored = vision.put(PNG, "image/png")
+    cached = vision.put(PNG + b"cached", "image/png")
+    generated = imagegen.put(PNG + b"generated", "image/png")
+    store.append(1, Message("user", (Text("look"), stored)))
+    vision.publish({cached.sha256})
+    store.flush()
+    # What code.py's collector passes: stored conversations plus its own cache
+    assert imagegen.collect(digests_in(store.scan('"image_ref"')) | {generated.sha256}, grace=0) == 0
+    assert all(imagegen.touch(ref.sha256) for ref in (stored, cached, generated))
+    store.close()
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from flazu.cache import ResponseCache, TTLCache
+
+
+def test_ttl_cache_evicts_oldest_and_expired():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    expired = TTLCache(ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None and expired.values() == []
+
+
+def test_key_ignores_dict_order_but_not_content():
+    messages = [{"role": "user", "content": "hi"}]
+    key = ResponseCache.key("gpt-5", messages, {"temperature": 0, "top_p": 1})
+    assert key == ResponseCache.key("gpt-5", messages, {"top_p": 1, "temperature": 0})
+    assert key != ResponseCache.key("gpt-4o", messages, {"temperature": 0, "top_p": 1})
+    assert key != ResponseCache.key("gpt-5", [{"role": "user", "content": "Hi"}], {"temperature": 0, "top_p": 1})
+
+
+def test_channels():
+    cache = ResponseCache(disk_path="", channels="10, 20,x")
+    assert cache.enabled_for(10) and cache.enabled_for(20) and not cache.enabled_for(30)
+    assert ResponseCache(disk_path="", channels="*").enabled_for(30)
+    assert not ResponseCache(disk_path="", channels="").enabled_for(10)
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def scenario():
+        cache = ResponseCache(disk_path="", channels="*")
+        replies = await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(5)))
+        assert replies == ["reply"] * 5
+        assert await cache.get_or_fetch("k", fetch) == "reply"
+        assert len(calls) == 1
+        snapshot = cache.snapshot()
+        assert (snapshot["misses"], snapshot["coalesced"], snapshot["hits"], snapshot["inflight"]) == (1, 4, 1, 0)
+
+    asyncio.run(scenario())
+
+
+def test_failed_fetch_reaches_followers_and_is_not_cached():
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def answering():
+        return "reply"
+
+    async def scenario():
+        cache = ResponseCache(disk_path="", channels="*")
+        results = await asyncio.gather(*(cache.get_or_fetch("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(calls) == 1
+        assert await cache.get_or_fetch("k", answering) == "reply"
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "responses.db")
+
+    async def fetch():
+        return "reply"
+
+    async def unexpected():
+        pytest.fail("should have come from disk")
+
+    async def scenario():
+        await ResponseCache(disk_path=path, channels="*").get_or_fetch("k", fetch)
+        cache = ResponseCache(disk_path=path, channels="*")
+        assert await cache.get_or_fetch("k", unexpected) == "reply"
+        assert cache.stats["disk_hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_honours_ttl(tmp_path):
+    path = str(tmp_path / "responses.db")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return "reply"
+
+    async def scenario():
+        await ResponseCache(ttl=-1, disk_path=path, channels="*").get_or_fetch("k", fetch)
+        await ResponseCache(disk_path=path, channels="*").get_or_fetch("k", fetch)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def scenario():
+        cache = ResponseCache(disk_path="", channels="*")
+        leader = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_fetch("k", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "reply"
+        assert len(calls) == 1 and cache._inflight == {}
+        assert await cache.get_or_fetch("k", fetch) == "reply"
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+from flazu.fences import CodeBlock, FenceParser, Prose, extract_code_blocks, fence_line
+
+
+def texts(reply):
+    text, files = extract_code_blocks(reply)
+    return text, [(name, body.getvalue().decode()) for name, body in files]
+
+
+def render(segments):
+    return "".join(s.text if isinstance(s, Prose) else f"<{s.lang}:{s.code}>" for s in segments)
+
+
+def test_fenced_blocks_become_attachments():
+    assert texts("Here:\n```python\nprint(1)\n```\nThat prints 1.") == (
+        "Here:\nThat prints 1.", [("code.py", "print(1)")])
+
+
+def test_inline_triple_backticks_stay_prose():
+    for reply in ("Use ```pip install x``` to install.\nThen run it.\n\nBye",
+                  "Sure.\n```ls -la``` lists files; ```pwd``` prints the directory.\nDone."):
+        assert texts(reply) == (reply, [])
+
+
+def test_four_backtick_fence_wraps_markdown():
+    reply = "Readme:\n````markdown\n# Title\n```py\nx = 1\n```\n````\nDone."
+    assert texts(reply) == ("Readme:\nDone.", [("code.md", "# Title\n```py\nx = 1\n```")])
+
+
+def test_indented_fences_are_dedented():
+    reply = "1. Install:\n   ```bash\n   pip install x\n     --upgrade\n   ```\n2. Run it."
+    assert texts(reply) == ("1. Install:\n2. Run it.", [("code.sh", "pip install x\n  --upgrade")])
+
+
+def test_unterminated_block_is_kept():
+    assert texts("Start:\n```js\nlet a = 1;") == ("Start:", [("code.js", "let a = 1;")])
+
+
+def test_fence_lines():
+    assert fence_line("```py") == ("```", "py")
+    assert fence_line("  ````  ") == ("````", "")
+    assert fence_line("```pip install x```") is None
+    assert fence_line("```" + "x" * 100) is None
+
+
+def test_streamed_deltas_match_whole_reply():
+    reply = ("Intro\n```py\nprint(1)\n```\nmid ```inline``` end\n````md\n```\nin\n```\n````\n"
+             "  ```sh\n  a\n  ```\nTail words here")
+    parser = FenceParser()
+    whole = render(parser.feed(reply) + parser.close())
+    assert whole == "Intro\n<py:print(1)>mid ```inline``` end\n<md:```\nin\n```><sh:a>Tail words here"
+    for step in (1, 2, 3, 7, 24):
+        parser = FenceParser()
+        segments = []
+        for i in range(0, len(reply), step):
+            segments += parser.feed(reply[i:i + step])
+        assert render(segments + parser.close()) == whole
+
+
+def test_prose_is_not_held_back_while_streaming():
+    parser = FenceParser()
+    assert render(parser.feed("Hello wor")) == "Hello wor"
+    assert render(parser.feed("ld\n``")) == "ld\n"
+    assert parser.feed("`py\nx") == []
+    assert [type(s) for s in parser.feed("\n```\nok")] == [CodeBlock, Prose]
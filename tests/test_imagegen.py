@@ -0,0 +1,33 @@
+import asyncio
+import base64
+
+from flazu import client
+from flazu.blobs import BlobStore
+from flazu.imagegen import ImageGenerator
+from flazu.resilience import Upstream
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def test_cache_key_keeps_case_and_ignores_spacing(monkeypatch, tmp_path):
+    prompts = []
+
+    async def generate(url, data, headers=None, timeout=None):
+        prompts.append(data["prompt"])
+        await asyncio.sleep(0.01)
+        return {"data": [{"b64_json": base64.b64encode(PNG + data["prompt"].encode()).decode()}] * data["n"]}
+
+    monkeypatch.setattr(client, "post_json", generate)
+
+    async def scenario():
+        images = ImageGenerator("http://flazu.test/v1/images/generations", "key",
+                                Upstream("http://flazu.test/v1", fallback_model=""), BlobStore(root=str(tmp_path)))
+        lower, upper = await asyncio.gather(images.generate("a sign that says hi"),
+                                            images.generate("a sign that says HI"))
+        assert prompts == ["a sign that says hi", "a sign that says HI"]
+        assert lower.fresh and upper.fresh and lower.refs[0].sha256 != upper.refs[0].sha256
+        again = await images.generate("a  sign that says\nhi")
+        assert not again.fresh and again.refs == lower.refs
+        images.close()
+
+    asyncio.run(scenario())
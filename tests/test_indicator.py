@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+from flazu.indicator import TypingManager
+
+
+class FlakyChannel:
+    id = 5
+
+    def __init__(self):
+        self.calls = 0
+
+    async def typing(self):
+        self.calls += 1
+        if self.calls == 1:
+            raise discord.HTTPException(SimpleNamespace(status=500, reason="Server Error"), "boom")
+
+
+def test_typing_restarts_after_an_error():
+    async def scenario():
+        manager = TypingManager(refresh=60)
+        channel = FlakyChannel()
+        async with manager.typing(channel):
+            await asyncio.sleep(0.01)
+            assert channel.calls == 1
+            # A second request on the channel brings the indicator back
+            async with manager.typing(channel):
+                await asyncio.sleep(0.01)
+                assert channel.calls == 2
+        assert manager._tasks == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+import asyncio
+
+from flazu import client
+from flazu.blobs import BlobStore
+from flazu.ingest import ImageIngestor
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def test_cancelled_leader_does_not_cancel_followers(monkeypatch, tmp_path):
+    fetches = []
+
+    async def slow_fetch(url, max_bytes, timeout=None):
+        fetches.append(url)
+        await asyncio.sleep(0.05)
+        return PNG, None
+
+    monkeypatch.setattr(client, "get_bytes_capped", slow_fetch)
+
+    async def scenario():
+        ingestor = ImageIngestor(BlobStore(root=str(tmp_path)))
+        source = (("url", "http://img.test/a.png"), "http://img.test/a.png", None)
+        leader = asyncio.create_task(ingestor._get(*source))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(ingestor._get(*source))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        ref, fetched, _ = await follower
+        assert ref.mime == "image/png" and fetched == len(PNG)
+        assert fetches == ["http://img.test/a.png"]
+        assert ingestor._inflight == {}
+        assert (await ingestor._get(*source))[1:] == (0, 0)  # Cached by the shared fetch
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import random
+
+from flazu.fences import extract_code_blocks
+from flazu.outbox import DISCORD_LIMIT, plan, split_message
+
+
+def check(text, limit=DISCORD_LIMIT):
+    chunks = split_message(text, limit)
+    assert all(len(chunk) <= limit for chunk in chunks), [len(c) for c in chunks if len(c) > limit]
+    return chunks
+
+
+def test_short_text_is_one_chunk():
+    assert split_message("hello") == ["hello"]
+    assert split_message("") == []
+
+
+def test_splits_at_paragraphs():
+    text = "\n\n".join(f"paragraph {i} " + "word " * 150 for i in range(6))
+    chunks = check(text)
+    assert len(chunks) == 3
+    assert all(chunk.startswith("paragraph") for chunk in chunks)
+
+
+def test_code_blocks_are_closed_and_reopened():
+    code = "\n".join(f"print({i})  # line {i}" for i in range(200))
+    chunks = check(f"Here:\n```python\n{code}\n```\nDone.")
+    assert len(chunks) > 1
+    assert chunks[1].startswith("```python\n")
+    assert all(chunk.count("```") % 2 == 0 for chunk in chunks)
+    rejoined = "\n".join(extract_code_blocks(chunk)[1][0][1].getvalue().decode() for chunk in chunks)
+    assert rejoined == code
+
+
+def test_long_line_starting_with_backticks_is_not_a_fence():
+    text = "Here you go:\n```" + "a b " * 600
+    chunks = check(text)
+    assert len(chunks) <= 3
+    assert "".join(chunks).replace(" ", "") == text.replace(" ", "").replace("\n", "")
+
+
+def test_long_unbroken_line_after_backticks_is_hard_split():
+    text = "Intro\n\n```" + "x" * 2100
+    chunks = check(text)
+    assert len(chunks) == 3
+    assert "".join(chunks) == text.replace("\n", "")
+
+
+def test_longer_fence_opened_mid_window_still_fits():
+    text = "intro " * 300 + "\n``````````md\n" + "\n".join("row " * 20 for _ in range(60))
+    check(text)
+
+
+def test_every_chunk_fits_the_limit():
+    rng = random.Random(19)
+    pieces = ["word ", "\n", "\n\n", "```", "```py\n", "````\n", "\n```\n", "x" * 300, "`", "  ```js\n"]
+    for _ in range(300):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 400)))
+        for limit in (60, 500, DISCORD_LIMIT):
+            chunks = check(text, limit)
+            assert sum(len(c) for c in chunks) < 3 * len(text) + 100
+
+
+def test_plan_puts_files_on_the_last_chunk():
+    parts = plan("a " * 1500, files=list(range(12)))
+    assert [len(files) for _, files in parts] == [0, 10, 2]
+    assert parts[-1][0] is None
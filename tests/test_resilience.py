@@ -0,0 +1,32 @@
+import asyncio
+
+from flazu.resilience import Upstream
+
+
+def test_cancelled_half_open_probe_releases_breaker():
+    async def scenario():
+        upstream = Upstream("http://flazu.test/v1", fallback_model="")
+        breaker = upstream.breaker("m")
+        breaker.failures = 1
+        breaker.reset_after = 0
+        breaker.record_failure()
+        assert breaker.state == "half-open"
+
+        async def hang(model):
+            await asyncio.sleep(60)
+
+        probe = asyncio.create_task(upstream.call("m", hang))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+
+        async def healthy(model):
+            return "ok"
+
+        assert await upstream.call("m", healthy) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from flazu import config
+from flazu.resilience import Upstream
+from flazu.router import ModelRouter, _parse_groups
+
+GROUP = ["gpt-5", "gpt-4o"]
+
+
+def router(hedge_delay=0.0):
+    return ModelRouter(Upstream("http://flazu.test/v1", fallback_model=""), {m: GROUP for m in GROUP}, hedge_delay)
+
+
+def warm(r, model, latency, n=None, ok=True):
+    for _ in range(n or config.ROUTER_MIN_SAMPLES):
+        r._stats(model).record(latency if ok else None, ok=ok)
+
+
+def test_parse_groups_skips_singletons():
+    groups = _parse_groups("gpt-5, gpt-4o ;solo; a,b,c")
+    assert groups["gpt-4o"] == ["gpt-5", "gpt-4o"] and groups["c"] == ["a", "b", "c"]
+    assert "solo" not in groups
+
+
+def test_rank_prefers_fast_healthy_members():
+    r = router()
+    assert r.rank("gpt-4o") == ["gpt-4o", "gpt-5"]  # No data yet: the requested model wins
+    assert r.rank("o3") == ["o3"]
+    warm(r, "gpt-5", 0.5)
+    warm(r, "gpt-4o", 2.0)
+    assert r.rank("gpt-4o") == ["gpt-5", "gpt-4o"]
+    warm(r, "gpt-5", None, n=config.ROUTER_WINDOW, ok=False)
+    assert r.rank("gpt-5") == ["gpt-4o", "gpt-5"]
+
+
+def test_open_breaker_ranks_last():
+    r = router()
+    warm(r, "gpt-5", 0.1)
+    warm(r, "gpt-4o", 5.0)
+    breaker = r.upstream.breaker("gpt-5")
+    for _ in range(breaker.failures):
+        breaker.record_failure()
+    assert r.rank("gpt-5") == ["gpt-4o", "gpt-5"]
+
+
+def test_call_records_outcomes():
+    async def attempt(model, claim):
+        if model == "gpt-5":
+            raise ValueError("bad request")
+        return model
+
+    async def scenario():
+        r = router()
+        assert await r.call("gpt-4o", attempt) == "gpt-4o"
+        with pytest.raises(ValueError):
+            await r.call("gpt-5", attempt)
+        snapshot = r.snapshot()
+        assert snapshot["gpt-4o"]["samples"] == 1 and snapshot["gpt-4o"]["errors"] == 0
+        assert snapshot["gpt-5"]["samples"] == 0 and snapshot["gpt-5"]["errors"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_hedge_wins_when_primary_stalls():
+    started = []
+
+    async def attempt(model, claim):
+        started.append(model)
+        await asyncio.sleep(1 if model == "gpt-5" else 0.01)
+        claim()
+        return model
+
+    async def scenario():
+        r = router(hedge_delay=0.02)
+        assert await asyncio.wait_for(r.call("gpt-5", attempt), 0.5) == "gpt-4o"
+        assert started == ["gpt-5", "gpt-4o"]
+        assert r.stats["gpt-4o"].hedge_wins == 1
+        assert list(r.stats["gpt-5"].latencies)[0] >= 0.02  # The loser's censored latency still counts
+        assert r.upstream.breaker("gpt-5").state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_once_primary_answers():
+    started = []
+
+    async def attempt(model, claim):
+        started.append(model)
+        claim()
+        await asyncio.sleep(0.05)
+        return model
+
+    async def scenario():
+        r = router(hedge_delay=0.01)
+        assert await r.call("gpt-5", attempt) == "gpt-5"
+        assert started == ["gpt-5"]
+
+    asyncio.run(scenario())
+
+
+def test_only_one_racer_streams():
+    written = []
+
+    async def attempt(model, claim):
+        await asyncio.sleep(0.03 if model == "gpt-5" else 0.04)
+        for piece in ("a", "b"):
+            if claim():
+                written.append((model, piece))
+            await asyncio.sleep(0.01)
+        return model
+
+    async def scenario():
+        r = router(hedge_delay=0.02)
+        winner = await r.call("gpt-5", attempt)
+        assert {model for model, _ in written} == {winner}
+        assert [piece for _, piece in written] == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_hedge_raises_when_both_fail():
+    async def attempt(model, claim):
+        await asyncio.sleep(0.03)
+        raise ValueError(model)
+
+    async def scenario():
+        r = router(hedge_delay=0.01)
+        with pytest.raises(ValueError):
+            await r.call("gpt-5", attempt)
+        assert r.stats["gpt-5"].error_rate == r.stats["gpt-4o"].error_rate == 1.0
+
+    asyncio.run(scenario())
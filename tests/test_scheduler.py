@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from flazu.scheduler import Overloaded, RequestScheduler
+
+
+def scheduler(**kw):
+    kw.setdefault("max_inflight", 1)
+    kw.setdefault("notify_position", 100)
+    kw.setdefault("max_queue", 100)
+    kw.setdefault("weights", {})
+    return RequestScheduler(**kw)
+
+
+async def run(sched, order, user_id, guild_id=None, hold=0.005):
+    async with sched.slot(user_id, guild_id):
+        order.append(user_id)
+        await asyncio.sleep(hold)
+
+
+def test_one_request_per_user_at_a_time():
+    async def scenario():
+        sched = scheduler(max_inflight=4)
+        active, peak = set(), []
+
+        async def job(user_id):
+            async with sched.slot(user_id):
+                assert user_id not in active
+                active.add(user_id)
+                peak.append(len(active))
+                await asyncio.sleep(0.005)
+                active.discard(user_id)
+
+        await asyncio.gather(*(job(u) for u in (1, 1, 1, 2, 2)))
+        assert max(peak) == 2
+        assert sched.snapshot()["completed"] == 5
+
+    asyncio.run(scenario())
+
+
+def test_spammy_user_does_not_starve_others():
+    async def scenario():
+        sched = scheduler()
+        order = []
+        tasks = [asyncio.create_task(run(sched, order, 1)) for _ in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(run(sched, order, 2)))
+        await asyncio.gather(*tasks)
+        assert order.index(2) <= 2
+
+    asyncio.run(scenario())
+
+
+def test_guilds_share_fairly():
+    async def scenario():
+        sched = scheduler()
+        order = []
+        # Four users in guild 10 against one user in guild 20
+        tasks = [asyncio.create_task(run(sched, order, u, guild_id=10)) for u in (1, 2, 3, 4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(run(sched, order, 5, guild_id=20)))
+        await asyncio.gather(*tasks)
+        assert order.index(5) <= 2
+
+    asyncio.run(scenario())
+
+
+def test_sheds_past_max_queue():
+    async def scenario():
+        sched = scheduler(max_queue=2)
+        order = []
+        held = asyncio.create_task(run(sched, order, 1, hold=0.02))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(run(sched, order, u)) for u in (2, 3)]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            async with sched.slot(4):
+                pass
+        await asyncio.gather(held, *waiting)
+        assert order == [1, 2, 3]
+        assert sched.stats["shed"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_position_notice():
+    async def scenario():
+        sched = scheduler(notify_position=2)
+        order, notices = [], []
+
+        async def on_queued(position):
+            notices.append(position)
+
+        async def job(user_id):
+            async with sched.slot(user_id, on_queued=on_queued):
+                order.append(user_id)
+                await asyncio.sleep(0.005)
+
+        await asyncio.gather(*(job(u) for u in (1, 2, 3)))
+        assert notices == [2]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_frees_its_place():
+    async def scenario():
+        sched = scheduler()
+        order = []
+        held = asyncio.create_task(run(sched, order, 1, hold=0.02))
+        await asyncio.sleep(0)
+        gone = asyncio.create_task(run(sched, order, 2))
+        after = asyncio.create_task(run(sched, order, 2))
+        other = asyncio.create_task(run(sched, order, 3))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.gather(held, after, other)
+        assert sorted(order) == [1, 2, 3]
+        assert sched.snapshot()["depth"] == 0 and sched.snapshot()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_holder_releases_its_slot():
+    async def scenario():
+        sched = scheduler()
+        order = []
+        held = asyncio.create_task(run(sched, order, 1, hold=1))
+        await asyncio.sleep(0.005)
+        held.cancel()
+        await asyncio.wait_for(run(sched, order, 2), 1)
+        assert order == [1, 2] and sched.snapshot()["inflight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from flazu.messages import Message
+from flazu.store import ConversationStore
+
+
+def texts(entry):
+    return [m.text() for m in entry["history"]]
+
+
+def test_queued_operations_apply_in_order(tmp_path):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    store.append(1, Message("user", "a"), Message("assistant", "b"))
+    store.append(1, Message("user", "c"))
+    store.set_meta(1, model="gpt-5")
+    store.trim(1, 2)
+    assert store.flush() == 4
+    entry = store.load(1)
+    assert texts(entry) == ["b", "c"] and entry["model"] == "gpt-5"
+    store.replace(1, [Message("system", "summary")])
+    store.append(1, Message("user", "d"))
+    assert texts(store.load(1)) == ["summary", "d"]  # load flushes the user's queued writes first
+    store.delete(1)
+    store.flush()
+    assert store.load(1) is None
+    store.close()
+
+
+def test_writes_survive_reopening(tmp_path):
+    path = str(tmp_path / "memory.db")
+    store = ConversationStore(path)
+    store.append(7, Message("user", "hello"))
+    store.close()
+    reopened = ConversationStore(path)
+    assert texts(reopened.load(7)) == ["hello"]
+    reopened.close()
+
+
+def test_other_process_writes_are_noticed(tmp_path):
+    path = str(tmp_path / "memory.db")
+    mine, theirs = ConversationStore(path), ConversationStore(path)
+    mine.append(3, Message("user", "x"))
+    mine.flush()
+    assert not mine.changed_elsewhere(3)
+    theirs.append(3, Message("user", "y"))
+    theirs.flush()
+    assert mine.changed_elsewhere(3)
+    mine.close()
+    theirs.close()
+
+
+class SlowFirstLock:
+    """A lock whose first acquirer stalls before taking it, like a flusher thread losing the CPU."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stalled = False
+
+    def __enter__(self):
+        if not self._stalled:
+            self._stalled = True
+            time.sleep(0.2)
+        self._lock.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def test_concurrent_flushes_keep_queue_order(tmp_path):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    store._db_lock = SlowFirstLock()
+    store.append(1, Message("user", "before reset"))
+    background = threading.Thread(target=store.flush)
+    background.start()
+    time.sleep(0.05)
+    store.delete(1)  # /reset while the background flush is in progress
+    store.flush()
+    background.join()
+    assert store.load(1) is None
+    store.close()
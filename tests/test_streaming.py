@@ -0,0 +1,36 @@
+import asyncio
+
+from flazu import metrics
+from flazu.streaming import LiveReply
+
+
+class Sent:
+    def __init__(self, content):
+        self.content = content
+
+    async def edit(self, content=None, attachments=None):
+        self.content = content
+
+
+def test_first_token_goes_to_metrics_not_the_log(capsys):
+    async def scenario():
+        sent = []
+
+        async def send(content=None, files=None):
+            sent.append(Sent(content))
+            return sent[-1]
+
+        reply = LiveReply(send, "<@1>", interval=0.01)
+        reply.start()
+        reply.update("Hel")
+        reply.update("Hello")
+        await asyncio.sleep(0.03)
+        await reply.finish("Hello there")
+        return sent
+
+    key = ("flazu_stage_seconds", (("stage", "first_token"),))
+    before = metrics._histograms[key].count if key in metrics._histograms else 0
+    sent = asyncio.run(scenario())
+    assert metrics._histograms[key].count == before + 1
+    assert [m.content for m in sent] == ["Hello there"]
+    assert "First token" not in capsys.readouterr().out
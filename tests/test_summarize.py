@@ -0,0 +1,62 @@
+import asyncio
+
+from flazu import client, config
+from flazu.messages import Message
+from flazu.resilience import Upstream
+from flazu.store import ConversationStore
+from flazu.summarize import Summarizer
+from flazu.tokens import ContextBudget
+from flazu.usage import UsageMeter
+
+
+def test_failed_summarization_backs_off(monkeypatch):
+    calls = []
+
+    async def failing(url, data, headers=None, timeout=None):
+        calls.append(data["model"])
+        raise client.RequestError("upstream down")
+
+    monkeypatch.setattr(client, "post_json", failing)
+    monkeypatch.setattr(config, "RETRY_ATTEMPTS", 0)
+
+    async def scenario():
+        entry = {"history": [Message("user", f"message {i}") for i in range(60)]}
+        upstream = Upstream("http://flazu.test/v1", fallback_model="")
+        summarizer = Summarizer(None, ContextBudget(), lambda uid: entry, "http://flazu.test/v1", "key", upstream)
+        for _ in range(3):
+            summarizer.maybe_schedule(1, entry, "gpt-5")
+            await asyncio.sleep(0.01)
+        assert len(calls) == 1
+        assert summarizer._failures[1][0] == 1
+        assert config.SUMMARY_MODEL in upstream.breakers  # Went through the shared upstream
+        summarizer.forget(1)
+        summarizer.maybe_schedule(1, entry, "gpt-5")
+        await asyncio.sleep(0.01)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_summary_tokens_are_metered(monkeypatch, tmp_path):
+    async def answering(url, data, headers=None, timeout=None):
+        return {"choices": [{"message": {"content": "short summary"}}],
+                "usage": {"prompt_tokens": 900, "completion_tokens": 40}}
+
+    monkeypatch.setattr(client, "post_json", answering)
+
+    async def scenario():
+        entry = {"history": [Message("user", f"message {i}") for i in range(60)]}
+        store = ConversationStore(str(tmp_path / "memory.db"))
+        meter = UsageMeter(str(tmp_path / "usage.db"))
+        upstream = Upstream("http://flazu.test/v1", fallback_model="")
+        summarizer = Summarizer(store, ContextBudget(), lambda uid: entry, "http://flazu.test/v1", "key", upstream, meter)
+        summarizer.maybe_schedule(1, entry, "gpt-5", guild_id=9)
+        await asyncio.sleep(0.01)
+        assert len(entry["history"]) == config.SUMMARY_KEEP_MESSAGES + 1
+        for scope, key in (("user", 1), ("guild", 9), ("model", config.SUMMARY_MODEL)):
+            totals = meter.totals(scope, key)
+            assert (totals["prompt_tokens"], totals["completion_tokens"]) == (900, 40)
+        meter.close()
+        store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from flazu.messages import Message
+from flazu.usage import HOUR, QuotaExceeded, UsageMeter, counts
+
+
+def meter(path, **kwargs):
+    return UsageMeter(str(path), limits={"user": (1000, 0), "guild": (0, 0)}, overrides={}, prices={}, **kwargs)
+
+
+def test_sharded_quota_counts_every_process(tmp_path):
+    path = tmp_path / "memory.db"
+    first, second = meter(path, shared=True), meter(path, shared=True)
+    first.load()
+    second.load()
+    first.record(1, 9, "gpt-5", 400, 200)
+    second.check(1, 9)
+    first.flush()
+    second.flush()  # Nothing of its own to write, but re-reads the window
+    second.record(1, 9, "gpt-5", 300, 100)
+    with pytest.raises(QuotaExceeded):
+        second.check(1, 9)  # 600 stored by the other process + 400 not yet flushed here
+    assert "0 of 1.0k tokens left" in second.report(1)
+    first.close()
+    second.close()
+
+
+def test_unshared_quota_is_per_process(tmp_path):
+    path = tmp_path / "memory.db"
+    first, second = meter(path), meter(path)
+    first.record(1, None, "gpt-5", 900, 200)
+    first.flush()
+    second.check(1)
+    with pytest.raises(QuotaExceeded):
+        first.check(1)
+    first.close()
+    second.close()
+
+
+def test_record_counts_user_guild_and_model(tmp_path):
+    usage = UsageMeter(str(tmp_path / "memory.db"), limits={}, overrides={},
+                       prices={"gpt-5": (2.0, 8.0), "gpt-image-1": (0.04,)})
+    usage.record(1, 9, "gpt-5", 1_000_000, 500_000, latency=2.0)
+    usage.record(1, None, "gpt-image-1", images=2, latency=4.0)
+    user = usage.totals("user", 1)
+    assert (user["requests"], user["prompt_tokens"], user["images"]) == (2, 1_000_000, 2)
+    assert user["cost"] == pytest.approx(6.08)
+    assert usage.totals("guild", 9)["requests"] == 1
+    assert usage.totals("model", "gpt-image-1", span=HOUR)["images"] == 2
+    assert "2 requests, 1.5M tokens (1.0M in / 500.0k out), 2 images, avg 3.0s, ~$6.08" in usage.report(1)
+    assert [key for key, _ in usage.top("user")] == ["1"]
+    usage.close()
+
+
+def test_flush_coalesces_and_load_restores(tmp_path):
+    path = str(tmp_path / "memory.db")
+    usage = UsageMeter(path, limits={}, overrides={}, prices={})
+    for _ in range(10):
+        usage.record(1, 9, "gpt-5", 100, 10)
+    assert usage.flush() == 6  # One hourly and one total row for each of the three accounts
+    assert usage.flush() == 0
+    usage.record(1, 9, "gpt-5", 100, 10)
+    usage.close()
+    restarted = UsageMeter(path, limits={}, overrides={}, prices={})
+    restarted.load()
+    for span in (None, HOUR):
+        totals = restarted.totals("user", 1, span)
+        assert (totals["requests"], totals["prompt_tokens"]) == (11, 1100)
+    restarted.close()
+
+
+def test_quota_retry_after_follows_the_window(monkeypatch, tmp_path):
+    start = 1000 * HOUR + 600
+    now = [start]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    usage = UsageMeter(str(tmp_path / "memory.db"), window=2 * HOUR, limits={"user": (1000, 0)},
+                       overrides={7: 0}, prices={})
+    usage.record(1, None, "gpt-5", 600, 0)
+    now[0] += HOUR
+    usage.record(1, None, "gpt-5", 600, 0)
+    with pytest.raises(QuotaExceeded) as denied:
+        usage.check(1)
+    # Dropping the first hour's 600 tokens is enough, and that happens when the window moves past it
+    assert denied.value.retry_after == (1000 + 2) * HOUR - now[0]
+    assert "try again in 50m" in str(denied.value)
+    now[0] = (1000 + 2) * HOUR
+    usage.check(1)
+    usage.record(7, None, "gpt-5", 5000, 0)
+    usage.check(7)  # Overridden to unlimited
+    assert usage.quota("user", 7) is None
+    usage.close()
+
+
+def test_image_quota_counts_the_request(tmp_path):
+    usage = UsageMeter(str(tmp_path / "memory.db"), limits={"user": (0, 3), "guild": (0, 0)}, overrides={}, prices={})
+    usage.record(1, 9, "gpt-image-1", images=2)
+    usage.check(1, 9, images=1)
+    with pytest.raises(QuotaExceeded) as denied:
+        usage.check(1, 9, images=2)
+    assert (denied.value.scope, denied.value.unit) == ("user", "image")
+    usage.check(1, 9)  # Chat requests aren't held back by the image quota
+    assert usage.quota("user", 1) == "1 of 3 images left (rolling 24h)"
+    usage.close()
+
+
+def test_counts_prefers_the_usage_block():
+    assert counts({"prompt_tokens": 12, "completion_tokens": 3}, [], "reply") == (12, 3)
+    prompt, completion = counts(None, [Message("user", "hello there")], "general kenobi")
+    assert prompt > 0 and completion > 0
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+from flazu import config
+from flazu.messages import Message
+from flazu.store import ConversationStore
+from flazu.tokens import ContextBudget
+from flazu.workingset import WorkingSet
+
+
+def test_eviction_drops_token_ledgers(tmp_path):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    budget = ContextBudget()
+    memory = WorkingSet(store, ttl=0, max_bytes=1, on_evict=budget.forget)
+    for uid in range(50):
+        history = [Message("user", f"message {i}") for i in range(20)]
+        memory[uid] = {"history": history}
+        store.replace(uid, history)
+        budget.select(uid, history, "gpt-5")
+    memory.sweep()
+    assert len(memory) == 0
+    assert budget._ledgers == {}
+    store.close()
+
+
+def test_shared_reloads_happen_in_ensure_off_the_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SHARED_STATE_CHECK", 0)
+    path = str(tmp_path / "memory.db")
+    mine, theirs = ConversationStore(path), ConversationStore(path)
+    memory = WorkingSet(mine, shared=True)
+    loop_thread = threading.current_thread()
+    calls = []
+    for name in ("load", "changed_elsewhere"):
+        original = getattr(mine, name)
+
+        def wrapped(user_id, original=original, name=name):
+            calls.append((name, threading.current_thread() is loop_thread))
+            return original(user_id)
+        setattr(mine, name, wrapped)
+
+    async def scenario():
+        theirs.append(1, Message("user", "x"))
+        theirs.flush()
+        await memory.ensure(1)
+        assert [m.text() for m in memory[1]["history"]] == ["x"]
+        theirs.append(1, Message("user", "y"))
+        theirs.flush()
+        assert [m.text() for m in memory[1]["history"]] == ["x"]  # plain lookup, no SQLite
+        await memory.ensure(1)
+        assert [m.text() for m in memory[1]["history"]] == ["x", "y"]
+        assert memory.stats["stale_reloads"] == 1
+
+    asyncio.run(scenario())
+    assert calls and not any(on_loop for _, on_loop in calls)
+    mine.close()
+    theirs.close()